@@ -0,0 +1,20 @@
+import pytest
+
+DEBUG_SETTINGS = {
+    'SSR_NAME': 'ssr', 'SSR_IO': '1', 'SSR_ACTIVE': 'false', 'SSR_CYCLE_TIME': '10',
+    'THERMOMETER_NAME': 'probe', 'THERMOMETER_IO': 'probe', 'THERMOMETER_ACTIVE': 'false',
+    'THERMOMETER_CYCLE_TIME': '10', 'DEBUG_VIRTUAL_CLOCK': 'true'
+}
+
+
+@pytest.fixture
+def debug_settings(monkeypatch, tmp_path):
+    """
+    Environment of a debug worker on a virtual clock, its files in tmp_path.
+    """
+    for key, value in DEBUG_SETTINGS.items():
+        monkeypatch.setenv(key, value)
+    for key in ['PID_PARAMS_FILE', 'PLANT_FILE', 'HISTORY_FILE', 'CHECKPOINT_FILE', 'CONTROLLER', 'ESTIMATOR']:
+        monkeypatch.delenv(key, raising=False)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip('distribrewed_core')
+
+from workers.autotune import DebugAutoTuneWorker  # noqa: E402
+
+
+def test_relay_test_completes(debug_settings, monkeypatch):
+    monkeypatch.setenv('AUTOTUNE_PLANT_FILE', str(debug_settings / 'plant.json'))
+    monkeypatch.setenv('PID_PARAMS_FILE', str(debug_settings / 'pid.json'))
+    worker = DebugAutoTuneWorker()
+    resume = worker._resume_all_devices
+    relays = []
+
+    def resume_all_devices():
+        # The first sample may arrive as soon as the devices run again
+        relays.append(worker.relay)
+        resume()
+
+    worker._resume_all_devices = resume_all_devices
+    try:
+        worker.start_worker('Auto Tune', [['0:00:00', 60.0]])
+        assert worker.finished.wait(60)
+    finally:
+        worker._stop_all_devices()
+    assert relays == [worker.relay]
+    assert worker.relay.setpoint == 60.0
+    assert worker.relay.done()
+    # The relay sampled from the very first temperature of the kettle on
+    assert worker.relay.samples[0][1] == pytest.approx(DebugAutoTuneWorker.DEBUG_INIT_TEMP, abs=0.5)
+    worker.tuning_thread.join(120)
+    assert (debug_settings / 'plant.json').exists()
@@ -0,0 +1,27 @@
+import pytest
+
+pytest.importorskip('distribrewed_core')
+
+from workers.debug_temperature import DebugTemperatureWorker  # noqa: E402
+
+
+def test_plant_keeps_schedule_time(debug_settings):
+    worker = DebugTemperatureWorker()
+    step = worker.plant.step
+    stepped = []
+
+    def plant_step(seconds, dt):
+        stepped.append(dt)
+        return step(seconds, dt)
+
+    worker.plant.step = plant_step
+    try:
+        worker.start_worker('Debug', [['0:10:00', 45.0], ['0:20:00', 45.0]])
+        assert worker.finished.wait(60)
+    finally:
+        worker._stop_all_devices()
+    cycle_time = float(worker.ssr.cycle_time)
+    elapsed = worker.clock.monotonic()
+    # The kettle heated up to 45 C first, then held it for the 30 minutes of the schedule
+    assert elapsed >= worker.timeline.total
+    assert sum(stepped) == pytest.approx(elapsed, abs=2 * cycle_time)
@@ -0,0 +1,31 @@
+import time
+
+from workers.benchmarks.common import fake_w1_slave
+from workers.devices.probe import Probe
+
+
+def test_no_stale_sample_after_pause(tmp_path):
+    path = fake_w1_slave(str(tmp_path), '28-1', 23125)
+    values = []
+    stale = []
+    probe = Probe('probe', path, False, 0.1, values.append)
+    probe.stale_age = 0.3
+    probe.stale_callback = stale.append
+    probe.run_device()
+    try:
+        probe.resume_device()
+        assert probe.wait_until_acknowledged(5)
+        time.sleep(0.5)
+        probe.pause_device()
+        assert probe.wait_until_acknowledged(5)
+        # Paused for longer than stale_age, the sample read before is too old now
+        time.sleep(0.6)
+        fake_w1_slave(str(tmp_path), '28-1', 24000)
+        probe.resume_device()
+        time.sleep(0.5)
+    finally:
+        probe.stop_device()
+        probe.join(5)
+    assert stale == []
+    assert values[0] == 23.125
+    assert values[-1] == 24.0
@@ -0,0 +1,41 @@
+import pytest
+
+from workers.devices.pwm import DeadlinePWM
+from workers.utils.clock import VirtualClock
+
+
+def run_window(pwm, duty, changes):
+    """
+    Runs one window of pwm, writing changes[t] to duty when the clock passes t.
+    """
+    window = pwm.window(lambda: duty[0])
+    for deadline in window:
+        for at in sorted(changes):
+            if pwm.clock.monotonic() < at <= deadline:
+                pwm.clock.advance(at - pwm.clock.monotonic())
+                duty[0] = changes.pop(at)
+                break
+        else:
+            pwm.clock.advance(deadline - pwm.clock.monotonic())
+
+
+def test_constant_duty():
+    switches = []
+    pwm = DeadlinePWM(switches.append, 10.0)
+    pwm.clock = VirtualClock()
+    run_window(pwm, [0.3], {})
+    assert switches == [True, False]
+    assert pwm.achieved_duty == pytest.approx(0.3)
+    assert pwm.duty_error == pytest.approx(0.0)
+
+
+def test_duty_change_mid_window():
+    switches = []
+    pwm = DeadlinePWM(switches.append, 10.0)
+    pwm.clock = VirtualClock()
+    # On at 0.8 for the first 5 s, then 0.2 cuts the on phase short right away
+    run_window(pwm, [0.8], {5.0: 0.2})
+    assert switches == [True, False]
+    assert pwm.on_time == pytest.approx(5.0)
+    assert pwm.requested_on_time == pytest.approx(0.8 * 5.0 + 0.2 * 5.0)
+    assert pwm.duty_error == pytest.approx(0.0)
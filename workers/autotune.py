@@ -0,0 +1,85 @@
+import json
+import logging
+import threading
+
+from workers.debug_temperature import DebugTemperatureWorker
+from workers.temperature import TemperatureWorker
+from workers.utils.tuning import RelayTest, tune
+
+log = logging.getLogger(__name__)
+
+
+class AutoTuneWorker(TemperatureWorker):
+    """
+    Runs a relay test around the temperature of the first schedule step instead of the PID. When
+    the oscillation is measured the worker finishes, writes the identified plant to
+    AUTOTUNE_PLANT_FILE and searches the PID gains on the simulated plant in a process pool. The
+    result goes to PID_PARAMS_FILE, which a TemperatureWorker loads on its next start.
+    """
+    AUTOTUNE_PLANT_FILE = "AUTOTUNE_PLANT_FILE"
+    AUTOTUNE_HYSTERESIS = "AUTOTUNE_HYSTERESIS"
+    AUTOTUNE_CYCLES = "AUTOTUNE_CYCLES"
+    AUTOTUNE_LITERS = "AUTOTUNE_LITERS"
+    AUTOTUNE_PROCESSES = "AUTOTUNE_PROCESSES"
+
+    def __init__(self):
+        super(AutoTuneWorker, self).__init__()
+        self.relay = None
+        self.tuning_thread = None
+
+    def _open_checkpoint(self):
+        return None  # A relay test is not resumed, it starts over
+
+    def _setup_worker_schedule(self, worker_schedule):
+        # A new test for every schedule, ready before the devices are resumed and sample into it
+        self.relay = RelayTest(
+            self._compile_schedule(worker_schedule).steps[0].set_point(0.0),
+            hysteresis=float(self._setting(self.AUTOTUNE_HYSTERESIS, 0.5)),
+            cycles=int(self._setting(self.AUTOTUNE_CYCLES, 3)))
+        super(AutoTuneWorker, self)._setup_worker_schedule(worker_schedule)
+
+    def _calculate_pid(self, measured_value):
+        return self.relay.output(self.clock.monotonic(), measured_value)
+
+    def _is_done(self):
+        return self.relay is not None and self.relay.done()
+
+    def stop_worker(self):
+        result = super(AutoTuneWorker, self).stop_worker()
+        if self._is_done() and self.tuning_thread is None:
+            self.tuning_thread = threading.Thread(target=self._tune, name='{0} tuning'.format(self.name))
+            self.tuning_thread.start()
+        return result
+
+    def _tune(self):
+        try:
+            cycle_time = float(self._get_device(self.ssr_name).cycle_time)
+            identification = self.relay.identify(cycle_time, float(self._setting(self.AUTOTUNE_LITERS, 1.0)))
+            plant_file = self._setting(self.AUTOTUNE_PLANT_FILE, 'plant.json')
+            with open(plant_file, 'w') as fo:
+                json.dump(identification, fo, indent=2, sort_keys=True)
+            log.info('Relay test identified {0}'.format(identification))
+            processes = self._setting(self.AUTOTUNE_PROCESSES)
+            params = tune(identification['plant'], self.relay.setpoint, cycle_time, self.relay.samples[0][1],
+                          self._setting(self.PID_PARAMS_FILE, 'pid.json'), identification['gains'],
+                          int(processes) if processes else None)
+            log.info('Tuned PID parameters {0}'.format(params))
+        except Exception as e:
+            log.error('AutoTuneWorker unable to tune PID parameters: {0}'.format(e))
+
+
+class DebugAutoTuneWorker(AutoTuneWorker, DebugTemperatureWorker):
+    pass
+
+
+if __name__ == "__main__":
+    # Setup debug logging
+    logging.getLogger().setLevel('DEBUG')
+    h = logging.StreamHandler()
+    h.setFormatter(logging.Formatter('%(pathname)s:%(lineno)s: [%(levelname)s] %(message)s'))
+    logging.getLogger().addHandler(h)
+
+    worker = DebugAutoTuneWorker()
+    worker.start_worker('Debug Auto Tune Schedule', [
+        ['0:00:00', 60.0]
+    ])
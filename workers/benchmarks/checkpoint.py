@@ -0,0 +1,81 @@
+#!/usr/bin python
+"""
+Measures what checkpointing the control state of a TemperatureWorker costs: the time save()
+takes on the device thread, the time of a synchronous write (temporary file, fsync, rename,
+directory fsync) as done on a stop, and how many of the saves made every --interval seconds the
+background thread actually wrote.
+
+    python -m workers.benchmarks.checkpoint --saves 1000 --directory /var/lib/distribrewed
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from workers.benchmarks.common import add_output_argument, emit, summarize
+from workers.utils.checkpoint import CheckpointFile, CHECKPOINT_VERSION
+
+SCHEDULE = [['0:30:00', 60.0], ['0:00:00', 66.0, 'ramp', 1.0], ['0:20:00', 66.0], ['0:10:00', 72.0],
+            ['0:00:00', 78.0, 'wait']]
+
+
+def state(index):
+    # Shaped like TemperatureWorker._checkpoint_state()
+    return {
+        'version': CHECKPOINT_VERSION, 'time': time.time(), 'schedule': SCHEDULE, 'working': True,
+        'paused': False, 'step_index': 2, 'gate': 4, 'waiting': False, 'timeline_elapsed': 2400.0 + index,
+        'set_temperature': 66.0, 'start_time': time.time() - 2400.0, 'start_hold_timer': time.time() - 240.0,
+        'pid': {'xk_1': 65.93, 'xk_2': 65.91, 'yk': 23.4, 'rk_1': None}
+    }
+
+
+def run(directory, saves, interval):
+    path = os.path.join(directory, 'bench.checkpoint')
+    checkpoint = CheckpointFile(path)
+    sync = []
+    for index in range(saves):
+        start = time.perf_counter()
+        checkpoint.save(state(index), sync=True)
+        sync.append(time.perf_counter() - start)
+    checkpoint.start()
+    written = checkpoint.written
+    calls = []
+    for index in range(saves):
+        start = time.perf_counter()
+        checkpoint.save(state(index))
+        calls.append(time.perf_counter() - start)
+        time.sleep(interval)
+    time.sleep(0.5)
+    checkpoint.stop()
+    return {
+        'save_us': summarize(calls, 1e6),
+        'sync_write_us': summarize(sync, 1e6),
+        'bytes': os.path.getsize(path),
+        'written': checkpoint.written - written,
+        'saves': saves
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--saves', type=int, default=1000)
+    parser.add_argument('--interval', type=float, default=0.001, help='Seconds between two saves')
+    parser.add_argument('--directory', help='Where to write, i.e. on the SD card (default a temporary directory)')
+    add_output_argument(parser)
+    args = parser.parse_args()
+    directory = args.directory or tempfile.mkdtemp()
+    try:
+        results = run(directory, args.saves, args.interval)
+    finally:
+        if args.directory:
+            for name in ['bench.checkpoint', 'bench.checkpoint.tmp']:
+                if os.path.exists(os.path.join(directory, name)):
+                    os.remove(os.path.join(directory, name))
+        else:
+            shutil.rmtree(directory)
+    emit('checkpoint', results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin python
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+W1_SLAVE_TEMPLATE = '72 01 4b 46 7f ff 0e 10 57 : crc=57 YES\n72 01 4b 46 7f ff 0e 10 57 t={0}\n'
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = int(math.ceil(fraction * len(ordered))) - 1
+    return ordered[min(max(index, 0), len(ordered) - 1)]
+
+
+def summarize(values, scale=1.0):
+    """
+    Reduces a list of samples to count/mean/p50/p99/max, multiplied by scale (i.e. 1e6 for microseconds).
+    """
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': scale * sum(values) / len(values),
+        'p50': scale * percentile(values, 0.50),
+        'p99': scale * percentile(values, 0.99),
+        'max': scale * max(values)
+    }
+
+
+def add_output_argument(parser):
+    parser.add_argument('--output', help='Also save the results as JSON to this file, for workers.benchmarks.compare')
+
+
+def emit(benchmark, results, output=None, stream=sys.stdout):
+    """
+    Writes the results as JSON to stream and, with output, saves them together with the time and
+    the machine they were taken on.
+    """
+    stream.write(json.dumps({'benchmark': benchmark, 'results': results}, indent=2, sort_keys=True))
+    stream.write('\n')
+    if output:
+        record = {
+            'benchmark': benchmark,
+            'results': results,
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'node': platform.node(),
+            'argv': sys.argv[1:]
+        }
+        with open(output, 'w') as fo:
+            json.dump(record, fo, indent=2, sort_keys=True)
+            fo.write('\n')
+
+
+def load(path):
+    with open(path) as fo:
+        return json.load(fo)
+
+
+def fake_w1_slave(root, slave_id, millidegrees):
+    """
+    Creates (or updates) root/slave_id/w1_slave the way the w1_therm driver formats it.
+    :return: Path to the w1_slave file.
+    """
+    directory = os.path.join(root, slave_id)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, 'w1_slave')
+    with open(path, 'w') as fo:
+        fo.write(W1_SLAVE_TEMPLATE.format(int(millidegrees)))
+    return path
+
+
+def fake_gpio_value(root, pin):
+    """
+    Creates root/gpio<pin>/value, initially off.
+    :return: Path to the value file.
+    """
+    directory = os.path.join(root, 'gpio{0}'.format(pin))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, 'value')
+    with open(path, 'w') as fo:
+        fo.write('0')
+    return path
@@ -0,0 +1,59 @@
+#!/usr/bin python
+"""
+Compares two benchmark results saved with --output, printing every number that changed by more
+than the threshold.
+
+    python -m workers.benchmarks.compare baseline.json control.json --threshold 10
+"""
+import argparse
+import sys
+
+from workers.benchmarks.common import load
+
+
+def flatten(results, prefix=''):
+    """
+    :return: Dict of "path/to/value" to every number in the nested results.
+    """
+    values = {}
+    for key, value in results.items():
+        path = prefix + str(key)
+        if isinstance(value, dict):
+            values.update(flatten(value, path + '/'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = float(value)
+    return values
+
+
+def compare(baseline, current, threshold):
+    """
+    :return: List of (path, baseline, current, change in percent) that moved more than threshold percent.
+    """
+    old = flatten(baseline['results'])
+    new = flatten(current['results'])
+    changes = []
+    for path in sorted(set(old) & set(new)):
+        if old[path] == 0.0:
+            continue
+        change = 100.0 * (new[path] - old[path]) / abs(old[path])
+        if abs(change) >= threshold:
+            changes.append((path, old[path], new[path], change))
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Percent change to report')
+    args = parser.parse_args()
+    baseline = load(args.baseline)
+    current = load(args.current)
+    if baseline.get('benchmark') != current.get('benchmark'):
+        sys.exit('Can not compare {0} with {1}'.format(baseline.get('benchmark'), current.get('benchmark')))
+    for path, old, new, change in compare(baseline, current, args.threshold):
+        print('{0:60} {1:>14.3f} {2:>14.3f} {3:>+8.1f}%'.format(path, old, new, change))
+
+
+if __name__ == "__main__":
+    main()
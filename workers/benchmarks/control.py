@@ -0,0 +1,158 @@
+#!/usr/bin python
+"""
+Measures the control path of a TemperatureWorker on real Probe and SSR devices over a fake sysfs
+tree: per sample callback latency (probe read, _temperature_callback, PID, SSR.write), PID
+evaluations per second, the cost of building and sending one measurement, and how long pausing
+and resuming 1, 10 and 100 devices takes.
+
+    python -m workers.benchmarks.control --samples 10000 --output control.json
+
+Compare two saved runs with python -m workers.benchmarks.compare old.json new.json.
+"""
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from workers.benchmarks.common import add_output_argument, emit, fake_gpio_value, fake_w1_slave, summarize
+from workers.devices.probe import Probe
+from workers.devices.runtime import DeviceRuntime
+from workers.utils.pid import PID
+
+SETPOINT = 66.0
+CYCLE_TIME = 10
+
+
+def pid_throughput(evaluations):
+    pid = PID(None, SETPOINT, CYCLE_TIME)
+    temperature = 20.0
+    start = time.perf_counter()
+    for i in range(evaluations):
+        pid.calculate(temperature + (i % 500) * 0.1, SETPOINT)
+    elapsed = time.perf_counter() - start
+    return {'evaluations': evaluations, 'evaluations_per_second': evaluations / elapsed}
+
+
+def create_worker(root):
+    from workers.temperature import TemperatureWorker
+
+    class BenchTemperatureWorker(TemperatureWorker):
+        def _send_event_to_master(self, *args, **kwargs):
+            pass
+
+        def _send_master_is_finished(self, *args, **kwargs):
+            pass
+
+    os.environ.update({
+        TemperatureWorker.SSR_NAME: 'bench-ssr',
+        TemperatureWorker.SSR_IO: fake_gpio_value(root, 17),
+        TemperatureWorker.SSR_ACTIVE: 'false',
+        TemperatureWorker.SSR_CYCLE_TIME: str(CYCLE_TIME),
+        TemperatureWorker.THERMOMETER_NAME: 'bench-probe',
+        TemperatureWorker.THERMOMETER_IO: fake_w1_slave(root, '28-000000000001', 20000),
+        TemperatureWorker.THERMOMETER_ACTIVE: 'false',
+        TemperatureWorker.THERMOMETER_CYCLE_TIME: str(CYCLE_TIME)
+    })
+    worker = BenchTemperatureWorker()
+    # Drive the callbacks by hand, without the schedule resuming the device loops
+    worker.current_set_temperature = SETPOINT
+    worker.pid = PID(None, SETPOINT, CYCLE_TIME)
+    return worker
+
+
+def callback_latency(worker, samples):
+    probe = worker.thermometer
+    ssr = worker.ssr
+    latency = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        probe.callback(float(probe.read()))
+        latency.append(time.perf_counter() - start)
+    return {'latency_us': summarize(latency, 1e6), 'ssr_on_percent': ssr.on_percent}
+
+
+def emission_cost(worker, samples):
+    """
+    Cost on the device thread (create and send) and on the measurement thread (export) per sample.
+    """
+    results = {}
+    for device, value in [(worker.thermometer, 42.0), (worker.ssr, 50.0)]:
+        send = []
+        export = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            measurement = worker._create_measurement(worker.name, device.name, value, SETPOINT,
+                                                     worker.WORK_REACHING, 1.0)
+            worker._send_measurement(measurement)
+            send.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            worker._export_measurement(measurement)
+            export.append(time.perf_counter() - start)
+        results[device.name] = {'send': summarize(send, 1e6), 'export': summarize(export, 1e6)}
+    results['dropped'] = worker.measurements.dropped
+    return results
+
+
+def transition_latency(root, devices, repeats, runtime_model):
+    runtime = DeviceRuntime('bench-devices') if runtime_model == 'asyncio' else None
+    probes = []
+    for i in range(devices):
+        io = fake_w1_slave(root, '28-{0:012x}'.format(0x100 + i), 20000 + i)
+        probes.append(Probe('probe{0}'.format(i), io, False, 0.05, lambda value: None))
+    for probe in probes:
+        probe.run_device(runtime)
+    results = {'pause_us': [], 'resume_us': []}
+    for _ in range(repeats):
+        for key, request in [('resume_us', Probe.resume_device), ('pause_us', Probe.pause_device)]:
+            start = time.perf_counter()
+            for probe in probes:
+                request(probe)
+            for probe in probes:
+                probe.wait_until_acknowledged(5.0)
+            results[key].append(time.perf_counter() - start)
+            time.sleep(0.01)
+    for probe in probes:
+        probe.stop_device()
+    if runtime is None:
+        for probe in probes:
+            probe.join(5.0)
+    else:
+        runtime.stop()
+    return dict((key, summarize(values, 1e6)) for key, values in results.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--samples', type=int, default=10000, help='Samples per latency measurement')
+    parser.add_argument('--evaluations', type=int, default=200000, help='PID evaluations')
+    parser.add_argument('--devices', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--repeats', type=int, default=20, help='Pause/resume round trips per device count')
+    parser.add_argument('--runtime', choices=['thread', 'asyncio'], default='thread')
+    parser.add_argument('--log-level', default='INFO', help='Level the worker logs at, to a null stream')
+    add_output_argument(parser)
+    args = parser.parse_args()
+    # Formatting and handling log records is part of the cost, only the output is thrown away
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    handler.setFormatter(logging.Formatter('%(pathname)s:%(lineno)s: [%(levelname)s] %(message)s'))
+    logging.getLogger().addHandler(handler)
+    logging.getLogger().setLevel(args.log_level)
+    root = tempfile.mkdtemp(prefix='bench-sysfs-')
+    try:
+        worker = create_worker(root)
+        results = {
+            'pid': pid_throughput(args.evaluations),
+            'callback': callback_latency(worker, args.samples),
+            'emission_us': emission_cost(worker, args.samples),
+            'transitions': dict((str(devices), transition_latency(root, devices, args.repeats, args.runtime))
+                                for devices in args.devices)
+        }
+        worker._stop_all_devices()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    emit('control', results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin python
+"""
+Compares the PID (default and tuned gains) with the model predictive controller on simulated
+kettles: time to setpoint, overshoot, settling time and hold error. The predictive controller
+also runs with a wrong model (heater power and transport delay off) to show how it degrades.
+
+    python -m workers.benchmarks.controller --setpoint 66 --initial 20
+"""
+import argparse
+
+from workers.benchmarks.common import add_output_argument, emit
+from workers.utils.mpc import PredictiveController
+from workers.utils.pid import PID
+from workers.utils.plant import KettlePlant
+from workers.utils.tuning import closed_loop, search
+
+PLANTS = {
+    'debug': {'watts': 5500.0, 'liters': 50.0, 'cooling': 0.002, 'delay': 4},
+    'small': {'watts': 2000.0, 'liters': 20.0, 'cooling': 0.001, 'delay': 10},
+    'lossy': {'watts': 3000.0, 'liters': 30.0, 'cooling': 0.0, 'delay': 6, 'loss': 0.0002, 'ambient': 20.0}
+}
+PROBE_RESOLUTION = 0.0625  # DS18B20 at 12 bits
+
+
+def mismatched(plant):
+    return {
+        'mpc_watts_+20%': dict(plant, watts=plant['watts'] * 1.2),
+        'mpc_watts_-20%': dict(plant, watts=plant['watts'] * 0.8),
+        'mpc_delay_x0.5': dict(plant, delay=plant['delay'] // 2),
+        'mpc_delay_x2': dict(plant, delay=plant['delay'] * 2)
+    }
+
+
+def run_plant(plant, setpoint, initial, cycle_time, duration, tune):
+    def run(controller):
+        kettle = KettlePlant(minimum=min(initial, plant.get('ambient', initial)), initial=initial, **plant)
+        return closed_loop(controller, kettle, setpoint, cycle_time, duration, PROBE_RESOLUTION)
+
+    results = {'pid_default': run(PID(None, setpoint, cycle_time))}
+    if tune:
+        score, (kc, ti, td), _ = search(plant, setpoint, cycle_time, initial, duration=duration)
+        results['pid_tuned'] = run(PID(None, setpoint, cycle_time, kc=kc, ti=ti, td=td))
+        results['pid_tuned']['gains'] = {'kc': kc, 'ti': ti, 'td': td}
+    results['mpc'] = run(PredictiveController(plant, cycle_time))
+    for name, model in mismatched(plant).items():
+        results[name] = run(PredictiveController(model, cycle_time))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--setpoint', type=float, default=66.0)
+    parser.add_argument('--initial', type=float, default=20.0)
+    parser.add_argument('--cycle-time', type=float, default=10.0)
+    parser.add_argument('--duration', type=float, default=3 * 3600.0)
+    parser.add_argument('--no-tuning', dest='tune', action='store_false', help='Skip the tuned PID (process pool search)')
+    add_output_argument(parser)
+    args = parser.parse_args()
+    emit('controller', dict((name, run_plant(plant, args.setpoint, args.initial, args.cycle_time, args.duration,
+                                             args.tune))
+                            for name, plant in sorted(PLANTS.items())), args.output)
+
+
+if __name__ == "__main__":
+    main()
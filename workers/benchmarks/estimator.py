@@ -0,0 +1,65 @@
+#!/usr/bin python
+"""
+Shows what the Kalman temperature estimator buys at short control cycles: the PID on raw,
+quantised and noisy probe samples against the PID on the estimate (filtered temperature, and
+the model's rate of change for the D term), on simulated kettles, for several cycle times.
+Reports time to setpoint, overshoot, hold error and duty_variation, the mean duty change per
+cycle while holding (heater chatter).
+
+    python -m workers.benchmarks.estimator --cycle-times 10 5 2 1 --noise 0.02
+"""
+import argparse
+import random
+
+from workers.benchmarks.common import add_output_argument, emit
+from workers.utils.estimator import EstimatingController, TemperatureEstimator
+from workers.utils.mpc import PredictiveController
+from workers.utils.pid import PID
+from workers.utils.plant import KettlePlant
+from workers.utils.tuning import closed_loop
+
+# Transport delay in seconds here, it is converted to steps of each cycle time
+PLANTS = {
+    'debug': {'watts': 5500.0, 'liters': 50.0, 'cooling': 0.002, 'delay': 40.0},
+    'lossy': {'watts': 3000.0, 'liters': 30.0, 'cooling': 0.0, 'delay': 60.0, 'loss': 0.0002, 'ambient': 20.0}
+}
+PROBE_RESOLUTION = 0.0625  # DS18B20 at 12 bits
+
+
+def run_plant(plant, setpoint, initial, cycle_time, duration, noise, seed):
+    model = dict(plant, delay=int(round(plant['delay'] / cycle_time)))
+
+    def run(controller):
+        kettle = KettlePlant(minimum=min(initial, model.get('ambient', initial)), initial=initial, **model)
+        return closed_loop(controller, kettle, setpoint, cycle_time, duration, PROBE_RESOLUTION, noise,
+                           random.Random(seed))
+
+    return {
+        'pid_raw': run(PID(None, setpoint, cycle_time)),
+        'pid_estimated': run(EstimatingController(PID(None, setpoint, cycle_time),
+                                                  TemperatureEstimator(model, cycle_time))),
+        'mpc_raw': run(PredictiveController(model, cycle_time)),
+        'mpc_estimated': run(EstimatingController(PredictiveController(model, cycle_time),
+                                                  TemperatureEstimator(model, cycle_time)))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--setpoint', type=float, default=66.0)
+    parser.add_argument('--initial', type=float, default=20.0)
+    parser.add_argument('--cycle-times', type=float, nargs='+', default=[10.0, 5.0, 2.0, 1.0])
+    parser.add_argument('--duration', type=float, default=3 * 3600.0)
+    parser.add_argument('--noise', type=float, default=0.02, help='Gaussian probe noise in C, on top of quantisation')
+    parser.add_argument('--seed', type=int, default=1)
+    add_output_argument(parser)
+    args = parser.parse_args()
+    emit('estimator', dict((name, dict(('{0:g}s'.format(cycle_time),
+                                        run_plant(plant, args.setpoint, args.initial, cycle_time, args.duration,
+                                                  args.noise, args.seed))
+                                       for cycle_time in args.cycle_times))
+                           for name, plant in sorted(PLANTS.items())), args.output)
+
+
+if __name__ == "__main__":
+    main()
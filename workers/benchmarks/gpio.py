@@ -0,0 +1,75 @@
+#!/usr/bin python
+"""
+Measures the time one SSR output toggle takes with each gpio backend: sysfs value file, mapped
+BCM283x registers and the in-memory fake, both on the backend alone and through
+SSR.set_ssr_state. Without --pin, sysfs writes to a fake value file in a temporary directory
+and gpiomem maps a regular file of the register block's size. On a Raspberry Pi, --pin uses
+/sys/class/gpio and /dev/gpiomem and drives that pin.
+
+    python -m workers.benchmarks.gpio --toggles 10000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from workers.benchmarks.common import add_output_argument, emit, fake_gpio_value, summarize
+from workers.devices.gpio import GPIO_MEMORY_DEVICE, GPIO_MEMORY_SIZE, SYSFS_GPIO_ROOT, FakeGPIO, MemoryGPIO, \
+    SysfsGPIO
+from workers.devices.ssr import SSR
+
+
+def toggle(write, toggles):
+    latencies = []
+    for i in range(toggles):
+        t = time.perf_counter()
+        write(i % 2 == 0)
+        latencies.append(time.perf_counter() - t)
+    write(False)
+    return summarize(latencies, 1e6)
+
+
+def measure(gpio, toggles):
+    ssr = SSR('ssr', None, False, 1, lambda value: None, gpio=gpio)
+    results = {
+        'gpio_us': toggle(gpio.write, toggles),
+        'ssr_us': toggle(ssr.set_ssr_state, toggles)
+    }
+    gpio.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--toggles', type=int, default=10000)
+    parser.add_argument('--pin', type=int, help='Toggle this real pin instead of stand-in files')
+    add_output_argument(parser)
+    args = parser.parse_args()
+    root = tempfile.mkdtemp()
+    try:
+        if args.pin is None:
+            sysfs = SysfsGPIO(fake_gpio_value(root, 17))
+            registers = os.path.join(root, 'gpiomem')
+            with open(registers, 'wb') as fo:
+                fo.write(b'\0' * GPIO_MEMORY_SIZE)
+            memory = MemoryGPIO(17, registers)
+        else:
+            sysfs = SysfsGPIO(os.path.join(SYSFS_GPIO_ROOT, 'gpio{0}'.format(args.pin), 'value'))
+            if not sysfs.check():
+                sysfs.setup_output()
+            memory = MemoryGPIO(args.pin, GPIO_MEMORY_DEVICE)
+        memory.setup_output()
+        results = {
+            'sysfs': measure(sysfs, args.toggles),
+            'gpiomem': measure(memory, args.toggles),
+            'fake': measure(FakeGPIO(17), args.toggles),
+            'hardware': args.pin is not None
+        }
+    finally:
+        shutil.rmtree(root)
+    emit('gpio', results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin python
+"""
+Evaluations per second of N scalar PID objects against one PIDBank of size N, checking that both
+give bit for bit the same outputs.
+
+    python -m workers.benchmarks.pid_bank --sizes 1 10 100 1000 10000 100000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from workers.benchmarks.common import add_output_argument, emit
+from workers.utils.pid import PID
+from workers.utils.pid_bank import PIDBank
+
+
+def run_size(size, steps, scalar_limit):
+    rng = np.random.RandomState(size)
+    setpoints = rng.uniform(40.0, 80.0, size)
+    measured = rng.uniform(10.0, 90.0, (steps, size))
+    pids = [PID(None, setpoints[i], 5.0, kc=rng.uniform(1.0, 100.0), ti=rng.uniform(0.0, 100.0),
+                td=rng.uniform(0.0, 10.0)) for i in range(size)]
+    bank = PIDBank.from_params([pid.pid_params for pid in pids])
+
+    start = time.perf_counter()
+    for step in range(steps):
+        bank.pid_reg4(measured[step], setpoints)
+    bank_seconds = time.perf_counter() - start
+    result = {'bank_evaluations_per_second': size * steps / bank_seconds}
+
+    if size <= scalar_limit:
+        bank = PIDBank.from_params([pid.pid_params for pid in pids])
+        rows = measured.tolist()
+        start = time.perf_counter()
+        for step in range(steps):
+            row = rows[step]
+            outputs = [pid.pid_reg4(row[i], pid.setpoint, pid.pid_params, True) for i, pid in enumerate(pids)]
+        scalar_seconds = time.perf_counter() - start
+        for step in range(steps):
+            bank.pid_reg4(measured[step], setpoints)
+        result['scalar_evaluations_per_second'] = size * steps / scalar_seconds
+        result['speedup'] = scalar_seconds / bank_seconds
+        result['bit_exact'] = np.array(outputs).tobytes() == bank.yk.tobytes()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100, 1000, 10000, 100000])
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--scalar-limit', type=int, default=100000, help='Largest N to also run scalar')
+    add_output_argument(parser)
+    args = parser.parse_args()
+    emit('pid_bank', dict((str(size), run_size(size, args.steps, args.scalar_limit)) for size in args.sizes),
+         args.output)
+
+
+if __name__ == "__main__":
+    main()
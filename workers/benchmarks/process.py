@@ -0,0 +1,133 @@
+#!/usr/bin python
+"""
+Compares SSR PWM timing of a device loop on a thread of the worker against one in a device
+process (DEVICE_RUNTIME=process), while the worker is busy: --load pure Python threads and a
+thread logging as fast as it can stand in for master messaging, Prometheus and logging. Edges
+are recorded with their monotonic time into shared memory by the output itself, wherever it
+runs. Reports the jitter of the window period and of the on time, and how many window callbacks
+reached the worker.
+
+    python -m workers.benchmarks.process --cycle-time 0.1 --duration 10 --load 4
+"""
+import argparse
+import logging
+import os
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from workers.benchmarks.common import add_output_argument, emit, summarize
+from workers.benchmarks.runtime import busy_load
+from workers.devices.gpio import GPIO
+from workers.devices.process import ProcessRuntime
+from workers.devices.ssr import SSR
+
+EDGE = struct.Struct('d')
+EDGE_CAPACITY = 100000
+
+
+class SharedEdgeGPIO(GPIO):
+    """
+    Records every write as +time (on) or -time (off) into a shared memory array of doubles, the
+    first of which is the number of edges, so the edges of a device process can be read here.
+    """
+
+    def __init__(self, memory):
+        GPIO.__init__(self, 0)
+        self.memory = memory
+
+    def write(self, on):
+        buffer = self.memory.buf
+        count = int(EDGE.unpack_from(buffer, 0)[0])
+        if count < EDGE_CAPACITY:
+            EDGE.pack_into(buffer, EDGE.size * (count + 1), time.monotonic() if on else -time.monotonic())
+            EDGE.pack_into(buffer, 0, count + 1)
+
+    def read(self):
+        return False
+
+    def recorded(self):
+        buffer = self.memory.buf
+        count = int(EDGE.unpack_from(buffer, 0)[0])
+        return [(abs(value), value > 0) for value, in EDGE.iter_unpack(buffer[EDGE.size:EDGE.size * (count + 1)])]
+
+
+def logging_load(stop, logger):
+    while not stop.is_set():
+        logger.info('Master message %s', time.time())
+
+
+def jitter(edges, cycle_time, duty):
+    rising = [timestamp for timestamp, on in edges if on]
+    periods = [abs(b - a - cycle_time) for a, b in zip(rising, rising[1:])]
+    on_times = []
+    on_since = None
+    for timestamp, on in edges:
+        if on:
+            on_since = timestamp
+        elif on_since is not None:
+            on_times.append(abs(timestamp - on_since - duty * cycle_time))
+            on_since = None
+    return {
+        'period_jitter_us': summarize(periods, 1e6),
+        'on_time_error_us': summarize(on_times, 1e6)
+    }
+
+
+def run_model(model, cycle_time, duty, duration, load):
+    memory = shared_memory.SharedMemory(create=True, size=EDGE.size * (EDGE_CAPACITY + 1))
+    EDGE.pack_into(memory.buf, 0, 0)
+    gpio = SharedEdgeGPIO(memory)
+    callbacks = []
+    ssr = SSR('ssr', None, False, cycle_time, callbacks.append, gpio=gpio)
+    runtime = ProcessRuntime() if model == 'process' else None
+    stop_load = threading.Event()
+    logger = logging.getLogger('workers.benchmarks.process.load')
+    logger.propagate = False
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    try:
+        ssr.run_device(runtime)
+        ssr.write(duty)
+        ssr.resume_device()
+        if not ssr.wait_until_acknowledged(10.0):
+            raise RuntimeError('The {0} SSR did not start'.format(model))
+        loads = [threading.Thread(target=busy_load, args=(stop_load,), daemon=True) for _ in range(load)]
+        loads.append(threading.Thread(target=logging_load, args=(stop_load, logger), daemon=True))
+        for thread in loads:
+            thread.start()
+        time.sleep(duration)
+        stop_load.set()
+        for thread in loads:
+            thread.join()
+        ssr.stop_device()
+        ssr.wait_until_acknowledged(5.0)
+        if runtime is not None:
+            runtime.stop()
+        results = jitter(gpio.recorded(), cycle_time, duty)
+        results['windows'] = int(duration / cycle_time)
+        results['callbacks'] = len(callbacks)
+        return results
+    finally:
+        logger.removeHandler(handler)
+        handler.stream.close()
+        memory.close()
+        memory.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cycle-time', type=float, default=0.1)
+    parser.add_argument('--duty', type=float, default=0.3)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--load', type=int, default=4, help='Busy threads competing for the GIL of the worker')
+    add_output_argument(parser)
+    args = parser.parse_args()
+    emit('device_process', dict((model, run_model(model, args.cycle_time, args.duty, args.duration, args.load))
+                                for model in ['thread', 'process']), args.output)
+
+
+if __name__ == "__main__":
+    main()
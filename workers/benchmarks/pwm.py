@@ -0,0 +1,130 @@
+#!/usr/bin python
+"""
+Measures window drift and duty error of SSR PWM, the deadline scheduled DeadlinePWM against the
+former pair of relative sleeps, with a slow actuation and callback. Also measures how long a new
+duty written to an SSR takes to reach the output, with and without preemption.
+
+    python -m workers.benchmarks.pwm --cycle-time 0.5 --windows 20 --duty 0.3
+"""
+import argparse
+import random
+import time
+
+from workers.benchmarks.common import add_output_argument, emit, summarize
+from workers.devices.gpio import FakeGPIO
+from workers.devices.pwm import DeadlinePWM
+from workers.devices.ssr import SSR
+
+
+class SlowOutput(object):
+    def __init__(self, latency):
+        self.latency = latency
+        self.edges = []
+
+    def actuate(self, on):
+        time.sleep(self.latency)
+        self.edges.append((time.monotonic(), on))
+
+
+def achieved(edges, start, end):
+    on_time = 0.0
+    on_since = None
+    for timestamp, on in edges:
+        if on and on_since is None:
+            on_since = timestamp
+        elif not on and on_since is not None:
+            on_time += max(0.0, min(timestamp, end) - max(on_since, start))
+            on_since = None
+    if on_since is not None:
+        on_time += max(0.0, end - max(on_since, start))
+    return on_time / (end - start)
+
+
+def relative_sleeps(output, duty, cycle_time, windows, callback_time):
+    for _ in range(windows):
+        if duty > 0.0:
+            output.actuate(True)
+            time.sleep(duty * cycle_time)
+        if duty < 1.0:
+            output.actuate(False)
+            time.sleep((1.0 - duty) * cycle_time)
+        time.sleep(callback_time)
+
+
+def deadlines(output, duty, cycle_time, windows, callback_time, burst_period=None):
+    pwm = DeadlinePWM(output.actuate, cycle_time, burst_period)
+    for _ in range(windows):
+        for deadline in pwm.window(duty):
+            if pwm.window_closing:
+                time.sleep(callback_time)
+            time.sleep(max(0.0, deadline - time.monotonic()))
+
+
+class RecordingSSR(SSR):
+    def __init__(self, cycle_time, preemptive):
+        SSR.__init__(self, 'ssr', None, False, cycle_time, lambda value: None, gpio=FakeGPIO())
+        self.preemptive = preemptive
+        self.edges = []
+
+    def auto_setup(self):
+        return True, None
+
+    def set_ssr_state(self, on=False):
+        self.edges.append((time.monotonic(), on))
+        return True
+
+
+def duty_update_latency(cycle_time, preemptive, trials):
+    ssr = RecordingSSR(cycle_time, preemptive)
+    ssr.run_device()
+    ssr.resume_device()
+    latencies = []
+    for trial in range(trials):
+        on = trial % 2 == 0
+        time.sleep(random.uniform(0.1, 0.9) * cycle_time)
+        written = time.monotonic()
+        ssr.write(1.0 if on else 0.0)
+        while not [edge for edge in ssr.edges if edge[0] >= written and edge[1] == on]:
+            time.sleep(0.001)
+        latencies.append([edge for edge in ssr.edges if edge[0] >= written][0][0] - written)
+    ssr.stop_device()
+    return summarize(latencies, 1e3)
+
+
+def run(name, function, args):
+    output = SlowOutput(args.latency)
+    start = time.monotonic()
+    function(output, args.duty, args.cycle_time, args.windows, args.callback_time)
+    elapsed = time.monotonic() - start
+    expected = args.windows * args.cycle_time
+    errors = [achieved(output.edges, start + i * args.cycle_time, start + (i + 1) * args.cycle_time) - args.duty
+              for i in range(args.windows)]
+    return {
+        'drift_ms': 1e3 * (elapsed - expected),
+        'overall_duty_error': achieved(output.edges, start, start + expected) - args.duty,
+        'window_duty_error': summarize([abs(error) for error in errors])
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cycle-time', type=float, default=0.5)
+    parser.add_argument('--windows', type=int, default=20)
+    parser.add_argument('--duty', type=float, default=0.3)
+    parser.add_argument('--latency', type=float, default=0.002, help='Seconds per actuation')
+    parser.add_argument('--callback-time', type=float, default=0.005, help='Seconds spent in the callback')
+    parser.add_argument('--trials', type=int, default=10, help='Duty updates per latency measurement')
+    add_output_argument(parser)
+    args = parser.parse_args()
+    emit('ssr_pwm', {
+        'relative_sleeps': run('relative_sleeps', relative_sleeps, args),
+        'deadlines': run('deadlines', deadlines, args),
+        'duty_update_latency_ms': {
+            'window_start': duty_update_latency(args.cycle_time, False, args.trials),
+            'preemptive': duty_update_latency(args.cycle_time, True, args.trials)
+        }
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
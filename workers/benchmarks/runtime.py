@@ -0,0 +1,98 @@
+#!/usr/bin python
+"""
+Compares CPU use and wakeup jitter of the thread-per-device model against the shared
+asyncio DeviceRuntime.
+
+    python -m workers.benchmarks.runtime --devices 40 --paused 20 --duration 10
+
+--load adds a pure Python busy thread, standing in for master messaging and logging
+competing for the GIL.
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from workers.benchmarks.common import add_output_argument, emit, summarize
+from workers.devices.device import Device
+from workers.devices.runtime import DeviceRuntime
+
+
+class TickDevice(Device):
+    def __init__(self, name, cycle_time):
+        Device.__init__(self, name, None, False, cycle_time, self._record)
+        self.lateness = []
+
+    def _record(self, value):
+        self.lateness.append(value)
+
+    def auto_setup(self):
+        return True, None
+
+    def run_cycle(self):
+        before = time.monotonic()
+        time.sleep(self.cycle_time)
+        self.do_callback(time.monotonic() - before - self.cycle_time)
+
+    async def run_cycle_async(self):
+        before = time.monotonic()
+        await asyncio.sleep(self.cycle_time)
+        self.do_callback(time.monotonic() - before - self.cycle_time)
+
+
+def busy_load(stop):
+    while not stop.is_set():
+        sum(i * i for i in range(1000))
+
+
+def run_model(model, devices, paused, cycle_time, duration, load):
+    runtime = DeviceRuntime() if model == 'asyncio' else None
+    all_devices = [TickDevice('tick{0}'.format(i), cycle_time) for i in range(devices + paused)]
+    for device in all_devices:
+        device.run_device(runtime)
+    for device in all_devices[:devices]:
+        device.resume_device()
+    stop_load = threading.Event()
+    if load:
+        threading.Thread(target=busy_load, args=(stop_load,), daemon=True).start()
+    # Let every device settle into its loop before measuring
+    for device in all_devices:
+        device.wait_until_acknowledged(1.0)
+    time.sleep(cycle_time)
+    for device in all_devices:
+        del device.lateness[:]
+    threads = threading.active_count()
+    cpu_start = time.process_time()
+    time.sleep(duration)
+    cpu = time.process_time() - cpu_start
+    stop_load.set()
+    for device in all_devices:
+        device.stop_device()
+    if runtime is not None:
+        runtime.stop()
+    lateness = [value for device in all_devices for value in device.lateness]
+    return {
+        'cpu_seconds': cpu,
+        'cpu_percent': 100.0 * cpu / duration,
+        'threads': threads,
+        'wakeup_lateness_us': summarize(lateness, 1e6)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--devices', type=int, default=20, help='Running devices')
+    parser.add_argument('--paused', type=int, default=20, help='Paused devices')
+    parser.add_argument('--cycle-time', type=float, default=0.05)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--load', action='store_true', help='Compete for the GIL with a busy thread')
+    add_output_argument(parser)
+    args = parser.parse_args()
+    results = {}
+    for model in ['thread', 'asyncio']:
+        results[model] = run_model(model, args.devices, args.paused, args.cycle_time, args.duration, args.load)
+    emit('device_runtime', results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin python
+"""
+Measures the cold start of a TemperatureWorker, from process start to the first SSR actuation,
+over a fake sysfs tree and without a master: every run is a fresh interpreter that imports the
+worker, sets up its devices, starts a schedule right away and reports its StartupProfiler once
+the PID first wrote to the SSR. Reports every phase of workers.utils.startup over all runs and
+whether the start stayed within STARTUP_BUDGET.
+
+    python -m workers.benchmarks.startup --runs 10 --output startup.json
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from workers.benchmarks.common import add_output_argument, emit, fake_gpio_value, fake_w1_slave, summarize
+from workers.utils.startup import STARTUP_BUDGET, STARTUP_PHASES
+
+SETPOINT = 66.0
+CYCLE_TIME = 10
+STARTUP_TIMEOUT = 30.0
+
+
+def child(root, runtime):
+    # Imported only now, importing is part of what is measured
+    from workers.temperature import TemperatureWorker
+    from workers.utils.startup import STARTUP
+
+    class BenchTemperatureWorker(TemperatureWorker):
+        def _send_event_to_master(self, *args, **kwargs):
+            pass
+
+        def _send_master_is_finished(self, *args, **kwargs):
+            pass
+
+    os.environ.update({
+        TemperatureWorker.SSR_NAME: 'bench-ssr',
+        TemperatureWorker.SSR_IO: fake_gpio_value(root, 17),
+        TemperatureWorker.SSR_ACTIVE: 'false',
+        TemperatureWorker.SSR_CYCLE_TIME: str(CYCLE_TIME),
+        TemperatureWorker.THERMOMETER_NAME: 'bench-probe',
+        TemperatureWorker.THERMOMETER_IO: fake_w1_slave(root, '28-000000000001', 20000),
+        TemperatureWorker.THERMOMETER_ACTIVE: 'false',
+        TemperatureWorker.THERMOMETER_CYCLE_TIME: str(CYCLE_TIME),
+        TemperatureWorker.DEVICE_RUNTIME: runtime
+    })
+    worker = BenchTemperatureWorker()
+    worker._setup_worker_schedule([['0:10:00', SETPOINT]])
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while STARTUP_PHASES[-1] not in STARTUP.phases and time.monotonic() < deadline:
+        time.sleep(0.001)
+    sys.stdout.write(json.dumps(STARTUP.report()) + '\n')
+    sys.stdout.flush()
+    worker._stop_all_devices()
+    worker.measurements.stop()
+    if worker.device_runtime is not None:
+        worker.device_runtime.stop()
+
+
+def cold_start(root, runtime):
+    output = subprocess.check_output([sys.executable, '-m', 'workers.benchmarks.startup', '--child', root,
+                                      '--runtime', runtime], timeout=STARTUP_TIMEOUT + 10)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--runtime', choices=['thread', 'asyncio', 'process'], default='thread')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    add_output_argument(parser)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.runtime)
+        return
+    root = tempfile.mkdtemp()
+    try:
+        runs = [cold_start(root, args.runtime) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(root)
+    phases = dict((phase, {
+        'at_ms': summarize([run[phase]['at'] for run in runs if phase in run], 1e3),
+        'seconds_ms': summarize([run[phase]['seconds'] for run in runs if phase in run], 1e3)
+    }) for phase in STARTUP_PHASES)
+    over = sorted(set(phase for run in runs for phase, budget in STARTUP_BUDGET.items()
+                      if phase not in run or run[phase]['at'] > budget))
+    emit('startup', {'runtime': args.runtime, 'phases': phases, 'budget': STARTUP_BUDGET, 'over_budget': over},
+         args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin python
+"""
+Sends a burst of brew event messages through the TelegramQueue to a local stub of the bot API
+and compares the time the caller is blocked with sending every message synchronously. The stub
+answers 429 once per rate_limit_every messages and adds latency to every request.
+
+    python -m workers.benchmarks.telegram --messages 200 --spacing 0.01 --latency 0.05
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from workers.benchmarks.common import add_output_argument, emit, summarize
+from workers.utils.telegram_queue import TelegramQueue
+
+CHAT_ID = '1234'
+
+
+class StubTelegramServer(ThreadingMixIn, HTTPServer):
+    """
+    Answers sendMessage and getMe like api.telegram.org does, on a free local port.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, rate_limit_every=0, retry_after=1):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubTelegramHandler)
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.messages = []
+        self.requests = 0
+        self.rate_limited = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def answer(self, method, fields):
+        time.sleep(self.latency)
+        with self.lock:
+            self.requests += 1
+            if method == 'getMe':
+                return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'username': 'stub_bot'}}
+            if self.rate_limit_every and self.requests % self.rate_limit_every == 0:
+                self.rate_limited += 1
+                return 429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+                             'parameters': {'retry_after': self.retry_after}}
+            self.messages.append((time.monotonic(), fields['chat_id'], fields['text']))
+            return 200, {'ok': True, 'result': {'message_id': len(self.messages)}}
+
+
+class StubTelegramHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        fields = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        status, answer = self.server.answer(self.path.rsplit('/', 1)[-1], fields)
+        body = json.dumps(answer).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+VESSELS = ['HLT', 'MLT', 'BK']
+STEPS = ['Mash in', 'Protein rest', 'Beta amylase rest', 'Alpha amylase rest', 'Mash out', 'Sparge', 'Boil',
+         'Whirlpool', 'Chill', 'Transfer']
+
+
+def brew_events(count):
+    # Mostly temperature updates of a few vessels, which are near-duplicates, and some distinct events
+    for i in range(count):
+        if i % 10 == 9:
+            yield '{0} started'.format(STEPS[i // 10 % len(STEPS)])
+        else:
+            yield '{0} temperature is {1:.1f}'.format(VESSELS[i % len(VESSELS)], 60.0 + i * 0.1)
+
+
+def run_queue(server, count, spacing, chat_interval, coalesce_window):
+    queue = TelegramQueue('token', api_url=server.url, name='benchmark', chat_interval=chat_interval,
+                          coalesce_window=coalesce_window)
+    queue.start()
+    blocked = []
+    started = time.monotonic()
+    for text in brew_events(count):
+        t = time.monotonic()
+        queue.put(CHAT_ID, text)
+        blocked.append(time.monotonic() - t)
+        time.sleep(spacing)
+    queue.stop()
+    sent_times = [sent for sent, _, _ in server.messages]
+    gaps = [b - a for a, b in zip(sent_times, sent_times[1:])]
+    return {
+        'put_us': summarize(blocked, 1e6),
+        'caller_blocked_s': sum(blocked),
+        'drain_s': time.monotonic() - started,
+        'sent': queue.sent,
+        'coalesced': queue.coalesced,
+        'dropped': queue.dropped,
+        'rate_limited': server.rate_limited,
+        'min_gap_s': min(gaps) if gaps else None
+    }
+
+
+def run_synchronous(server, count, spacing):
+    # One request per message on the caller's thread, like telepot.Bot.sendMessage, without
+    # coalescing; 429 answers are not retried
+    queue = TelegramQueue('token', api_url=server.url, name='benchmark-sync')
+    blocked = []
+    for text in brew_events(count):
+        t = time.monotonic()
+        queue._request('sendMessage', {'chat_id': CHAT_ID, 'text': text})
+        blocked.append(time.monotonic() - t)
+        time.sleep(spacing)
+    return {
+        'send_us': summarize(blocked, 1e6),
+        'caller_blocked_s': sum(blocked),
+        'sent': len(server.messages),
+        'rate_limited': server.rate_limited
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds the stub takes per request')
+    parser.add_argument('--spacing', type=float, default=0.01, help='Seconds between two messages of the burst')
+    parser.add_argument('--rate-limit-every', type=int, default=7, help='Answer 429 to every nth request, 0 never')
+    parser.add_argument('--chat-interval', type=float, default=0.1)
+    parser.add_argument('--coalesce-window', type=float, default=1.0)
+    add_output_argument(parser)
+    args = parser.parse_args()
+    results = {}
+    for name in ['synchronous', 'queue']:
+        server = StubTelegramServer(args.latency, args.rate_limit_every, retry_after=1)
+        server.start()
+        try:
+            if name == 'queue':
+                results[name] = run_queue(server, args.messages, args.spacing, args.chat_interval, args.coalesce_window)
+            else:
+                results[name] = run_synchronous(server, args.messages, args.spacing)
+        finally:
+            server.shutdown()
+            server.server_close()
+    emit('telegram', results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin python
+import copy
+import json
+import logging
+from collections import OrderedDict
+
+from distribrewed_core.base.worker import ScheduleWorker
+
+from workers.debug_temperature import DebugTemperatureWorker
+from workers.device import DeviceWorker
+from workers.temperature import TemperatureWorker
+from workers.utils.clock import VirtualClock
+
+log = logging.getLogger(__name__)
+
+
+class HostedLoop(object):
+    """
+    Makes a TemperatureWorker class run as one loop of a BrewhouseWorker: settings come from the
+    loop config, the clock and device runtime are the host's and whatever the loop would tell the
+    master goes through the host. See hosted_loop_class.
+    """
+
+    def __init__(self, host, loop_name, config):
+        self.host = host
+        self.loop_name = loop_name
+        self.config = config
+        super(HostedLoop, self).__init__()
+
+    def _setting(self, key, default=None):
+        if key in self.config:
+            value = self.config[key]
+            return str(value).lower() if isinstance(value, bool) else str(value)
+        if key in self.host.LOOP_SETTINGS:
+            return default  # Never share a device or a file with another loop
+        return self.host._setting(key, default)
+
+    def _create_clock(self):
+        return self.host.clock
+
+    def _create_device_runtime(self):
+        return self.host.device_runtime
+
+    def _send_event_to_master(self, event):
+        self.host._loop_event(self, event)
+
+    def _send_master_is_finished(self):
+        self.host._loop_finished(self)
+
+
+class HostConnection(ScheduleWorker):
+    """
+    Takes the place of the master connection in a hosted loop, the host holds the only one.
+    """
+
+    def __init__(self):
+        self.name = '{0}-{1}'.format(self.host.name, self.loop_name)
+        self.ip = getattr(self.host, 'ip', None)
+        self.prom_port = getattr(self.host, 'prom_port', None)
+
+    def stop_worker(self):
+        return True
+
+    def pause_worker(self):
+        return True
+
+    def resume_worker(self):
+        return True
+
+
+def hosted_loop_class(worker_class):
+    """
+    :return: Subclass of worker_class (a TemperatureWorker) whose instances are created with
+             (host, loop name, loop config) and do not connect to the master themselves.
+    """
+    return type('Hosted' + worker_class.__name__, (HostedLoop, worker_class, HostConnection), {})
+
+
+class BrewhouseWorker(DeviceWorker):
+    """
+    Runs several temperature loops, i.e. HLT, mash tun and boil kettle, in one process with one
+    master connection, one Prometheus port and one device runtime. Every loop is a
+    TemperatureWorker of its own (probe, SSR, controller, schedule, history) configured by an entry
+    of BREWHOUSE_LOOPS, a JSON list (or the path of a JSON file holding one) like
+
+        [{"name": "hlt", "SSR_NAME": "hlt_ssr", "SSR_IO": "/sys/class/gpio/gpio17/value",
+          "SSR_CYCLE_TIME": 10, "THERMOMETER_NAME": "hlt_probe",
+          "THERMOMETER_IO": "/sys/bus/w1/devices/28-0316a2795dff/w1_slave", "THERMOMETER_CYCLE_TIME": 10},
+         {"name": "mash", ...}]
+
+    Each entry takes the same settings as the environment of a TemperatureWorker. Settings not in
+    an entry come from the environment, except the devices and files of LOOP_SETTINGS.
+
+    The schedule from the master is a dict of loop name to the schedule of that loop. Loops not in
+    it stay idle, and a plain schedule list goes to the first loop. The worker is finished when
+    every scheduled loop is. Events of a loop reach the master prefixed with its name, i.e.
+    "mash:on_temperature_reached".
+    """
+    BREWHOUSE_LOOPS = "BREWHOUSE_LOOPS"
+    LOOP_EVENT = "{0}:{1}"  # Loop name and event, so the master can tell the vessels apart
+    LOOP_WORKER = TemperatureWorker
+    LOOP_SETTINGS = [
+        TemperatureWorker.SSR_NAME, TemperatureWorker.SSR_IO, TemperatureWorker.SSR_ACTIVE,
+        TemperatureWorker.SSR_CYCLE_TIME, TemperatureWorker.THERMOMETER_NAME, TemperatureWorker.THERMOMETER_IO,
+        TemperatureWorker.THERMOMETER_ACTIVE, TemperatureWorker.THERMOMETER_CYCLE_TIME,
+        TemperatureWorker.PID_PARAMS_FILE, TemperatureWorker.PLANT_FILE, TemperatureWorker.HISTORY_FILE,
+        TemperatureWorker.CHECKPOINT_FILE
+    ]
+
+    def __init__(self):
+        self.loops = OrderedDict()
+        self.scheduled = set()
+        self.finished_loops = set()
+        DeviceWorker.__init__(self)
+
+    def worker_info(self):
+        return {
+            'id': self.name,
+            'ip': self.ip,
+            'type': self.__class__.__name__,
+            'prometheus_scrape_port': self.prom_port,
+            'number_of_devices': sum(len(loop.devices) for loop in self.loops.values()),
+            'loops': list(self.loops)
+        }
+
+    def _load_loops(self):
+        loops = self._setting(self.BREWHOUSE_LOOPS)
+        if not loops:
+            raise ValueError('Provide the brewhouse loops in env variable \'{0}\''.format(self.BREWHOUSE_LOOPS))
+        if not loops.lstrip().startswith('['):
+            with open(loops) as fo:
+                loops = fo.read()
+        return json.loads(loops)
+
+    def add_devices(self):
+        # The loops add their own devices, on the runtime of this worker
+        loop_class = hosted_loop_class(self.LOOP_WORKER)
+        for config in self._load_loops():
+            name = config['name']
+            if name in self.loops:
+                raise ValueError('Brewhouse loop "{0}" is configured twice'.format(name))
+            self.loops[name] = loop_class(self, name, config)
+        log.info('{0} runs loops {1}'.format(self.name, ', '.join(self.loops)))
+        # Loops that resumed from their checkpoint count as scheduled until the master says otherwise
+        self.scheduled = set(name for name, loop in self.loops.items() if loop.resumed)
+
+    def _events(self):
+        events = ScheduleWorker._events(self)
+        events.extend(self.LOOP_EVENT.format(name, TemperatureWorker.EVENT_ON_TEMPERATURE_REACHED)
+                      for name in self.loops)
+        return events
+
+    def _loop_event(self, loop, event):
+        log.info('{0} loop {1}: {2}'.format(self.name, loop.loop_name, event))
+        self._send_event_to_master(self.LOOP_EVENT.format(loop.loop_name, event))
+
+    def _loop_finished(self, loop):
+        self.finished_loops.add(loop.loop_name)
+        if self._is_done():
+            self._send_master_is_finished()
+
+    def _split_schedule(self, worker_schedule):
+        if not isinstance(worker_schedule, dict):
+            return {next(iter(self.loops)): worker_schedule}
+        unknown = [name for name in worker_schedule if name not in self.loops]
+        if unknown:
+            raise ValueError('Schedule for unknown brewhouse loops {0}'.format(', '.join(unknown)))
+        return worker_schedule
+
+    def _setup_worker_schedule(self, worker_schedule):
+        schedules = self._split_schedule(worker_schedule)
+        self.scheduled = set(schedules)
+        self.finished_loops = set()
+        for name, schedule in schedules.items():
+            self.loops[name]._setup_worker_schedule(schedule)
+
+    def _check_events(self):
+        pass
+
+    def _is_done(self):
+        return bool(self.scheduled) and self.scheduled <= self.finished_loops
+
+    def _calculate_finish_time(self):
+        times = [self.loops[name]._calculate_finish_time() for name in self.scheduled
+                 if name not in self.finished_loops]
+        return max(times) if times else self.clock.now()
+
+    def stop_worker(self):
+        for loop in self.loops.values():
+            loop.stop_worker()
+        super(DeviceWorker, self).stop_worker()
+        return True
+
+    def pause_worker(self):
+        for name in self.scheduled:
+            self.loops[name].pause_worker()
+        super(DeviceWorker, self).pause_worker()
+        return True
+
+    def resume_worker(self):
+        for name in self.scheduled:
+            self.loops[name].resume_worker()
+        super(DeviceWorker, self).resume_worker()
+        return True
+
+    def _stop_all_devices(self):
+        for loop in self.loops.values():
+            loop._stop_all_devices()
+
+    def _build_grafana_rows(self):
+        # The rows of every loop, panel ids renumbered to stay unique on one dashboard
+        rows = []
+        panel_id = 0
+        for loop in self.loops.values():
+            for row in copy.deepcopy(loop._get_grafana_rows()):
+                for panel in row['panels']:
+                    panel_id += 1
+                    panel['id'] = panel_id
+                rows.append(row)
+        return rows
+
+
+class DebugBrewhouseWorker(BrewhouseWorker):
+    """
+    A BrewhouseWorker of DebugTemperatureWorker loops, every loop simulating its own kettle. With
+    DEBUG_VIRTUAL_CLOCK=true all of them run on one virtual clock.
+    """
+    LOOP_WORKER = DebugTemperatureWorker
+
+    def _create_clock(self):
+        if self._setting(DebugTemperatureWorker.DEBUG_VIRTUAL_CLOCK, 'false').lower() in ['1', 'true']:
+            return VirtualClock()
+        return BrewhouseWorker._create_clock(self)
@@ -1,18 +1,28 @@
 #!/usr/bin python
 import logging
-import os
 from datetime import timedelta as timedelta
 from datetime import datetime as datetime
 
 from distribrewed_core.base.worker import ScheduleWorker
-from devices.probe import SimulationProbe
-from devices.ssr import SimulationSSR
-from utils.pid import PID
+from workers.devices.probe import SimulationProbe
+from workers.devices.ssr import SimulationSSR
 from workers.temperature import TemperatureWorker
+from workers.utils.clock import VirtualClock
+from workers.utils.measurement import Measurement
+from workers.utils.plant import KettlePlant
+from workers.utils.timeline import Timeline
 
 log = logging.getLogger(__name__)
 
 
+class DebugMeasurement(Measurement):
+    __slots__ = ['debug_timer']
+
+    def __init__(self, *args, **kwargs):
+        Measurement.__init__(self, *args, **kwargs)
+        self.debug_timer = None
+
+
 class DebugTemperatureWorker(TemperatureWorker):
     DEBUG_INIT_TEMP = 40.0
     DEBUG_CYCLE_TIME = 10.0
@@ -22,11 +32,47 @@ class DebugTemperatureWorker(TemperatureWorker):
     DEBUG_COOLING = 0.002
     DEBUG_TIME_DIVIDER = 60
     DEBUG_TIMEDELTA = 10  # seconds
+    DEBUG_VIRTUAL_CLOCK = "DEBUG_VIRTUAL_CLOCK"
+    PLANT_WATTS = "PLANT_WATTS"
+    PLANT_LITERS = "PLANT_LITERS"
+    PLANT_COOLING = "PLANT_COOLING"
+    PLANT_DELAY = "PLANT_DELAY"
+    PLANT_AMBIENT = "PLANT_AMBIENT"
+    PLANT_LOSS = "PLANT_LOSS"
+    MEASUREMENT = DebugMeasurement
 
     def __init__(self):
-        TemperatureWorker.__init__(self)
+        # Set before TemperatureWorker.__init__, which may resume a checkpoint and start the devices
+        self.plant = self._create_plant()
         self.test_temperature = self.DEBUG_INIT_TEMP
         self.debug_timer = timedelta(0)
+        TemperatureWorker.__init__(self)
+
+    def _create_plant(self):
+        # The DEBUG_* constants are only the defaults, every kettle parameter can be set per worker
+        return KettlePlant(
+            float(self._setting(self.PLANT_WATTS, self.DEBUG_WATTS)),
+            float(self._setting(self.PLANT_LITERS, self.DEBUG_LITERS)),
+            cooling=float(self._setting(self.PLANT_COOLING, self.DEBUG_COOLING)),
+            delay=int(self._setting(self.PLANT_DELAY, self.DEBUG_DELAY)),
+            minimum=self.DEBUG_INIT_TEMP,
+            initial=self.DEBUG_INIT_TEMP,
+            ambient=float(self._setting(self.PLANT_AMBIENT, self.DEBUG_INIT_TEMP)),
+            loss=float(self._setting(self.PLANT_LOSS, 0.0)))
+
+    def _load_plant_model(self):
+        # Without a PLANT_FILE the predictive controller gets the exact model of the simulated kettle
+        plant = TemperatureWorker._load_plant_model(self)
+        if plant is None:
+            plant = {'watts': self.plant.watts, 'liters': self.plant.liters, 'cooling': self.plant.cooling,
+                     'delay': self.plant.delay, 'ambient': self.plant.ambient, 'loss': self.plant.loss}
+        return plant
+
+    def _create_clock(self):
+        # With a virtual clock the schedule runs in full length, only as fast as the CPU allows
+        if self._setting(self.DEBUG_VIRTUAL_CLOCK, 'false').lower() in ['1', 'true']:
+            return VirtualClock()
+        return TemperatureWorker._create_clock(self)
 
     def _create_ssr(self, name, io, active, cycle_time, callback):
         return SimulationSSR(name, io, active, cycle_time, callback, self)
@@ -34,30 +80,25 @@ class DebugTemperatureWorker(TemperatureWorker):
     def _create_thermometer(self, name, io, active, cycle_time, callback):
         return SimulationProbe(name, io, active, cycle_time, callback, self)
 
+    def _compile_schedule(self, worker_schedule):
+        if isinstance(self.clock, VirtualClock):
+            return Timeline.compile(worker_schedule)
+        return Timeline.compile(worker_schedule, 1.0 / self.DEBUG_TIME_DIVIDER)
+
     def _setup_worker_schedule(self, worker_schedule):
         TemperatureWorker._setup_worker_schedule(self, worker_schedule)
-        seconds = self.current_hold_time
-        seconds /= self.DEBUG_TIME_DIVIDER
+        self.plant.reset(self.DEBUG_INIT_TEMP)
         self._get_device(self.thermometer_name).test_temperature = self.DEBUG_INIT_TEMP
-        self.current_hold_time = seconds
 
     def _temperature_callback_event(self, measured_value, measurement):
         self.debug_timer += timedelta(seconds=self.DEBUG_TIMEDELTA)
 
     def _ssr_callback_event(self, heating_ratio, measurement):
-        measurement["debug_timer"] = self.debug_timer
+        measurement.debug_timer = self.debug_timer
         try:
             cycle_time = (float)(self._get_device(self.ssr_name).cycle_time)
             hold_time = (heating_ratio/100.0) * cycle_time
-            self._get_device(self.thermometer_name).test_temperature = \
-                PID.calc_heating(self.current_temperature,
-                                 self.DEBUG_WATTS,
-                                 hold_time,
-                                 cycle_time,
-                                 self.DEBUG_LITERS,
-                                 self.DEBUG_COOLING,
-                                 self.DEBUG_DELAY,
-                                 self.DEBUG_INIT_TEMP)
+            self._get_device(self.thermometer_name).test_temperature = self.plant.step(hold_time, cycle_time)
         except Exception as e:
             log.debug('DebugTemperatureWorker unable to update test temperature for debug: {0}'.format(e.args[0]))
 
@@ -71,5 +112,7 @@ if __name__ == "__main__":
 
     worker = DebugTemperatureWorker()
     worker.start_worker('Debug Temperature Schedule', [
-        ['1:00:00', 60.0]
+        ['1:00:00', 60.0],
+        ['0:00:00', 66.0, 'ramp', 1.0],
+        ['0:30:00', 66.0]
     ])
@@ -1,18 +1,52 @@
 import logging
+import os
 import time
 
 from distribrewed_core.base.worker import ScheduleWorker
 
+from workers.devices.gpio import GPIO_BACKEND_SYSFS, create_gpio
+from workers.devices.probe import Probe
+from workers.devices.probe_group import ProbeGroup
+from workers.devices.ssr import SSR
+from workers.utils import grafana
+from workers.utils.clock import REAL_CLOCK
+from workers.utils.metrics import DeviceMetrics
+from workers.utils.startup import STARTUP
+
 log = logging.getLogger(__name__)
 
+DEVICE_TRANSITION_TIMEOUT = 5.0
+
 
 class DeviceWorker(ScheduleWorker):
-    def __init__(self):
+    DEVICE_RUNTIME = "DEVICE_RUNTIME"
+    DEVICE_RUNTIME_THREAD = "thread"
+    DEVICE_RUNTIME_ASYNCIO = "asyncio"
+    DEVICE_RUNTIME_PROCESS = "process"
+    GPIO_BACKEND = "GPIO_BACKEND"
+
+    def __init__(self, start_devices=True):
+        """
+        :param start_devices: Start the devices right after adding them. A subclass whose callbacks
+                              need more state passes False and calls _auto_setup() once it is ready.
+        """
+        STARTUP.mark('imports')
         super(DeviceWorker, self).__init__()
+        STARTUP.worker_name = STARTUP.worker_name or self.name
         self.devices = {}
-        self.pausing_all_devices = False
-        self.add_devices()
-        self._start_all_devices()
+        self.device_transition_latency = {}
+        self.grafana_rows = None
+        self.clock = self._create_clock()
+        self.gpio_backend = self._setting(self.GPIO_BACKEND, GPIO_BACKEND_SYSFS)
+        self.device_runtime = self._create_device_runtime()
+        with STARTUP.phase('devices'):
+            self.add_devices()
+        if start_devices:
+            self._auto_setup()
+
+    def _auto_setup(self):
+        with STARTUP.phase('auto_setup'):
+            self._start_all_devices()
 
     def worker_info(self):
         return {
@@ -26,15 +60,46 @@ class DeviceWorker(ScheduleWorker):
     def add_devices(self):
         pass
 
+    def _setting(self, key, default=None):
+        """
+        :return: The worker setting key, from the environment unless a subclass keeps its own.
+        """
+        return os.environ.get(key, default)
+
+    def _create_clock(self):
+        return REAL_CLOCK
+
+    def _create_gpio(self, io):
+        # Actuators get their output pin through the backend the worker is configured for
+        return create_gpio(io, self.gpio_backend)
+
     def _add_device(self, name, device):
+        device.set_clock(self.clock)
+        device.metrics = DeviceMetrics(self.name, name)
         self.devices[name] = device
+        self.grafana_rows = None  # The dashboard follows the devices
 
     def _get_device(self, name):
         return self.devices[name]
 
+    def _create_device_runtime(self):
+        # One OS thread per device unless the shared event loop or the process runtime is asked for
+        runtime = self._setting(self.DEVICE_RUNTIME, self.DEVICE_RUNTIME_THREAD).lower()
+        if runtime in [self.DEVICE_RUNTIME_ASYNCIO, self.DEVICE_RUNTIME_PROCESS]:
+            if self.clock is not REAL_CLOCK:
+                log.warning('The {0} device runtime only runs in real time, using threads'.format(runtime))
+                return None
+            # Imported here, asyncio and multiprocessing are not needed by the thread model
+            if runtime == self.DEVICE_RUNTIME_PROCESS:
+                from workers.devices.process import ProcessRuntime
+                return ProcessRuntime('{0}-devices'.format(self.__class__.__name__))
+            from workers.devices.runtime import DeviceRuntime
+            return DeviceRuntime('{0}-devices'.format(self.__class__.__name__))
+        return None
+
     def _start_all_devices(self):
         for name, device in self.devices.items():
-            device.run_device()
+            device.run_device(self.device_runtime)
         return
 
     def _is_any_device_enabled(self):
@@ -49,26 +114,43 @@ class DeviceWorker(ScheduleWorker):
                 return True
         return False
 
-    def _pause_all_devices(self):
-        if self.pausing_all_devices:
-            return
-        self._pausing_all_devices = True
-        while self._is_any_device_enabled():
-            log.debug('Trying to pause all passive devices...')
-            for device in self.devices.values():
-                device.pause_device()
-            time.sleep(1)
-        log.debug('All passive devices paused')
-        self._pausing_all_devices = False
-
-    def _resume_all_devices(self):
-        while self.pausing_all_devices:
-            time.sleep(1)
+    def _pause_all_devices(self, timeout=DEVICE_TRANSITION_TIMEOUT):
+        log.debug('Pausing all passive devices...')
+        for device in self.devices.values():
+            device.pause_device()
+        failed = self._wait_for_devices(timeout)
+        if failed:
+            log.warning('Devices {0} did not pause within {1} seconds'.format(failed, timeout))
+        else:
+            log.debug('All passive devices paused')
+        return failed
+
+    def _resume_all_devices(self, timeout=DEVICE_TRANSITION_TIMEOUT):
         log.debug('Resuming all passive devices...')
         for device in self.devices.values():
             device.resume_device()
-        log.debug('All passive devices resumed')
-        self.pausing_all_devices = False
+        failed = self._wait_for_devices(timeout)
+        if failed:
+            log.warning('Devices {0} did not resume within {1} seconds'.format(failed, timeout))
+        else:
+            log.debug('All passive devices resumed')
+        return failed
+
+    def _wait_for_devices(self, timeout=DEVICE_TRANSITION_TIMEOUT):
+        """
+        Waits until every device loop acknowledged its last requested state, sharing one deadline
+        between all devices, and records the transition latency of each device.
+        :return: List with the names of the devices that did not reach their state in time.
+        """
+        deadline = time.monotonic() + timeout
+        failed = []
+        for name, device in self.devices.items():
+            if not device.wait_until_acknowledged(max(0.0, deadline - time.monotonic())):
+                failed.append(name)
+            elif device.transition_latency is not None:
+                self.device_transition_latency[name] = device.transition_latency
+        log.debug('Device transition latency: {0}'.format(self.device_transition_latency))
+        return failed
 
     def _stop_all_devices(self):
         for device in self.devices.values():
@@ -76,3 +158,63 @@ class DeviceWorker(ScheduleWorker):
 
     def _send_measurement(self, worker_measurement):
         pass  # TODO: send to prometheus
+
+    def _get_grafana_rows(self):
+        """
+        :return: Dashboard rows for the devices of this worker, built once until a device is added.
+        """
+        if self.grafana_rows is None:
+            self.grafana_rows = self._build_grafana_rows()
+        return self.grafana_rows
+
+    def _grafana_pairs(self):
+        """
+        :return: List of (probe name, SSR name) plotted together in one panel, either may be None.
+        """
+        probes = []
+        ssrs = []
+        for name, device in self.devices.items():
+            if isinstance(device, SSR):
+                ssrs.append(name)
+            elif isinstance(device, ProbeGroup):
+                probes.extend(member.name for member in device.members)
+            elif isinstance(device, Probe):
+                probes.append(name)
+        return [(probes[i] if i < len(probes) else None, ssrs[i] if i < len(ssrs) else None)
+                for i in range(max(len(probes), len(ssrs)))]
+
+    def _build_grafana_rows(self):
+        pairs = self._grafana_pairs()
+        panels = []
+        for probe, ssr in pairs:
+            title = self.name if len(pairs) == 1 else '{0} {1}'.format(self.name, probe or ssr)
+            targets = []
+            if probe is not None:
+                targets.append(('TEMPERATURE' + grafana.selector(name=self.name, device_name=probe), 'Temperature'))
+            if ssr is not None:
+                targets.append(('HEATING_RATIO' + grafana.selector(name=self.name, device_name=ssr), 'Heating Time'))
+            panels.append(grafana.graph(len(panels) + 1, title, targets, 'celsius', 'percentunit', ['Heating Time']))
+        rows = [grafana.row(panels)] if panels else []
+        rows.append(self._build_grafana_internals_row(len(panels) + 1))
+        return rows
+
+    def _build_grafana_internals_row(self, first_id):
+        name = grafana.selector(name=self.name)
+        return grafana.row([
+            grafana.graph(first_id, 'Latency (p99)', [
+                ('histogram_quantile(0.99, rate(PROBE_READ_SECONDS_bucket' + name + '[5m]))', '{{device_name}} read'),
+                ('histogram_quantile(0.99, rate(CALLBACK_SECONDS_bucket' + name + '[5m]))', 'Callback'),
+                ('histogram_quantile(0.99, rate(DEVICE_LOOP_JITTER_SECONDS_bucket' + name + '[5m]))',
+                 '{{device_name}} jitter')
+            ], 's', span=4),
+            grafana.graph(first_id + 1, 'Errors and stalls', [
+                ('rate(PROBE_READ_ERRORS_total' + name + '[5m]) * 60', '{{device_name}} {{reason}} errors/min'),
+                ('increase(DEVICE_STALLS_total' + name + '[5m])', '{{device_name}} stalls'),
+                ('MEASUREMENTS_DROPPED' + name, 'Dropped measurements'),
+                ('time() - DEVICE_LAST_CYCLE' + name, '{{device_name}} seconds since cycle')
+            ], 'short', span=4),
+            grafana.graph(first_id + 2, 'SSR duty error', [
+                ('histogram_quantile(0.5, rate(SSR_DUTY_ERROR_bucket' + name + '[5m]))', '{{device_name}} p50'),
+                ('histogram_quantile(0.99, rate(SSR_DUTY_ERROR_bucket' + name + '[5m]))', '{{device_name}} p99')
+            ], 'percentunit', span=4)
+        ], self.name + ' control loop', collapse=True)
@@ -3,10 +3,12 @@ import logging
 import threading
 import time
 
+from workers.utils.clock import REAL_CLOCK, VirtualClock
+from workers.utils.metrics import NOOP_DEVICE_METRICS, DEVICE_STALL_FACTOR
+
 log = logging.getLogger(__name__)
 
 DEVICE_DEBUG_CYCLE_TIME = 1.0
-DEVICE_PAUSE_CYCLE_TIME = 2.0
 
 
 class Device(threading.Thread):
@@ -21,15 +23,28 @@ class Device(threading.Thread):
         self.read_write_lock = threading.Lock()
         self.shutdown = False
         self.enabled = False
+        self.runtime = None
+        self.clock = REAL_CLOCK
+        # State as acknowledged by the device loop, guarded by state_condition
+        self.state_condition = threading.Condition()
+        self.loop_running = False
+        self.transition_requested = None
+        self.transition_latency = None
+        self._wakeup = threading.Event()
+        self._interrupted = False
+        self.metrics = NOOP_DEVICE_METRICS
+        self.cycle_started = None
 
     def init(self):
         pass
 
     def activate(self):
         self.active = True
+        self._state_changed()
 
     def deactivate(self):
         self.active = False
+        self._state_changed()
 
     def is_active(self):
         return self.active
@@ -38,30 +53,186 @@ class Device(threading.Thread):
         if self.enabled or self.active:
             self.callback(measured_value)
 
-    def run_device(self):
+    def run_device(self, runtime=None):
+        """
+        Starts the device loop, either on its own thread or, if a runtime is given, as a task
+        on the shared event loop of that runtime or in a process of its own.
+        """
         if self.enabled:
             return
+        if runtime is not None and runtime.isolates(self):
+            runtime.add_device(self)  # The device is set up in its process
+            return
         ok, msg = self.auto_setup()
         log.info(ok)
         if msg is not None:
             log.info(msg)
-        self.start()
+        if runtime is None:
+            self.start()
+        else:
+            runtime.add_device(self)
 
     def pause_device(self):
         self.enabled = False
+        self._state_changed()
 
     def resume_device(self):
         self.enabled = True
+        self._state_changed()
 
     def stop_device(self):
         self.shutdown = True
+        self._state_changed()
+
+    def should_run(self):
+        return not self.shutdown and (self.enabled or self.active)
+
+    def _state_changed(self):
+        with self.state_condition:
+            if self.transition_requested is None and self.loop_running != self.should_run():
+                self.transition_requested = time.monotonic()
+        self._wakeup.set()
+        self.clock.notify()
+        if self.runtime is not None:
+            self.runtime.wake(self)
+
+    def interrupt(self):
+        """
+        Cuts the sleep the current cycle is in short without pausing the device, i.e. to act on
+        a new value written to it.
+        """
+        self._interrupted = True
+        self._wakeup.set()
+        self.clock.notify()
+        if self.runtime is not None:
+            self.runtime.wake(self)
+
+    def _acknowledge(self, running, idle=True):
+        """
+        Called by the device loop whenever it (re)evaluates its state, wakes up anyone waiting
+        in wait_until_acknowledged and records how long the transition took.
+        :param idle: False if the loop runs elsewhere and idles the device there.
+        """
+        if idle and self.loop_running and not running:
+            try:
+                self.idle()
+            except Exception as e:
+                log.warning('Unable to idle device {0}: {1}'.format(self.name, e))
+        with self.state_condition:
+            if self.transition_requested is not None and running == self.should_run():
+                self.transition_latency = time.monotonic() - self.transition_requested
+                self.transition_requested = None
+            self.loop_running = running
+            self.state_condition.notify_all()
+
+    def is_loop_thread(self):
+        if self.runtime is not None:
+            return self.runtime.is_runtime_thread()
+        return threading.current_thread() is self
+
+    def wait_until_acknowledged(self, timeout=None):
+        """
+        Blocks until the device loop runs or idles as requested by the last
+        pause/resume/activate/deactivate/stop call.
+        :return: True if acknowledged, False if the timeout expired first.
+        """
+        if self.is_loop_thread():
+            return True  # The loop acknowledges as soon as the caller returns to it
+        with self.state_condition:
+            return self.state_condition.wait_for(lambda: self.loop_running == self.should_run(), timeout)
+
+    def simulation_cycle_time(self):
+        """
+        :return: Seconds a simulated device sleeps per cycle. On a virtual clock that is the whole
+                 cycle_time, which the simulation steps by, in real time only DEVICE_DEBUG_CYCLE_TIME.
+        """
+        if isinstance(self.clock, VirtualClock):
+            return float(self.cycle_time)
+        return DEVICE_DEBUG_CYCLE_TIME
+
+    def sleep(self, seconds):
+        """
+        Sleeps inside a cycle, but returns early if the device is paused, stopped or interrupted.
+        :return: False if paused or stopped, otherwise True.
+        """
+        deadline = self.clock.monotonic() + seconds
+        while self.should_run():
+            if self._interrupted:
+                self._interrupted = False
+                return True
+            remaining = deadline - self.clock.monotonic()
+            if remaining <= 0:
+                return True
+            if self.clock.wait(self._wakeup, remaining):
+                self._wakeup.clear()
+        return False
+
+    async def sleep_async(self, seconds):
+        return await self.runtime.sleep(self, seconds)
+
+    def idle(self):
+        pass
+
+    def process_spec(self):
+        """
+        :return: (class, (name, io, active, cycle_time), keyword arguments, attributes) to build a
+                 copy of this device in a device process, see devices.process. The callback is
+                 added to the arguments there. None if the device can not run in a process.
+        """
+        return None
+
+    def process_input(self):
+        """
+        :return: The float the copy in a device process needs from this device, i.e. the SSR duty.
+        """
+        return 0.0
+
+    def set_process_input(self, value):
+        pass
+
+    def process_output(self):
+        """
+        :return: A float the copy in a device process sends along with every callback.
+        """
+        return 0.0
+
+    def process_callback(self, measured_value, output):
+        self.do_callback(measured_value)
+
+    def process_stale(self, age):
+        pass
+
+    def set_clock(self, clock):
+        self.clock = clock
 
     def run(self):
-        while not self.shutdown:
-            if self.enabled or self.active:
-                self.run_cycle()
-            else:
-                time.sleep(DEVICE_PAUSE_CYCLE_TIME)
+        self.clock.register()
+        try:
+            while not self.shutdown:
+                self._wakeup.clear()
+                self._interrupted = False
+                running = self.should_run()
+                self._acknowledge(running)
+                if running:
+                    self._record_cycle()
+                    self.run_cycle()
+                else:
+                    self.cycle_started = None
+                    self.clock.wait(self._wakeup)
+        finally:
+            self._acknowledge(False)
+            self.clock.unregister()
+
+    def _record_cycle(self):
+        # Real time on purpose, this is about how the thread gets scheduled
+        now = time.monotonic()
+        if self.cycle_started is not None:
+            period = now - self.cycle_started
+            self.metrics.loop_jitter.observe(abs(period - self.cycle_time))
+            if period > DEVICE_STALL_FACTOR * self.cycle_time + 1.0:
+                self.metrics.loop_stalls.inc()
+        self.cycle_started = now
+        self.metrics.last_cycle.set_to_current_time()
 
     def run_cycle(self):
         pass
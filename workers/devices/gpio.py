@@ -0,0 +1,208 @@
+#!/usr/bin python
+import logging
+import mmap
+import os
+import re
+import time
+from collections import deque
+
+from workers.devices.sysfs import SysfsFile
+
+log = logging.getLogger(__name__)
+
+SYSFS_GPIO_ROOT = '/sys/class/gpio'
+GPIO_MEMORY_DEVICE = '/dev/gpiomem'
+GPIO_BACKEND_SYSFS = 'sysfs'
+GPIO_BACKEND_MEMORY = 'gpiomem'
+GPIO_BACKEND_FAKE = 'fake'
+
+# BCM283x GPIO registers, as 32 bit word offsets into /dev/gpiomem
+GPFSEL0 = 0x00 // 4  # Function select, 3 bits per pin, 10 pins per register
+GPSET0 = 0x1c // 4  # Writing a 1 bit drives the pin high
+GPCLR0 = 0x28 // 4  # Writing a 1 bit drives the pin low
+GPLEV0 = 0x34 // 4  # Pin levels
+GPIO_FUNCTION_OUTPUT = 0b001
+GPIO_MEMORY_SIZE = 4096
+FAKE_GPIO_EDGES = 100000  # Edges a recording FakeGPIO keeps, the oldest are dropped first
+
+_gpio_number = re.compile(r'gpio(\d+)')
+
+
+def gpio_pin(io):
+    """
+    :param io: Path of a sysfs value file like "/sys/class/gpio/gpio17/value", or the pin number.
+    :return: BCM pin number.
+    """
+    found = _gpio_number.search(str(io))
+    if found is not None:
+        return int(found.group(1))
+    return int(io)
+
+
+class GPIO(object):
+    """
+    One output pin. Actuators only call check/setup_output once and then write/read, so the way the
+    pin is reached (sysfs files, registers, memory) is up to the backend.
+    """
+
+    def __init__(self, pin):
+        self.pin = pin
+
+    def check(self):
+        """
+        :return: True if the pin is ready to be used as an output.
+        """
+        return True
+
+    def setup_output(self):
+        pass
+
+    def write(self, on):
+        pass
+
+    def read(self):
+        """
+        :return: True if the pin is high.
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class SysfsGPIO(GPIO):
+    """
+    The deprecated /sys/class/gpio interface. The value file is kept open, see SysfsFile, but every
+    write still is a system call through the kernel attribute code.
+    """
+
+    def __init__(self, io):
+        GPIO.__init__(self, gpio_pin(io))
+        if _gpio_number.search(str(io)) is None:
+            io = os.path.join(SYSFS_GPIO_ROOT, 'gpio{0}'.format(self.pin), 'value')
+        self.path = io
+        self.directory = os.path.dirname(io)
+        self.value_file = SysfsFile(io, writable=True)
+
+    def check(self):
+        log.info("Checking io")
+        log.info(self.path)
+        try:
+            with open(self.path):
+                return True
+        except IOError:
+            log.warning("Unable to find/open \"{0}\"".format(self.path))
+            return False
+
+    def setup_output(self):
+        try:
+            export_file = os.path.join(os.path.dirname(self.directory), 'export')
+            log.info(export_file)
+            with open(export_file, mode='w') as fo:
+                fo.write(str(self.pin))
+            direction_file = os.path.join(self.directory, 'direction')
+            log.info(direction_file)
+            with open(direction_file, mode='w') as fo:
+                fo.write("out")
+        except Exception:
+            raise Exception("Cannot register gpio{0}".format(self.pin))
+
+    def write(self, on):
+        self.value_file.write(b'1' if on else b'0')
+
+    def read(self):
+        length = self.value_file.read()
+        return self.value_file.buffer[:length].strip() == b'1'
+
+    def close(self):
+        self.value_file.close()
+
+
+class MemoryGPIO(GPIO):
+    """
+    Drives the pin through the BCM283x GPIO registers mapped from /dev/gpiomem (Raspberry Pi), which
+    needs no root and no system call per write, a toggle is a single store into the mapping. The
+    mapping is opened on first use.
+    """
+
+    def __init__(self, io, device=GPIO_MEMORY_DEVICE):
+        GPIO.__init__(self, gpio_pin(io))
+        self.device = device
+        self.registers = None
+        self.mapping = None
+        self.bank = self.pin // 32
+        self.mask = 1 << (self.pin % 32)
+
+    def open(self):
+        fd = os.open(self.device, os.O_RDWR | os.O_SYNC)
+        try:
+            self.mapping = mmap.mmap(fd, GPIO_MEMORY_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        self.registers = memoryview(self.mapping).cast('I')
+
+    def check(self):
+        # The function of a pin is not kept across reboots, so it is always set up
+        return False
+
+    def setup_output(self):
+        if self.registers is None:
+            self.open()
+        index = GPFSEL0 + self.pin // 10
+        shift = (self.pin % 10) * 3
+        self.registers[index] = (self.registers[index] & ~(0b111 << shift)) | (GPIO_FUNCTION_OUTPUT << shift)
+
+    def write(self, on):
+        if self.registers is None:
+            self.open()
+        self.registers[(GPSET0 if on else GPCLR0) + self.bank] = self.mask
+
+    def read(self):
+        if self.registers is None:
+            self.open()
+        return bool(self.registers[GPLEV0 + self.bank] & self.mask)
+
+    def close(self):
+        if self.registers is not None:
+            self.registers.release()
+            self.mapping.close()
+            self.registers = None
+            self.mapping = None
+
+
+class FakeGPIO(GPIO):
+    """
+    Keeps the pin level in memory, for simulations and tests. With record every write is kept as
+    (monotonic time, level) in edges, up to the newest max_edges.
+    """
+
+    def __init__(self, io=0, record=False, max_edges=FAKE_GPIO_EDGES):
+        GPIO.__init__(self, gpio_pin(io))
+        self.level = False
+        self.record = record
+        self.edges = deque(maxlen=max_edges)
+
+    def write(self, on):
+        self.level = bool(on)
+        if self.record:
+            self.edges.append((time.monotonic(), self.level))
+
+    def read(self):
+        return self.level
+
+
+GPIO_BACKENDS = {
+    GPIO_BACKEND_SYSFS: SysfsGPIO,
+    GPIO_BACKEND_MEMORY: MemoryGPIO,
+    GPIO_BACKEND_FAKE: FakeGPIO
+}
+
+
+def create_gpio(io, backend=None):
+    """
+    :param backend: One of GPIO_BACKENDS, sysfs if not given.
+    """
+    backend = (backend or GPIO_BACKEND_SYSFS).lower()
+    if backend not in GPIO_BACKENDS:
+        raise ValueError('Unknown gpio backend "{0}", use one of {1}'.format(backend, sorted(GPIO_BACKENDS)))
+    return GPIO_BACKENDS[backend](io)
@@ -0,0 +1,144 @@
+#!/usr/bin python
+import logging
+import threading
+
+from workers.utils.clock import REAL_CLOCK
+from workers.utils.metrics import NOOP_DEVICE_METRICS
+
+log = logging.getLogger(__name__)
+
+PREFETCH_RETRIES = 3  # Reads per cycle before the cycle is given up
+PREFETCH_RETRY_DELAY = 0.1
+PREFETCH_MAX_JUMP = 5.0  # Largest change between two samples that is believed right away
+PREFETCH_CONFIRMATIONS = 3  # Agreeing jumped samples in a row after which the jump is believed
+PREFETCH_STALE_CYCLES = 3  # A sample older than this many cycles (plus the read) is stale
+
+
+class Sample(object):
+    __slots__ = ['value', 'timestamp', 'monotonic']
+
+    def __init__(self, value, timestamp, monotonic):
+        self.value = value
+        self.timestamp = timestamp  # Unix time of the read
+        self.monotonic = monotonic
+
+
+class Prefetcher(object):
+    """
+    Calls a slow read function on its own thread every interval and publishes the last sample that
+    passed validation in latest, which a device loop picks up without waiting. Failed reads
+    (exceptions, or None) are retried up to retries times per cycle. A value further than max_jump
+    from the last good one is rejected as an outlier, unless the values of confirmations cycles in
+    a row jumped and agree with each other, then the jump is real and the newest is published.
+
+    Reads only happen while should_run() is true, wake() has to be called when that changes.
+    """
+
+    def __init__(self, read, interval, name='prefetch', should_run=None, retries=PREFETCH_RETRIES,
+                 retry_delay=PREFETCH_RETRY_DELAY, max_jump=PREFETCH_MAX_JUMP, confirmations=PREFETCH_CONFIRMATIONS):
+        self.read = read
+        self.interval = interval
+        self.name = name
+        self.should_run = should_run or (lambda: True)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_jump = max_jump
+        self.confirmations = confirmations
+        self.metrics = NOOP_DEVICE_METRICS
+        self.clock = REAL_CLOCK
+        self.latest = None
+        self.failures = 0  # Cycles in a row without a good sample
+        self.rejected = []  # Outliers in a row, newest last
+        self.running = False
+        self.thread = None
+        self._wakeup = threading.Event()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wake()
+
+    def wake(self):
+        self._wakeup.set()
+        self.clock.notify()
+
+    def reset(self):
+        """
+        Forgets the samples read so far, the next one published is read after this call.
+        """
+        self.latest = None
+        self.failures = 0
+        self.rejected = []
+
+    def age(self):
+        """
+        :return: Seconds since the latest sample was read, None if there is none.
+        """
+        latest = self.latest
+        if latest is None:
+            return None
+        return self.clock.monotonic() - latest.monotonic
+
+    def fetch(self):
+        """
+        Reads until one value passes or the retries are used up, and publishes it.
+        :return: The published sample or None.
+        """
+        for attempt in range(self.retries):
+            if attempt:
+                self.clock.sleep(self.retry_delay)
+            try:
+                value = self.read()
+            except Exception as e:
+                log.debug('Read {0} of {1} failed: {2}'.format(attempt + 1, self.name, e))
+                continue
+            if value is None:
+                continue
+            if self._accept(value):
+                self.latest = Sample(value, self.clock.time(), self.clock.monotonic())
+                self.failures = 0
+                return self.latest
+            break  # The read worked, rereading right away would only confirm the outlier
+        self.failures += 1
+        if self.failures == 1 or self.failures % 10 == 0:
+            log.warning('No valid reading of {0} for {1} cycles, keeping the one from {2}s ago'.format(
+                self.name, self.failures, self.age()))
+        return None
+
+    def _accept(self, value):
+        latest = self.latest
+        if latest is None or abs(value - latest.value) <= self.max_jump:
+            self.rejected = []
+            return True
+        self.rejected.append(value)
+        if len(self.rejected) >= self.confirmations and \
+                max(self.rejected) - min(self.rejected) <= self.max_jump:
+            log.info('{0} jumped from {1} to {2}'.format(self.name, latest.value, value))
+            self.rejected = []
+            return True
+        del self.rejected[:-self.confirmations]
+        self.metrics.read_outliers.inc()
+        log.debug('Rejected {0} from {1}, last good value is {2}'.format(value, self.name, latest.value))
+        return False
+
+    def _run(self):
+        self.clock.register()
+        try:
+            while self.running:
+                self._wakeup.clear()
+                if not self.should_run():
+                    self.clock.wait(self._wakeup)
+                    continue
+                start = self.clock.monotonic()
+                self.fetch()
+                remaining = self.interval - (self.clock.monotonic() - start)
+                if remaining > 0:
+                    self.clock.wait(self._wakeup, remaining)
+        finally:
+            self.clock.unregister()
@@ -2,18 +2,48 @@
 import logging
 import time
 
-from workers.devices.device import Device, DEVICE_DEBUG_CYCLE_TIME
+from workers.devices.device import Device
+from workers.devices.prefetch import PREFETCH_STALE_CYCLES, Prefetcher
+from workers.devices.sysfs import SysfsFile, parse_w1_slave
 
 log = logging.getLogger(__name__)
 
+PROBE_FIRST_SAMPLE_POLL = 0.05  # Seconds between looks for the first sample of the prefetch
+
 
 class Probe(Device):
+    """
+    A DS18B20 on 1-wire. The slow read runs on a Prefetcher thread, the device loop hands the
+    latest validated sample to the callback without waiting for the bus. When that sample is older
+    than stale_age, the cycle calls stale_callback(age) instead (age is None before any sample).
+    """
+
     def __init__(self, name, io, active, cycle_time, callback, owner=None):
         Device.__init__(self, name, io, active, cycle_time, callback, owner)
         self.test_temperature = 0.0
+        self.w1_slave = SysfsFile(io)
+        self.prefetch = Prefetcher(self.read, cycle_time, '{0}-prefetch'.format(name), self.should_run)
+        self.stale_age = PREFETCH_STALE_CYCLES * cycle_time + 1.0
+        self.stale_callback = None
 
     def init(self):
-        pass
+        self.prefetch.metrics = self.metrics
+        self.prefetch.start()
+
+    def set_clock(self, clock):
+        Device.set_clock(self, clock)
+        self.prefetch.clock = clock
+
+    def stop_device(self):
+        Device.stop_device(self)
+        self.prefetch.stop()
+
+    def _state_changed(self):
+        if self.should_run() and not self.loop_running:
+            # The sample from before a pause says nothing about now, wait for a fresh one as on a first start
+            self.prefetch.reset()
+        Device._state_changed(self)
+        self.prefetch.wake()
 
     def register(self):
         log.error(
@@ -24,28 +54,83 @@ class Probe(Device):
         pass
 
     def read(self):
-        with self.read_write_lock:
-            fo = open(self.io, mode='r')
-            probe_crc = fo.readline()[-4:].rstrip()
-            if probe_crc != 'YES':
-                log.debug('Temp reading wrong, do not update temp, wait for next reading')
-            else:
-                probe_heat = fo.readline().split('=')[1]
-            temperature = float(probe_heat) / 1000
-            fo.close()
-        return temperature
+        start = time.monotonic()
+        try:
+            with self.read_write_lock:
+                length = self.w1_slave.read()
+                probe_heat = parse_w1_slave(self.w1_slave.buffer, length)
+        except OSError:
+            self.metrics.read_io_errors.inc()
+            raise
+        finally:
+            self.metrics.read_seconds.observe(time.monotonic() - start)
+        if probe_heat is None:
+            self.metrics.read_crc_errors.inc()
+            log.debug('Temp reading wrong, do not update temp, wait for next reading')
+            raise IOError('CRC check failed for probe at "{0}"'.format(self.io))
+        return probe_heat / 1000.0
 
-    def run_cycle(self):
-        read_value = self.read()
-        measured_value = float(read_value)
+    def consume(self):
+        """
+        Passes the latest sample on, never waits for the bus.
+        :return: False while the first read is still running, otherwise True.
+        """
+        sample = self.prefetch.latest
+        if sample is None and self.prefetch.failures == 0:
+            return False
+        age = self.prefetch.age()
+        if sample is None or age > self.stale_age:
+            self.metrics.read_stale.inc()
+            if self.stale_callback is not None and (self.enabled or self.active):
+                self.stale_callback(age)
+            return True
+        self.metrics.sample_age.set(age)
+        self.do_callback(sample.value)
+        return True
+
+    def process_spec(self):
+        return type(self), (self.name, self.io, self.active, self.cycle_time), {}, {'stale_age': self.stale_age}
+
+    def process_output(self):
+        return self.prefetch.age() or 0.0
+
+    def process_callback(self, measured_value, output):
+        self.metrics.sample_age.set(output)
         self.do_callback(measured_value)
-        time.sleep(self.cycle_time)
+
+    def process_stale(self, age):
+        self.metrics.read_stale.inc()
+        if self.stale_callback is not None and (self.enabled or self.active):
+            self.stale_callback(age)
+
+    def run_cycle(self):
+        deadline = self.clock.monotonic() + self.cycle_time
+        # Right after a (re)start the first sample is passed on as soon as it is read, not a cycle later
+        while not self.consume():
+            remaining = deadline - self.clock.monotonic()
+            if remaining <= 0 or not self.sleep(min(remaining, PROBE_FIRST_SAMPLE_POLL)):
+                return
+        self.sleep(deadline - self.clock.monotonic())
+
+    async def run_cycle_async(self):
+        deadline = self.clock.monotonic() + self.cycle_time
+        while not self.consume():
+            remaining = deadline - self.clock.monotonic()
+            if remaining <= 0 or not await self.sleep_async(min(remaining, PROBE_FIRST_SAMPLE_POLL)):
+                return
+        await self.sleep_async(deadline - self.clock.monotonic())
 
 
 class SimulationProbe(Probe):
     def __init__(self, name, io, active, cycle_time, callback, owner=None):
         Probe.__init__(self, name, io, active, cycle_time, callback, owner)
 
+    def init(self):
+        pass  # Reading the simulation is instant, no prefetch
+
+    def process_spec(self):
+        return None  # The simulated kettle lives in the worker
+
     def register(self):
         return True
 
@@ -59,4 +144,10 @@ class SimulationProbe(Probe):
         read_value = self.read()
         measured_value = float(read_value)
         self.do_callback(measured_value)
-        time.sleep(DEVICE_DEBUG_CYCLE_TIME)
+        self.sleep(self.simulation_cycle_time())
+
+    async def run_cycle_async(self):
+        read_value = self.read()
+        measured_value = float(read_value)
+        self.do_callback(measured_value)
+        await self.sleep_async(self.simulation_cycle_time())
@@ -0,0 +1,159 @@
+#!/usr/bin python
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from workers.devices.device import Device
+from workers.devices.sysfs import SysfsFile, parse_w1_slave
+from workers.utils.lazy import lazy_import
+
+asyncio = lazy_import('asyncio')  # Only the DeviceRuntime, which has it imported, runs run_cycle_async
+
+log = logging.getLogger(__name__)
+
+W1_ROOT = '/sys/bus/w1/devices'
+W1_BUS_MASTER = 'w1_bus_master1'
+W1_BULK_READ = 'therm_bulk_read'
+W1_BULK_TRIGGER = b'trigger'
+W1_BULK_IN_PROGRESS = b'-1'
+W1_CONVERSION_TIME = 0.75  # Worst case DS18B20 12 bit conversion
+W1_CONVERSION_POLL = 0.05
+
+
+class GroupMember(object):
+    def __init__(self, name, io, callback):
+        self.name = name
+        self.io = io
+        self.callback = callback
+        self.w1_slave = SysfsFile(io)
+
+
+class ProbeGroup(Device):
+    """
+    Reads all probes on one 1-wire bus each cycle. Conversions are started together with a bulk
+    "trigger" on the bus master when the kernel offers therm_bulk_read, otherwise the reads (each
+    doing its own conversion) run concurrently. Every reading goes to the callback of its probe as
+    callback(temperature, timestamp).
+
+    io is the bus master directory name below w1_root, i.e. "w1_bus_master1". w1_root can point at
+    a fake sysfs tree for testing.
+    """
+
+    def __init__(self, name, io, active, cycle_time, callback=None, owner=None, w1_root=W1_ROOT):
+        Device.__init__(self, name, io or W1_BUS_MASTER, active, cycle_time, callback, owner)
+        self.w1_root = w1_root
+        self.members = []
+        self.bulk_read = SysfsFile(os.path.join(w1_root, self.io, W1_BULK_READ), writable=True)
+        self.executor = None
+        self.executor_size = 0
+
+    def add_probe(self, name, io, callback):
+        """
+        :param io: Path to the w1_slave file of the probe or only its slave id, i.e. "28-0316a2795dff".
+        """
+        if not os.path.isabs(io):
+            io = os.path.join(self.w1_root, io, 'w1_slave')
+        self.members.append(GroupMember(name, io, callback))
+
+    def init(self):
+        self._member_executor()
+
+    def _member_executor(self):
+        # One thread per probe, grown when probes were added after init()
+        size = max(1, len(self.members))
+        if self.executor is None or self.executor_size < size:
+            previous = self.executor
+            self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix=self.name)
+            self.executor_size = size
+            if previous is not None:
+                previous.shutdown(wait=False)
+        return self.executor
+
+    def stop_device(self):
+        Device.stop_device(self)
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def check(self):
+        missing = [member.io for member in self.members if not os.path.exists(member.io)]
+        for io in missing:
+            log.warning("Unable to find/open \"{0}\"".format(io))
+        return len(missing) == 0
+
+    def register(self):
+        log.error(
+            "Can not register probes on \"{0}\", try to run \"sudo modprobe w1-gpio && sudo modprobe w1_therm\" in commandline or check your probe connections".format(
+                self.io))
+
+    def has_bulk_read(self):
+        return os.path.exists(self.bulk_read.path)
+
+    def trigger(self):
+        """
+        Starts a conversion on every probe of the bus at once.
+        :return: True if a bulk conversion was triggered.
+        """
+        if not self.has_bulk_read():
+            return False
+        try:
+            self.bulk_read.write(W1_BULK_TRIGGER)
+            return True
+        except OSError as e:
+            log.debug('Bulk trigger on "{0}" failed, reading probes one by one: {1}'.format(self.io, e))
+            return False
+
+    def conversion_done(self):
+        length = self.bulk_read.read()
+        return not self.bulk_read.buffer.startswith(W1_BULK_IN_PROGRESS, 0, length)
+
+    def read_member(self, member):
+        try:
+            length = member.w1_slave.read()
+            probe_heat = parse_w1_slave(member.w1_slave.buffer, length)
+        except OSError as e:
+            log.warning('Unable to read probe {0} at "{1}": {2}'.format(member.name, member.io, e))
+            return None, self.clock.time()
+        if probe_heat is None:
+            log.debug('Temp reading wrong for {0}, wait for next reading'.format(member.name))
+            return None, self.clock.time()
+        return probe_heat / 1000.0, self.clock.time()
+
+    def deliver(self, results):
+        for member, (temperature, timestamp) in zip(self.members, results):
+            if temperature is not None and (self.enabled or self.active):
+                member.callback(temperature, timestamp)
+
+    def run_cycle(self):
+        start = self.clock.monotonic()
+        if self.trigger():
+            deadline = start + W1_CONVERSION_TIME
+            while not self.conversion_done() and self.clock.monotonic() < deadline:
+                if not self.sleep(W1_CONVERSION_POLL):
+                    return
+        try:
+            results = list(self._member_executor().map(self.read_member, self.members))
+        except RuntimeError:
+            if self.shutdown:
+                return  # The executor was shut down by stop_device()
+            raise
+        self.deliver(results)
+        self.sleep(self.cycle_time - (self.clock.monotonic() - start))
+
+    async def run_cycle_async(self):
+        start = self.clock.monotonic()
+        if await self.runtime.run_blocking(self.trigger):
+            deadline = start + W1_CONVERSION_TIME
+            while not await self.runtime.run_blocking(self.conversion_done) and self.clock.monotonic() < deadline:
+                if not await self.sleep_async(W1_CONVERSION_POLL):
+                    return
+        loop = asyncio.get_event_loop()
+        executor = self._member_executor()
+        try:
+            results = await asyncio.gather(*[loop.run_in_executor(executor, self.read_member, member)
+                                             for member in self.members])
+        except RuntimeError:
+            if self.shutdown:
+                return  # The executor was shut down by stop_device()
+            raise
+        self.deliver(results)
+        await self.sleep_async(self.cycle_time - (self.clock.monotonic() - start))
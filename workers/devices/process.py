@@ -0,0 +1,383 @@
+#!/usr/bin python
+import logging
+import math
+import multiprocessing
+import signal
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from workers.utils.metrics import NOOP_METRIC
+
+log = logging.getLogger(__name__)
+
+PROCESS_POLL_INTERVAL = 0.1  # Longest the runtime waits before looking at the processes anyway
+PROCESS_PARENT_CHECK = 1.0  # How often a device process checks that the worker is still there
+PROCESS_STOP_TIMEOUT = 5.0
+
+SEQUENCE = struct.Struct('<Q')
+
+# Written by the worker, read by the device process
+CONTROL_FIELDS = [
+    ('enabled', '?'),
+    ('active', '?'),
+    ('shutdown', '?'),
+    ('value', 'd')  # Device.process_input(), i.e. the SSR duty
+]
+# DeviceMetrics a device process records for the worker: observe() sends the newest observation
+# and a count, inc() a count and set() the newest value
+FORWARDED_METRICS = {
+    'read_seconds': 'observe',
+    'read_crc_errors': 'inc',
+    'read_io_errors': 'inc',
+    'read_outliers': 'inc',
+    'loop_jitter': 'observe',
+    'loop_stalls': 'inc',
+    'last_cycle': 'set'
+}
+METRIC_FIELDS = {'observe': [('', 'd'), ('_count', 'Q')], 'inc': [('', 'Q')], 'set': [('', 'd')]}
+
+# Written by the device process, read by the worker
+STATUS_FIELDS = [
+    ('running', '?'),
+    ('callbacks', 'Q'),  # Number of callbacks so far, value and output are those of the newest
+    ('value', 'd'),
+    ('output', 'd'),  # Device.process_output() at that callback
+    ('stales', 'Q'),  # Number of stale cycles so far, age is that of the newest (nan without a sample)
+    ('age', 'd'),
+    ('timestamp', 'd')
+] + [(attribute + suffix, code) for attribute, kind in sorted(FORWARDED_METRICS.items())
+     for suffix, code in METRIC_FIELDS[kind]]
+
+
+class SharedState(object):
+    """
+    A fixed struct in a multiprocessing.shared_memory block with one writing process, guarded by a
+    seqlock: write() makes the sequence odd, stores the fields and makes it even again, read()
+    retries until it saw the same even sequence before and after the fields. Neither side ever
+    blocks on the other, so a slow reader can not hold up a PWM loop.
+
+    Created without a name it allocates the block, which it unlinks on close; with a name it
+    attaches to the block of another process.
+    """
+
+    def __init__(self, fields, name=None):
+        self.names = [field for field, _ in fields]
+        self.struct = struct.Struct('<' + ''.join(code for _, code in fields))
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner,
+                                                 size=SEQUENCE.size + self.struct.size)
+        self.name = self.memory.name
+        self.values = dict.fromkeys(self.names, 0)
+        self.sequence = 0
+
+    def write(self, **values):
+        """
+        Stores values, the fields not given keep what this writer stored last.
+        """
+        self.values.update(values)
+        buffer = self.memory.buf
+        self.sequence += 1
+        SEQUENCE.pack_into(buffer, 0, self.sequence)
+        self.struct.pack_into(buffer, SEQUENCE.size, *[self.values[name] for name in self.names])
+        self.sequence += 1
+        SEQUENCE.pack_into(buffer, 0, self.sequence)
+
+    def read(self):
+        """
+        :return: Dict of field name to value, all from the same write.
+        """
+        buffer = self.memory.buf
+        while True:
+            before = SEQUENCE.unpack_from(buffer, 0)[0]
+            if not before & 1:
+                values = self.struct.unpack_from(buffer, SEQUENCE.size)
+                if SEQUENCE.unpack_from(buffer, 0)[0] == before:
+                    return dict(zip(self.names, values))
+            time.sleep(0)  # The writer is in the middle of a write, let it finish
+
+    def close(self):
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class ForwardedMetric(object):
+    """
+    One of FORWARDED_METRICS on the copy of a device in its process, keeps what the worker needs
+    to record it in values.
+    """
+
+    def __init__(self, values, attribute):
+        self.values = values
+        self.attribute = attribute
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        self.values[self.attribute] = value
+        self.values[self.attribute + '_count'] += 1
+
+    def inc(self, value=1):
+        self.values[self.attribute] += value
+
+    def set(self, value):
+        self.values[self.attribute] = value
+
+    def set_to_current_time(self):
+        self.set(time.time())
+
+
+class ProcessMetrics(object):
+    """
+    Takes the place of DeviceMetrics on the copy of a device in its process. The metrics of
+    FORWARDED_METRICS go to the worker with every status update, the others are either sent
+    otherwise (sample age, stale cycles, SSR duty error) or not recorded.
+    """
+
+    def __init__(self):
+        self.values = dict((attribute + suffix, 0) for attribute, kind in FORWARDED_METRICS.items()
+                           for suffix, _ in METRIC_FIELDS[kind])
+
+    def __getattr__(self, attribute):
+        child = ForwardedMetric(self.values, attribute) if attribute in FORWARDED_METRICS else NOOP_METRIC
+        setattr(self, attribute, child)
+        return child
+
+
+class DeviceProcess(object):
+    """
+    The worker side of one device running in a process: its control and status blocks, the
+    semaphore that wakes it and the counters of what was already passed on.
+    """
+
+    def __init__(self, device, spec, context, notify):
+        self.device = device
+        self.control = SharedState(CONTROL_FIELDS)
+        self.status = SharedState(STATUS_FIELDS)
+        self.wake = context.Semaphore(0)
+        self.process = context.Process(
+            target=_run_device_process, name='{0}-process'.format(device.name), daemon=True,
+            args=(spec, self.control.name, self.status.name, self.wake, notify, logging.getLogger().level))
+        self.callbacks = 0
+        self.stales = 0
+        self.forwarded = dict.fromkeys(FORWARDED_METRICS, 0)  # Counts of FORWARDED_METRICS recorded so far
+
+    def update(self):
+        # Always under the lock of the runtime, the control block takes one writer at a time
+        device = self.device
+        self.control.write(enabled=device.enabled, active=device.active, shutdown=device.shutdown,
+                           value=device.process_input())
+        self.wake.release()
+
+    def close(self, timeout):
+        self.process.join(timeout)
+        if self.process.is_alive():
+            log.warning('Device process {0} did not stop, terminating it'.format(self.process.name))
+            self.process.terminate()
+            self.process.join(timeout)
+        self.control.close()
+        self.status.close()
+
+
+class ProcessRuntime(object):
+    """
+    Runs the loop of each device in a process of its own, so its timing does not depend on the
+    GIL of the worker (master messaging, Prometheus, logging). The worker keeps a stand-in of the
+    device: state changes and Device.process_input() (the SSR duty) go to the process through a
+    SharedState control block, callbacks (duty, samples) come back through a status block that one
+    thread of the runtime picks up. Nothing is pickled after the process started, and when the
+    worker falls behind, only the newest callback of a device is passed on.
+
+    Devices whose process_spec() is None, i.e. simulations that need the worker's state, run on
+    a thread as usual.
+    """
+
+    def __init__(self, name='ProcessRuntime', poll_interval=PROCESS_POLL_INTERVAL):
+        self.name = name
+        self.poll_interval = poll_interval
+        # A fresh interpreter, forking a worker with running threads could copy held locks
+        self.context = multiprocessing.get_context('spawn')
+        self.notify = self.context.Semaphore(0)
+        self.processes = {}
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=PROCESS_STOP_TIMEOUT):
+        self.running = False
+        self.notify.release()
+        if self.thread is not None and threading.current_thread() is not self.thread:
+            self.thread.join(timeout)
+        with self.lock:
+            processes = list(self.processes.values())
+            self.processes.clear()
+            for handle in processes:
+                handle.control.write(shutdown=True)
+                handle.wake.release()
+        for handle in processes:
+            handle.close(timeout)
+            handle.device._acknowledge(False, idle=False)
+
+    def is_runtime_thread(self):
+        # Device callbacks run on the thread polling the processes, which also relays their acknowledgements
+        return self.thread is not None and threading.current_thread() is self.thread
+
+    def isolates(self, device):
+        return device.process_spec() is not None
+
+    def add_device(self, device):
+        spec = device.process_spec()
+        if spec is None:
+            log.info('Device {0} can not run in a process, starting it on a thread'.format(device.name))
+            device.start()
+            return
+        with self.lock:
+            if device in self.processes:
+                return
+            handle = DeviceProcess(device, spec, self.context, self.notify)
+            self.processes[device] = handle
+            device.runtime = self
+            handle.update()
+        handle.process.start()
+        self.start()
+
+    def wake(self, device):
+        """
+        Passes the enabled/active/shutdown state and the process input of a device on to its
+        process. Safe to call from any thread.
+        """
+        with self.lock:
+            handle = self.processes.get(device)
+            if handle is not None:
+                handle.update()
+
+    def _run(self):
+        while self.running:
+            self.notify.acquire(timeout=self.poll_interval)
+            with self.lock:
+                processes = list(self.processes.values())
+            for handle in processes:
+                try:
+                    self._poll(handle)
+                except Exception as e:
+                    log.error('Handling device process {0} failed: {1}'.format(handle.process.name, e))
+
+    def _poll(self, handle):
+        device = handle.device
+        status = handle.status.read()
+        if status['callbacks'] != handle.callbacks:
+            handle.callbacks = status['callbacks']
+            device.process_callback(status['value'], status['output'])
+        if status['stales'] != handle.stales:
+            handle.stales = status['stales']
+            device.process_stale(None if math.isnan(status['age']) else status['age'])
+        self._record_metrics(handle, status)
+        alive = handle.process.is_alive()
+        running = status['running'] and alive
+        if running != device.loop_running:
+            device._acknowledge(running, idle=False)  # The process idles the hardware itself
+        if not alive:
+            if not device.shutdown:
+                log.error('Device process {0} exited with code {1}'.format(
+                    handle.process.name, handle.process.exitcode))
+            with self.lock:
+                if self.processes.pop(device, None) is handle:
+                    handle.close(0)
+
+
+    @staticmethod
+    def _record_metrics(handle, status):
+        # Like callbacks, only the newest observation reaches the worker when it falls behind
+        metrics = handle.device.metrics
+        for attribute, kind in FORWARDED_METRICS.items():
+            value = status[attribute]
+            seen = status[attribute + '_count'] if kind == 'observe' else value
+            if seen == handle.forwarded[attribute]:
+                continue
+            metric = getattr(metrics, attribute)
+            if kind == 'observe':
+                metric.observe(value)
+            elif kind == 'inc':
+                metric.inc(value - handle.forwarded[attribute])
+            else:
+                metric.set(value)
+            handle.forwarded[attribute] = seen
+
+
+def _raise_exit(signum, frame):
+    raise SystemExit(0)
+
+
+def _run_device_process(spec, control_name, status_name, wake, notify, log_level):
+    """
+    Main of a device process: builds the device from its process_spec(), runs its loop on a thread
+    and applies every control update until the worker stops the device or goes away.
+    """
+    logging.basicConfig(level=log_level, format='%(asctime)s %(processName)s %(name)s %(levelname)s %(message)s')
+    signal.signal(signal.SIGTERM, _raise_exit)
+    factory, args, kwargs, attributes = spec
+    control = SharedState(CONTROL_FIELDS, control_name)
+    status = SharedState(STATUS_FIELDS, status_name)
+    counts = {'callbacks': 0, 'stales': 0}
+    metrics = ProcessMetrics()
+
+    def publish(**values):
+        # Only the device thread publishes, the metrics recorded on other threads go along
+        values.update(metrics.values)
+        status.write(timestamp=time.time(), **values)
+        notify.release()
+
+    def callback(value):
+        counts['callbacks'] += 1
+        publish(callbacks=counts['callbacks'], value=value, output=device.process_output())
+
+    def stale(age):
+        counts['stales'] += 1
+        publish(stales=counts['stales'], age=float('nan') if age is None else age)
+
+    device = factory(*(tuple(args) + (callback,)), **kwargs)
+    device.metrics = metrics
+    for key, value in attributes.items():
+        setattr(device, key, value)
+    if hasattr(device, 'stale_callback'):
+        device.stale_callback = stale
+    acknowledge = device._acknowledge
+
+    def acknowledge_running(running, idle=True):
+        acknowledge(running, idle)
+        publish(running=running)
+
+    device._acknowledge = acknowledge_running
+    parent = multiprocessing.parent_process()
+    try:
+        device.run_device()
+        while True:
+            state = control.read()
+            if state['shutdown'] or not parent.is_alive():
+                break
+            device.set_process_input(state['value'])
+            if state['active'] and not device.active:
+                device.activate()
+            elif device.active and not state['active']:
+                device.deactivate()
+            if state['enabled'] and not device.enabled:
+                device.resume_device()
+            elif device.enabled and not state['enabled']:
+                device.pause_device()
+            wake.acquire(timeout=PROCESS_PARENT_CHECK)
+    finally:
+        device.stop_device()
+        if device.is_alive():
+            device.join(PROCESS_STOP_TIMEOUT)
+        control.close()
+        status.close()
@@ -0,0 +1,146 @@
+#!/usr/bin python
+import logging
+
+from workers.utils.clock import REAL_CLOCK
+
+log = logging.getLogger(__name__)
+
+PWM_LATENCY_SMOOTHING = 0.2  # Weight of the newest actuation in the latency average
+
+
+class DeadlinePWM(object):
+    """
+    Time proportional output scheduled against absolute clock.monotonic() deadlines, so that
+    actuation and callback time do not push the windows back. Edges are fired early by the
+    (averaged) time the actuation itself takes, and the duty cycle actually achieved in each
+    window is measured from the moments the actuation completed.
+
+    With a burst_period the window is split into slots of about that length and the on time is
+    spread over all of them as short pulses, for vessels with little thermal mass.
+    """
+
+    def __init__(self, actuate, cycle_time, burst_period=None, min_switch_interval=0.0):
+        self.actuate = actuate
+        self.cycle_time = float(cycle_time)
+        self.burst_period = burst_period
+        self.min_switch_interval = min_switch_interval
+        self.clock = REAL_CLOCK
+        self.latency = 0.0
+        self.state = None
+        self.last_switch = float('-inf')
+        self.next_window = None
+        self.window_closing = False
+        self.on_since = None
+        self.on_time = 0.0
+        self.requested_on_time = 0.0
+        self.achieved_duty = 0.0
+        self.duty_error = 0.0
+
+    def edges(self, duty):
+        """
+        :return: List of (offset in the window, on) for every switch in a window with this duty.
+        """
+        slots = 1
+        if self.burst_period:
+            slots = max(1, int(round(self.cycle_time / self.burst_period)))
+        slot_time = self.cycle_time / slots
+        pulse = duty * slot_time
+        edges = []
+        state = None
+        for slot in range(slots):
+            start = slot * slot_time
+            for offset, on in [(start, pulse > 0.0), (start + pulse, False)]:
+                if on != state and offset < start + slot_time:
+                    edges.append((offset, on))
+                    state = on
+        return edges
+
+    def switch(self, on):
+        if on == self.state:
+            return
+        before = self.clock.monotonic()
+        self.actuate(on)
+        now = self.clock.monotonic()
+        self.latency += PWM_LATENCY_SMOOTHING * ((now - before) - self.latency)
+        if on:
+            self.on_since = now
+        elif self.on_since is not None:
+            self.on_time += now - self.on_since
+            self.on_since = None
+        self.state = on
+        self.last_switch = now
+
+    def window(self, duty):
+        """
+        Generator running one window. It yields the monotonic deadline the caller has to sleep until
+        before each edge and finally, with window_closing set, just before the window ends. Abandoning
+        it leaves the window unfinished and the next one starts on its own fresh timeline. Work the
+        caller does per window (callbacks) belongs before that last sleep, so it can not delay the
+        first edge of the next window.
+
+        duty is either a number or a callable that is asked again every time the generator resumes.
+        Resuming it early, i.e. after a new duty was written, applies that duty to the rest of the
+        current window: the on phase is cut short or extended right away, but never switching
+        sooner than min_switch_interval after the previous switch.
+        """
+        duty_source = duty if callable(duty) else lambda: duty
+        now = self.clock.monotonic()
+        start = self.next_window
+        if start is None or now - start > self.cycle_time:
+            start = now
+        end = start + self.cycle_time
+        self.next_window = None
+        self.window_closing = False
+        self.on_time = 0.0
+        self.requested_on_time = 0.0
+        if self.on_since is not None:
+            self.on_since = start
+        reported = False
+        evaluated = start
+        duty = None
+        while True:
+            now = self.clock.monotonic()
+            if now >= end - self.latency:
+                break
+            if duty is not None:
+                # Until now the output followed the duty evaluated last, not the one written since
+                self.requested_on_time += duty * (now - evaluated)
+                evaluated = now
+            duty = duty_source()
+            # Edges fire early by the actuation latency, look at the window where they will land
+            offset = now - start + self.latency
+            on = False
+            next_edge = self.cycle_time
+            for edge, edge_on in self.edges(duty):
+                if edge <= offset:
+                    on = edge_on
+                elif edge_on != on:
+                    next_edge = edge
+                    break
+            if on != self.state:
+                hold = self.last_switch + self.min_switch_interval - now
+                if hold <= 0.0:
+                    self.switch(on)
+                    continue
+                deadline = now + hold
+            else:
+                deadline = start + next_edge - self.latency
+            # The next window opens with an edge at its start, wake up in time to fire it early as well
+            self.window_closing = deadline >= end - self.latency and not reported
+            reported = reported or self.window_closing
+            yield min(deadline, end - self.latency)
+            self.window_closing = False
+        if duty is None:
+            duty = duty_source()
+        self.requested_on_time += duty * (end - evaluated)
+        self._finish_window(end)
+
+    def _finish_window(self, end):
+        if self.on_since is not None:
+            self.on_time += end - self.on_since
+            self.on_since = end
+        duty = self.requested_on_time / self.cycle_time
+        self.achieved_duty = self.on_time / self.cycle_time
+        self.duty_error = self.achieved_duty - duty
+        self.next_window = end
+        log.debug('PWM window duty {0:.4f}, achieved {1:.4f}'.format(duty, self.achieved_duty))
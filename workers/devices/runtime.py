@@ -0,0 +1,150 @@
+#!/usr/bin python
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+RUNTIME_IO_WORKERS = 4
+RUNTIME_STOP_TIMEOUT = 5.0
+
+
+class DeviceRuntime(object):
+    """
+    Runs the cycle loops of many devices as tasks on one shared asyncio event loop
+    instead of giving every device its own OS thread.
+
+    A device is driven by, in order of preference:
+      - a coroutine ``run_cycle_async()`` method,
+      - a ``run_cycle()`` method that is itself a coroutine function,
+      - the legacy blocking ``run_cycle()``, run on a small executor (adapter).
+    Blocking I/O inside a coroutine cycle should go through ``run_blocking``.
+    """
+
+    def __init__(self, name='DeviceRuntime', io_workers=RUNTIME_IO_WORKERS):
+        self.name = name
+        self.loop = None
+        self.thread = None
+        self.executor = ThreadPoolExecutor(max_workers=io_workers)
+        self.tasks = {}
+        self.wakeups = {}
+        self._ready = threading.Event()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._run_loop, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+        self._ready.wait()
+
+    def stop(self, timeout=RUNTIME_STOP_TIMEOUT):
+        if self.thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if threading.current_thread() is not self.thread:
+            self.thread.join(timeout)
+        self.executor.shutdown(wait=False)
+
+    def is_runtime_thread(self):
+        return self.thread is not None and threading.current_thread() is self.thread
+
+    def isolates(self, device):
+        return False
+
+    def add_device(self, device):
+        self.start()
+        device.runtime = self
+        self.loop.call_soon_threadsafe(self._add_device, device)
+
+    def wake(self, device):
+        """
+        Signals that the enabled/active/shutdown state of a device has changed.
+        Safe to call from any thread.
+        """
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._wake, device)
+        except RuntimeError:
+            pass  # Loop is shutting down
+
+    async def sleep(self, device, seconds):
+        """
+        Coroutine counterpart of Device.sleep, returns False if woken early by a pause or stop.
+        """
+        wakeup = self.wakeups[device]
+        deadline = self.loop.time() + seconds
+        while device.should_run():
+            if device._interrupted:
+                device._interrupted = False
+                return True
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                return True
+            try:
+                await asyncio.wait_for(wakeup.wait(), remaining)
+                wakeup.clear()
+            except asyncio.TimeoutError:
+                pass
+        return False
+
+    async def run_blocking(self, function, *args):
+        return await self.loop.run_in_executor(self.executor, function, *args)
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            tasks = list(self.tasks.values())
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+    def _add_device(self, device):
+        if device in self.tasks:
+            return
+        self.wakeups[device] = asyncio.Event()
+        self.tasks[device] = self.loop.create_task(self._run_device(device))
+
+    def _wake(self, device):
+        wakeup = self.wakeups.get(device)
+        if wakeup is not None:
+            wakeup.set()
+
+    def _cycle(self, device):
+        run_cycle_async = getattr(device, 'run_cycle_async', None)
+        if run_cycle_async is not None:
+            return run_cycle_async()
+        if asyncio.iscoroutinefunction(device.run_cycle):
+            return device.run_cycle()
+        return self.loop.run_in_executor(self.executor, device.run_cycle)
+
+    async def _run_device(self, device):
+        wakeup = self.wakeups[device]
+        try:
+            while not device.shutdown:
+                wakeup.clear()
+                device._interrupted = False
+                running = device.should_run()
+                device._acknowledge(running)
+                if running:
+                    device._record_cycle()
+                    await self._cycle(device)
+                else:
+                    device.cycle_started = None
+                    await wakeup.wait()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error('Device {0} stopped on error: {1}'.format(device.name, e))
+        finally:
+            device._acknowledge(False)
+            self.tasks.pop(device, None)
+            self.wakeups.pop(device, None)
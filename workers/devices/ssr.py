@@ -1,88 +1,129 @@
 #!/usr/bin python
 import logging
-import re
-import time
+import math
 
-from workers.devices.device import Device, DEVICE_DEBUG_CYCLE_TIME
+from workers.devices.device import Device
+from workers.devices.gpio import FakeGPIO, create_gpio
+from workers.devices.pwm import DeadlinePWM
 
 log = logging.getLogger(__name__)
 
 
 class SSR(Device):
 
-    def __init__(self, name, io, active, cycle_time, callback, owner = None):
+    def __init__(self, name, io, active, cycle_time, callback, owner = None, burst_period = None,
+                 min_switch_interval = 0.0, gpio = None):
+        """
+        :param gpio: The workers.devices.gpio.GPIO of the output, the sysfs one at io if not given.
+        """
         Device.__init__(self, name, io, active, cycle_time, callback, owner)
         self.on_percent = 0.0
         self.last_on_time = 0.0
+        # Apply a new duty within the running window instead of at the start of the next one
+        self.preemptive = True
+        self.gpio = gpio if gpio is not None else create_gpio(io)
+        self.pwm = DeadlinePWM(self.set_ssr_state, cycle_time, burst_period, min_switch_interval)
+        self.window_error = None  # Duty error of the last finished window, until a callback passed it on
 
     def init(self):
         pass
 
+    def check(self):
+        return self.gpio.check()
+
     def register(self):
-        found = re.search('\d{1,2}', self.io)
-        gpio_numb = found.group()
-        #log.debug(gpio_numb)
-
-        #log.debug(self.io[:16]+"export")
-        #log.debug(self.io[:23]+"direction")
-
-        try:
-            export_file = self.io[:16]+"export"
-            log.info(export_file)
-            fo = open(export_file, mode='w')
-            fo.write(gpio_numb)
-            fo.close()
-            direction_file = self.io[:23]+"direction"
-            log.info(direction_file)
-            fo = open(direction_file, mode='w')
-            fo.write("out")
-            fo.close()
-            return True
-        except Exception:
-            raise Exception("Cannot register gpio{0}".format(gpio_numb))
-        return False
+        self.gpio.setup_output()
+        return True
 
     def write(self, value):
+        last_on_percent = self.on_percent
         self.on_percent = value
         if self.on_percent > 1.0:
             self.on_percent = 1.0
         elif self.on_percent < 0.0:
             self.on_percent = 0.0
+        if self.on_percent != last_on_percent:
+            if self.preemptive:
+                self.interrupt()
+            elif self.runtime is not None:
+                self.runtime.wake(self)  # A device process only learns about the duty this way
         return True
 
+    def set_clock(self, clock):
+        Device.set_clock(self, clock)
+        self.pwm.clock = clock
+
+    def get_on_percent(self):
+        return self.on_percent
+
+    def process_spec(self):
+        return type(self), (self.name, self.io, self.active, self.cycle_time), {
+            'burst_period': self.pwm.burst_period,
+            'min_switch_interval': self.pwm.min_switch_interval,
+            'gpio': self.gpio
+        }, {'preemptive': self.preemptive}
+
+    def process_input(self):
+        return self.on_percent
+
+    def set_process_input(self, value):
+        self.write(value)
+
+    def process_output(self):
+        error, self.window_error = self.window_error, None
+        return float('nan') if error is None else error
+
+    def process_callback(self, measured_value, output):
+        if not math.isnan(output):
+            self.metrics.duty_error.observe(abs(output))
+        self.do_callback(measured_value)
+
+    def _window_finished(self):
+        # Only now DeadlinePWM measured the window, the callback came just before its end
+        self.window_error = self.pwm.duty_error
+        self.metrics.duty_error.observe(abs(self.window_error))
+
     def set_ssr_state(self, on = False):
         with self.read_write_lock:
-            fo = open(self.io, mode='w')
-            if on:
-                fo.write('1')
-            else:
-                fo.write('0')
-            fo.close()
+            self.gpio.write(on)
             ok = True
         return ok
 
+    def idle(self):
+        # Never leave the element heating while nobody is driving it
+        self.pwm.switch(False)
+
     def read(self):
         with self.read_write_lock:
-            fo = open(self.io, mode='r')
-            value = fo.read()
-            fo.close()
+            value = '1' if self.gpio.read() else '0'
         return value
 
     def run_cycle(self):
-        # grab the current value if it should be changed during the cycle
-        on_percent = self.on_percent
-        on_time = on_percent * (float)(self.cycle_time)
-        if self.on_percent > 0.0:
-            self.set_ssr_state(True)
-            time.sleep(on_time)
-        if self.on_percent < 1.0:
-            self.set_ssr_state(False)
-            time.sleep((1.0-on_percent)*(float)(self.cycle_time))
-        self.do_callback(on_percent * 100.0)
+        # follow the current value if preemptive, otherwise grab it once for the whole cycle
+        duty = self.get_on_percent if self.preemptive else self.on_percent
+        for deadline in self.pwm.window(duty):
+            if self.pwm.window_closing:
+                self.do_callback(self.on_percent * 100.0)
+            if not self.sleep(deadline - self.clock.monotonic()):
+                return
+        self._window_finished()
+
+    async def run_cycle_async(self):
+        duty = self.get_on_percent if self.preemptive else self.on_percent
+        for deadline in self.pwm.window(duty):
+            if self.pwm.window_closing:
+                self.do_callback(self.on_percent * 100.0)
+            if not await self.sleep_async(deadline - self.clock.monotonic()):
+                return
+        self._window_finished()
 
 class SimulationSSR(SSR):
     def __init__(self, name, io, active, cycle_time, callback, owner = None):
-        SSR.__init__(self, name, io, active, cycle_time, callback, owner)
+        SSR.__init__(self, name, io, active, cycle_time, callback, owner, gpio=FakeGPIO())
+        self.preemptive = False
+
+    def process_spec(self):
+        return None  # The simulated kettle lives in the worker
 
     def register(self):
         return True
@@ -96,9 +137,16 @@ class SimulationSSR(SSR):
     def run_cycle(self):
         on_percent = self.on_percent
         on_time = on_percent * (float)(self.cycle_time)
-        time.sleep(DEVICE_DEBUG_CYCLE_TIME)
+        if not self.sleep(self.simulation_cycle_time()):
+            return
         self.do_callback(on_percent * 100.0)
         return
 
+    async def run_cycle_async(self):
+        on_percent = self.on_percent
+        if not await self.sleep_async(self.simulation_cycle_time()):
+            return
+        self.do_callback(on_percent * 100.0)
+
     def set_ssr_state(self, on = False):
         return True
\ No newline at end of file
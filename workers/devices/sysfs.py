@@ -0,0 +1,95 @@
+#!/usr/bin python
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+SYSFS_BUFFER_SIZE = 256
+
+W1_CRC_OK = b'YES'
+W1_TEMPERATURE = b't='
+NEWLINE = b'\n'
+
+
+class SysfsFile(object):
+    """
+    Keeps a sysfs attribute file open and rereads/rewrites it at offset 0, which makes the kernel
+    run the attribute again, into one reusable buffer. The handle is reopened transparently when
+    an operation on it fails, i.e. after a probe was unplugged or a gpio was re-exported.
+    """
+
+    def __init__(self, path, writable=False, buffer_size=SYSFS_BUFFER_SIZE):
+        self.path = path
+        self.flags = os.O_RDWR if writable else os.O_RDONLY
+        self.fd = None
+        self.buffer = bytearray(buffer_size)
+        self.buffers = [self.buffer]
+
+    def open(self):
+        self.close()
+        self.fd = os.open(self.path, self.flags)
+
+    def close(self):
+        if self.fd is not None:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.fd = None
+
+    def read(self):
+        """
+        Reads the whole attribute into self.buffer.
+        :return: Number of valid bytes in the buffer.
+        """
+        return self._retry(self._read)
+
+    def write(self, data):
+        return self._retry(self._write, data)
+
+    def _read(self):
+        return os.preadv(self.fd, self.buffers, 0)
+
+    def _write(self, data):
+        return os.pwrite(self.fd, data, 0)
+
+    def _retry(self, operation, *args):
+        try:
+            if self.fd is None:
+                self.open()
+            return operation(*args)
+        except OSError as e:
+            log.debug('Reopening "{0}" after error: {1}'.format(self.path, e))
+            self.open()
+            return operation(*args)
+
+
+def parse_w1_slave(buffer, length):
+    """
+    Parses the output of a w1_therm "w1_slave" attribute in place, without slicing the buffer:
+
+        72 01 4b 46 7f ff 0e 10 57 : crc=57 YES
+        72 01 4b 46 7f ff 0e 10 57 t=23125
+
+    :return: Temperature in millidegrees or None if the CRC check failed.
+    """
+    newline = buffer.find(NEWLINE, 0, length)
+    if newline < len(W1_CRC_OK) or not buffer.startswith(W1_CRC_OK, newline - len(W1_CRC_OK)):
+        return None
+    index = buffer.find(W1_TEMPERATURE, newline, length)
+    if index < 0:
+        return None
+    index += len(W1_TEMPERATURE)
+    sign = 1
+    if index < length and buffer[index] == 0x2d:  # '-'
+        sign = -1
+        index += 1
+    value = 0
+    digits = 0
+    while index < length and 0x30 <= buffer[index] <= 0x39:
+        value = value * 10 + buffer[index] - 0x30
+        index += 1
+        digits += 1
+    if digits == 0:
+        return None
+    return sign * value
@@ -1,47 +1,42 @@
 import logging
+import time
 # noinspection PyPackageRequirements
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 import schedule
 from distribrewed_core.base.worker import ScheduleWorker
 
+from workers.utils.timeline import Timeline, parse_duration
+
 log = logging.getLogger(__name__)
 
 
 class TemperatureWorkerExample(ScheduleWorker):
     @staticmethod
     def duration_str_to_delta(str):
-        t = datetime.strptime(str, "%H:%M:%S")
-        return timedelta(hours=t.hour, minutes=t.minute, seconds=t.second)
+        return timedelta(seconds=parse_duration(str))
 
     def __init__(self):
         super(TemperatureWorkerExample, self).__init__()
 
     def _setup_worker_schedule(self, worker_schedule):
         log.info('Received schedule: {0}'.format(worker_schedule))
-        self.finish_time = datetime.now()
-        temp_array = []
-        for duration, temperature in worker_schedule:
-            duration = self.duration_str_to_delta(duration)
-            self.finish_time += duration
-            temp_array.append((self.finish_time, temperature))
-        schedule.every(3).seconds.do(self.do_some_work, temp_array)
-
-    def do_some_work(self, temp_array):
+        self.timeline = Timeline.compile(worker_schedule)
+        self.start_time = time.monotonic()
+        schedule.every(3).seconds.do(self.do_some_work)
+
+    def do_some_work(self):
         log.info('Boil stuff')
-        if self.finish_time < datetime.now():
+        # Only timed steps here, nothing waits for a temperature
+        elapsed = time.monotonic() - self.start_time
+        if elapsed >= self.timeline.total:
             log.info('Stopping')
             self._send_master_is_finished()
             self.stop_worker()
         else:
-            for_how_long = None
-            current_temp = None
-            for time, temp in temp_array:
-                if time > datetime.now():
-                    for_how_long = time - datetime.now()
-                    current_temp = temp
-                    break
-            log.info('Holding {0}°C for {1}'.format(current_temp, for_how_long))
+            step = self.timeline.steps[self.timeline.index_at(elapsed)]
+            for_how_long = timedelta(seconds=step.end - elapsed)
+            log.info('Holding {0}°C for {1}'.format(step.set_point(elapsed - step.start), for_how_long))
 
 
 if __name__ == "__main__":
@@ -1,9 +1,11 @@
 import logging
 import os
 
-import telepot
 from distribrewed_core.base.worker import MessageWorker
 
+from workers.utils.telegram_queue import TELEGRAM_API_URL, TELEGRAM_COALESCE_WINDOW, TELEGRAM_CHAT_INTERVAL, \
+    TELEGRAM_TIMEOUT, TelegramQueue
+
 log = logging.getLogger(__name__)
 
 
@@ -18,18 +20,26 @@ class TelegramWorker(MessageWorker):
         if self.chat_id is None:
             log.error('Provide a chat id for telegram in env variable \'TELEGRAM_CHAT\'')
             exit(0)
-        self.bot = telepot.Bot(token)
+        self.outbox = TelegramQueue(
+            token,
+            api_url=os.environ.get('TELEGRAM_API_URL', TELEGRAM_API_URL),
+            name=self.name,
+            coalesce_window=float(os.environ.get('TELEGRAM_COALESCE_WINDOW', TELEGRAM_COALESCE_WINDOW)),
+            chat_interval=float(os.environ.get('TELEGRAM_CHAT_INTERVAL', TELEGRAM_CHAT_INTERVAL))
+        )
+        self.outbox.start()
 
     def _info(self):
-        bot_info = self.bot.getMe()
+        bot_info = self.outbox.call('getMe')
         bot_info['telegram_id'] = bot_info.pop('id')
         return bot_info
 
     def send_message(self, message):
         super(TelegramWorker, self).send_message(message)
-        self.bot.sendMessage(self.chat_id, message)
+        self.outbox.put(self.chat_id, message)
 
 
 if __name__ == "__main__":
     worker = TelegramWorker()
     worker.send_message('Whoop Whoop')
+    worker.outbox.stop(TELEGRAM_TIMEOUT)
@@ -1,16 +1,25 @@
 #!/usr/bin python
+import json
 import logging
-import os
+import time
 from datetime import datetime as datetime
 from datetime import timedelta as timedelta
 
 from distribrewed_core.base.worker import ScheduleWorker
-from prometheus_client import Gauge
 
-from device import DeviceWorker
-from devices.probe import Probe
-from devices.ssr import SSR
-from utils.pid import PID
+from workers.device import DeviceWorker
+from workers.devices.probe import Probe
+from workers.devices.ssr import SSR
+from workers.utils.checkpoint import CheckpointFile, CHECKPOINT_MAX_AGE, CHECKPOINT_VERSION
+from workers.utils.estimator import TemperatureEstimator
+from workers.utils.history import HistoryFile, HISTORY_CAPACITY
+from workers.utils.metrics import metric, NOOP_METRIC, CALLBACK_BUCKETS
+from workers.utils.measurement import Measurement, MeasurementBuffer
+from workers.utils.mpc import PredictiveController
+from workers.utils.pid import PID
+from workers.utils.startup import STARTUP
+from workers.utils.timeline import Timeline, parse_duration
+from workers.utils.tuning import load_pid_params
 
 log = logging.getLogger(__name__)
 
@@ -20,39 +29,255 @@ class TemperatureWorker(DeviceWorker):
     SSR_IO = "SSR_IO"
     SSR_ACTIVE = "SSR_ACTIVE"
     SSR_CYCLE_TIME = "SSR_CYCLE_TIME"
+    SSR_BURST_PERIOD = "SSR_BURST_PERIOD"
+    SSR_MIN_SWITCH_INTERVAL = "SSR_MIN_SWITCH_INTERVAL"
     THERMOMETER_NAME = "THERMOMETER_NAME"
     THERMOMETER_IO = "THERMOMETER_IO"
     THERMOMETER_ACTIVE = "THERMOMETER_ACTIVE"
     THERMOMETER_CYCLE_TIME = "THERMOMETER_CYCLE_TIME"
+    PID_PARAMS_FILE = "PID_PARAMS_FILE"
+    HISTORY_FILE = "HISTORY_FILE"
+    CONTROLLER = "CONTROLLER"
+    CONTROLLER_PID = "pid"
+    CONTROLLER_MPC = "mpc"
+    PLANT_FILE = "PLANT_FILE"
+    ESTIMATOR = "ESTIMATOR"
+    ESTIMATOR_NONE = "none"
+    ESTIMATOR_KALMAN = "kalman"
+    HISTORY_CAPACITY = "HISTORY_CAPACITY"
+    CHECKPOINT_FILE = "CHECKPOINT_FILE"
+    CHECKPOINT_MAX_AGE = "CHECKPOINT_MAX_AGE"
 
     EVENT_ON_TEMPERATURE_REACHED = "on_temperature_reached"
 
+    WORK_REACHING = 'Reaching temperature {:.2f}'
+    WORK_HOLDING = 'Holding temperature at {:.2f}'
+    MEASUREMENT = Measurement
+
     def __init__(self):
-        DeviceWorker.__init__(self)
+        # The devices start once everything their callbacks use is there
+        DeviceWorker.__init__(self, start_devices=False)
         self.working = False
         self.simulation = False
         self.schedule = None
         self.enabled = False
         self.active = False
-        self.hold_pause_timer = None
         self.paused = False
-        self.pause_time = None
-        self.ssr_name = os.environ.get(self.SSR_NAME)
-        self.thermometer_name = os.environ.get(self.THERMOMETER_NAME)
+        self.ssr_name = self._setting(self.SSR_NAME)
+        self.thermometer_name = self._setting(self.THERMOMETER_NAME)
         self.pid = None
-        self.kpid = None
+        self.kpid = self._load_pid_tuning()
+        self.predictor = None
+        self.estimator = None
+        self.controller_kind = self._setting(self.CONTROLLER, self.CONTROLLER_PID).lower()
+        self.estimator_kind = self._setting(self.ESTIMATOR, self.ESTIMATOR_NONE).lower()
+        self.plant_model = self._load_controller_plant()
+        self.history = self._open_history()
         self.current_temperature = 0.0
+        self.temperature_stale = False
         self.current_set_temperature = 0.0
         self.current_hold_time = timedelta(minutes=0)
         self.start_time = None
         self.stop_time = None
         self.start_hold_timer = None
-        self._setup_prometheus()
+        self.timeline = None
+        self.step_index = 0
+        self.gate = 0
+        self.waiting = False
+        self.timeline_elapsed = 0.0
+        self.timeline_mark = 0.0
+        self.worker_schedule = None
+        self.resumed = False
+        self.thermometer = None
+        self.ssr = None
+        self.measurement_gauges = {}
+        self.callback_seconds = NOOP_METRIC
+        # The metrics (and prometheus_client) are set up on the measurement thread, off the way to
+        # the first SSR actuation
+        self.measurements = MeasurementBuffer(self._export_measurement, name='{0}-measurements'.format(self.name),
+                                              setup=self._setup_prometheus)
+        self._setup_measurements()
+        self.measurements.start()
+        self.checkpoint = self._open_checkpoint()
+        self._auto_setup()
+        self._resume_checkpoint()
+
+    def _load_pid_tuning(self):
+        """
+        :return: Dict with kc, ti and td from PID_PARAMS_FILE (see workers.utils.tuning), None for the defaults.
+        """
+        path = self._setting(self.PID_PARAMS_FILE)
+        if not path:
+            return None
+        try:
+            params = load_pid_params(path)
+        except (IOError, ValueError) as e:
+            log.warning('Unable to load PID parameters from "{0}", using defaults: {1}'.format(path, e))
+            return None
+        log.info('Loaded PID parameters from "{0}": {1}'.format(path, params))
+        return params
+
+    def _load_plant_model(self):
+        """
+        :return: Plant dict (watts, liters, cooling, delay, ...) from PLANT_FILE, i.e. the one written by AutoTuneWorker.
+        """
+        path = self._setting(self.PLANT_FILE)
+        if not path:
+            return None
+        with open(path) as fo:
+            plant = json.load(fo)
+        return plant.get('plant', plant) if isinstance(plant, dict) else plant
+
+    def _load_controller_plant(self):
+        # The predictive controller and the estimator need a plant model, without one the PID stays in charge
+        # of the raw samples
+        if self.controller_kind != self.CONTROLLER_MPC and self.estimator_kind != self.ESTIMATOR_KALMAN:
+            return None
+        try:
+            plant = self._load_plant_model()
+            if plant is not None:
+                self._check_plant_model(plant)
+        except (IOError, ValueError) as e:
+            log.warning('Unable to load plant model from "{0}": {1}'.format(self._setting(self.PLANT_FILE), e))
+            plant = None
+        if plant is None:
+            log.warning('No plant model for the predictive controller or estimator, using the PID on probe samples')
+        return plant
+
+    @staticmethod
+    def _check_plant_model(plant):
+        """
+        :raise ValueError: Unless plant has the positive watts and liters every plant based model needs.
+        """
+        if not isinstance(plant, dict):
+            raise ValueError('The plant model is not an object')
+        for key in ['watts', 'liters']:
+            try:
+                value = float(plant[key])
+            except KeyError:
+                raise ValueError('The plant model has no "{0}"'.format(key))
+            except (TypeError, ValueError):
+                raise ValueError('The plant model "{0}" is not a number'.format(key))
+            if value <= 0.0:
+                raise ValueError('The plant model "{0}" has to be positive'.format(key))
+
+    def _open_history(self):
+        """
+        :return: The HistoryFile at HISTORY_FILE, None if no history is kept.
+        """
+        path = self._setting(self.HISTORY_FILE)
+        if not path:
+            return None
+        try:
+            return HistoryFile(path, int(self._setting(self.HISTORY_CAPACITY, HISTORY_CAPACITY)))
+        except (OSError, ValueError) as e:
+            log.warning('Unable to open history "{0}", not keeping one: {1}'.format(path, e))
+            return None
+
+    def _open_checkpoint(self):
+        """
+        :return: The CheckpointFile at CHECKPOINT_FILE, started, None if no checkpoint is kept.
+        """
+        path = self._setting(self.CHECKPOINT_FILE)
+        if not path:
+            return None
+        checkpoint = CheckpointFile(path, name='{0}-checkpoint'.format(self.name))
+        checkpoint.start()
+        return checkpoint
+
+    @staticmethod
+    def _timestamp(moment):
+        if moment is None:
+            return None
+        return time.mktime(moment.timetuple()) + moment.microsecond / 1e6
+
+    @staticmethod
+    def _moment(timestamp):
+        return None if timestamp is None else datetime.fromtimestamp(timestamp)
+
+    def _checkpoint_state(self):
+        p = None if self.pid is None else self.pid.pid_params
+        return {
+            'version': CHECKPOINT_VERSION,
+            'time': self.clock.time(),
+            'schedule': self.worker_schedule,
+            'working': self.working,
+            'paused': self.paused,
+            'step_index': self.step_index,
+            'gate': self.gate,
+            'waiting': self.waiting,
+            'timeline_elapsed': self._timeline_time(),
+            'set_temperature': self.current_set_temperature,
+            'start_time': self._timestamp(self.start_time),
+            'start_hold_timer': self._timestamp(self.start_hold_timer),
+            'pid': None if p is None else {'xk_1': p.xk_1, 'xk_2': p.xk_2, 'yk': p.yk, 'rk_1': p.rk_1}
+        }
+
+    def _save_checkpoint(self, sync=False):
+        if self.checkpoint is not None:
+            self.checkpoint.save(self._checkpoint_state(), sync)
+
+    def _resume_checkpoint(self):
+        """
+        Picks the schedule up where the checkpoint left it, if it was written less than
+        CHECKPOINT_MAX_AGE seconds ago while working, without waiting for the master. Time the
+        worker was down does not count as timeline time.
+        """
+        if self.checkpoint is None:
+            return False
+        state = self.checkpoint.load()
+        if state is None or not state.get('working'):
+            return False
+        age = self.clock.time() - state['time']
+        if age < 0.0:
+            # The clock is behind, i.e. a node without a real time clock that has not synced after
+            # a power cut, so there is no telling how long the vessel was left alone
+            log.warning('{0} does not resume its checkpoint, it is {1:.0f}s in the future'.format(self.name, -age))
+            return False
+        if age > float(self._setting(self.CHECKPOINT_MAX_AGE, CHECKPOINT_MAX_AGE)):
+            log.info('{0} does not resume its checkpoint of {1:.0f}s ago'.format(self.name, age))
+            return False
+        try:
+            self.timeline = self._compile_schedule(state['schedule'])
+            self.worker_schedule = state['schedule']
+            self.working = True
+            self.paused = state['paused']
+            self.start_time = self._moment(state['start_time'])
+            self.gate = state['gate']
+            self.waiting = state['waiting']
+            self.timeline_elapsed = state['timeline_elapsed']
+            self.timeline_mark = self.clock.monotonic()
+            self._enter_step(state['step_index'])
+            self.current_set_temperature = state['set_temperature']
+            self.start_hold_timer = self._moment(state['start_hold_timer'])
+            if state['pid'] is not None:
+                for key, value in state['pid'].items():
+                    setattr(self.pid.pid_params, key, value)
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            log.warning('Unable to resume checkpoint "{0}", waiting for the master: {1}'.format(
+                self.checkpoint.path, e))
+            self.timeline = self.worker_schedule = self.pid = None
+            self.working = self.paused = False
+            return False
+        log.info('{0} resumed step {1} of {2} from its checkpoint of {3:.0f}s ago'.format(
+            self.name, self.step_index + 1, len(self.timeline), age))
+        self.resumed = True
+        if not self.paused:
+            self._resume_all_devices()
+        return True
+
+    def _record_history(self, measured_value, calc):
+        # The PID terms are stale while the predictive controller is in charge
+        if self.pid is None or self.predictor is not None:
+            self.history.append(self.clock.time(), measured_value, self.current_set_temperature, calc * 100.0)
+        else:
+            p = self.pid.pid_params
+            self.history.append(self.clock.time(), measured_value, self.current_set_temperature, calc * 100.0,
+                                p.pp, p.pi, p.pd)
 
     @staticmethod
     def duration_str_to_delta(str):
-        t = datetime.strptime(str, "%H:%M:%S")
-        return timedelta(hours=t.hour, minutes=t.minute, seconds=t.second)
+        return timedelta(seconds=parse_duration(str))
 
     def _events(self):
         events = ScheduleWorker._events(self)
@@ -60,24 +285,29 @@ class TemperatureWorker(DeviceWorker):
         return events
 
     def add_devices(self):
-        ssr_name = os.environ.get(self.SSR_NAME)
-        ssr_io = os.environ.get(self.SSR_IO)
-        ssr_active = os.environ.get(self.SSR_ACTIVE, 'false').lower() in ['1', 'true']
-        ssr_cycle_time = int(os.environ.get(self.SSR_CYCLE_TIME))
+        ssr_name = self._setting(self.SSR_NAME)
+        ssr_io = self._setting(self.SSR_IO)
+        ssr_active = self._setting(self.SSR_ACTIVE, 'false').lower() in ['1', 'true']
+        ssr_cycle_time = int(self._setting(self.SSR_CYCLE_TIME))
         ssr_callback = self._ssr_callback
         ssr = self._create_ssr(ssr_name, ssr_io, ssr_active, ssr_cycle_time, ssr_callback)
+        ssr_burst_period = self._setting(self.SSR_BURST_PERIOD)
+        if ssr_burst_period:
+            ssr.pwm.burst_period = float(ssr_burst_period)
+        ssr.pwm.min_switch_interval = float(self._setting(self.SSR_MIN_SWITCH_INTERVAL, 0.0))
         self._add_device(ssr_name, ssr)
 
-        therm_name = os.environ.get(self.THERMOMETER_NAME)
-        therm_io = os.environ.get(self.THERMOMETER_IO)
-        therm_active = os.environ.get(self.THERMOMETER_ACTIVE, 'false').lower() in ['1', 'true']
-        therm_cycle_time = int(os.environ.get(self.THERMOMETER_CYCLE_TIME))
+        therm_name = self._setting(self.THERMOMETER_NAME)
+        therm_io = self._setting(self.THERMOMETER_IO)
+        therm_active = self._setting(self.THERMOMETER_ACTIVE, 'false').lower() in ['1', 'true']
+        therm_cycle_time = int(self._setting(self.THERMOMETER_CYCLE_TIME))
         therm_callback = self._temperature_callback
         thermometer = self._create_thermometer(therm_name, therm_io, therm_active, therm_cycle_time, therm_callback)
+        thermometer.stale_callback = self._temperature_stale
         self._add_device(therm_name, thermometer)
 
     def _create_ssr(self, name, io, active, cycle_time, callback):
-        return SSR(name, io, active, cycle_time, callback, self)
+        return SSR(name, io, active, cycle_time, callback, self, gpio=self._create_gpio(io))
 
     def _create_thermometer(self, name, io, active, cycle_time, callback):
         return Probe(name, io, active, cycle_time, callback, self)
@@ -87,76 +317,142 @@ class TemperatureWorker(DeviceWorker):
         pass
 
     def _calculate_finish_time(self):
-        return self.start_hold_timer + (self.current_hold_time + self.pause_time)
+        step = self.timeline.steps[self.step_index]
+        return self.clock.now() + timedelta(seconds=max(0.0, step.end - self._timeline_time()))
 
     def _is_done(self):
-        if self.start_hold_timer is None:
+        if self.timeline is None or self.gate < len(self.timeline):
             return False
-        finish = self._calculate_finish_time()
-        now = datetime.now()
-        if finish <= now:
+        remaining = self.timeline.total - self._timeline_time()
+        if remaining <= 0.0:
             return True
-        log.debug('Time until work done: {0}'.format(str(finish - now)))
+        log.debug('Time until work done: {0}'.format(timedelta(seconds=remaining)))
         return False
 
+    def _compile_schedule(self, worker_schedule):
+        return Timeline.compile(worker_schedule)
+
     def _setup_worker_schedule(self, worker_schedule):
         log.debug('Receiving schedule...')
+        if self.resumed and worker_schedule == self.worker_schedule:
+            # The master resends the schedule this worker already resumed from its checkpoint
+            self.resumed = False
+            log.info('{0} already runs this schedule, keeping its progress'.format(self.name))
+            return
+        self.resumed = False
         self._pause_all_devices()
-        self.current_set_temperature = float(worker_schedule[0][1])
-        self.current_hold_time = self.duration_str_to_delta(worker_schedule[0][0])
+        self.timeline = self._compile_schedule(worker_schedule)
+        self.worker_schedule = worker_schedule
         self.working = True
-        self.start_time = datetime.now()
-        self.start_hold_timer = None
-        self.hold_pause_timer = None
-        self.pause_time = timedelta(seconds=0)
+        self.start_time = self.clock.now()
+        self.gate = self.timeline.next_gate(0)
+        self.waiting = False
+        self.timeline_elapsed = 0.0
+        self.timeline_mark = self.clock.monotonic()
+        self._enter_step(0)
+        self._save_checkpoint(sync=True)
+        self._resume_all_devices()
+
+    def _create_pid(self):
         cycle_time = float(self._get_device(self.thermometer_name).cycle_time)
+        if self.plant_model is not None:
+            # The plant delay is counted in SSR cycles, like KettlePlant is stepped
+            ssr_cycle_time = float(self._get_device(self.ssr_name).cycle_time)
+            if self.controller_kind == self.CONTROLLER_MPC and self.predictor is None:
+                self.predictor = PredictiveController(self.plant_model, cycle_time, ssr_cycle_time)
+            if self.estimator_kind == self.ESTIMATOR_KALMAN and self.estimator is None:
+                self.estimator = TemperatureEstimator(self.plant_model, cycle_time, ssr_cycle_time)
+        gains = self.kpid or {}
         if self.pid is None:
-            self.pid = PID(None, self.current_set_temperature, cycle_time)
+            self.pid = PID(None, self.current_set_temperature, cycle_time, **gains)
         else:
-            self.pid = PID(self.pid.pid_params, self.current_set_temperature, cycle_time)
-        self._resume_all_devices()
-        #schedule.every(5).seconds.do(self._check_events)
+            # Carry the controller state over into the new step
+            self.pid = PID(self.pid.pid_params, self.current_set_temperature, cycle_time, **gains)
+
+    def _timeline_time(self, now=None):
+        """
+        :return: Seconds the timeline ran, not counting waits for temperature and pauses.
+        """
+        if self.waiting or self.paused or not self.working:
+            return self.timeline_elapsed
+        return self.timeline_elapsed + ((self.clock.monotonic() if now is None else now) - self.timeline_mark)
+
+    def _enter_step(self, index):
+        step = self.timeline.steps[index]
+        log.info('{0} starts step {1} of {2}: {3}'.format(self.name, index + 1, len(self.timeline), step))
+        self.step_index = index
+        self.current_set_temperature = step.set_point(0.0)
+        self.current_hold_time = timedelta(seconds=step.duration)
+        self.start_hold_timer = None if step.gated else self.clock.now()
+        self._create_pid()
+
+    def _advance_timeline(self, measured_value):
+        """
+        Moves through the timeline on every temperature sample, without asking the master.
+        """
+        now = self.clock.monotonic()
+        elapsed = self._timeline_time(now)
+        index = min(self.timeline.index_at(elapsed), self.gate)
+        step = self.timeline.steps[index]
+        if index != self.step_index:
+            self._enter_step(index)
+        if index == self.gate:
+            # Time stands still at the start of the step until its temperature is reached
+            self.waiting = True
+            elapsed = step.start
+            if round(measured_value, 1) >= step.temperature:
+                self.waiting = False
+                self.gate = self.timeline.next_gate(index + 1)
+                self.start_hold_timer = self.clock.now()
+                self._send_event_to_master(self.EVENT_ON_TEMPERATURE_REACHED)
+        self.timeline_elapsed = elapsed
+        self.timeline_mark = now
+        self.current_set_temperature = step.set_point(elapsed - step.start)
 
     def stop_worker(self):
         self._get_device(self.ssr_name).write(0.0)
         self._pause_all_devices()
+        self.timeline_elapsed = self._timeline_time()
         self.working = False
         self.enabled = False
-        self.stop_time = datetime.now()
+        self.stop_time = self.clock.now()
+        self.resumed = False
+        self._save_checkpoint(sync=True)
+        if self.history is not None:
+            self.history.flush()
         super(DeviceWorker, self).stop_worker()
         return True
 
     def pause_worker(self):
         log.debug('Pause {0}'.format(self))
         self._pause_all_devices()
-        if self.start_hold_time is not None:
-            self.hold_pause_timer = datetime.now()
+        self.timeline_elapsed = self._timeline_time()
         self.paused = True
+        self._save_checkpoint(sync=True)
         super(DeviceWorker, self).pause_worker()
         return True
 
     def resume_worker(self):
         log.info('Resume {0}'.format(self))
-        if self.hold_pause_timer is not None and self.start_hold_time is not None:
-            self.pause_time += (datetime.now() - self.hold_pause_timer)
-        self.hold_pause_timer = None
-        self._resume_all_devices()
+        self.timeline_mark = self.clock.monotonic()
         self.paused = False
+        self._save_checkpoint(sync=True)
+        self._resume_all_devices()
         super(DeviceWorker, self).resume_worker()
         return True
 
     def _calculate_pid(self, measured_value):
-        return self.pid.calculate(measured_value, self.current_set_temperature)
-
-    def _create_measurement(self, name, device_name, value, set_point, work, remaining):
-        measurement = {}
-        measurement["name"] = name
-        measurement["device_name"] = device_name
-        measurement["value"] = value
-        measurement["set_point"] = set_point
-        measurement["work"] = work
-        measurement["remaining"] = remaining
-        return measurement
+        rate = None
+        if self.estimator is not None:
+            # The SSR duty still is the one of the cycle that ended with this sample
+            estimate = self.estimator.update(measured_value, self.ssr.get_on_percent(), self.clock.monotonic())
+            measured_value, rate = estimate.temperature, estimate.rate
+        if self.predictor is not None:
+            return self.predictor.calculate(measured_value, self.current_set_temperature, rate)
+        return self.pid.calculate(measured_value, self.current_set_temperature, rate)
+
+    def _create_measurement(self, name, device_name, value, set_point, work, remaining, target=None):
+        return self.MEASUREMENT(name, device_name, value, set_point, work, remaining, target, self.clock.time())
 
     def _temperature_callback_event(self, measured_value, measurement):
         pass
@@ -164,59 +460,78 @@ class TemperatureWorker(DeviceWorker):
     def _ssr_callback_event(self, measured_value, measurement):
         pass
 
+    def _temperature_stale(self, age):
+        # Do not heat blind, the PID takes over again with the next good sample. Told once per outage,
+        # a dead probe would fill the log at the probe cycle rate
+        if self.temperature_stale:
+            return
+        self.temperature_stale = True
+        log.warning('{0} has no recent temperature ({1}s old), heating is off'.format(
+            self.name, None if age is None else round(age, 1)))
+        self._get_device(self.ssr_name).write(0.0)
+
     def _temperature_callback(self, measured_value):
+        start = time.monotonic()
+        STARTUP.mark('first_sample')
         try:
             calc = 0.0
+            if self.temperature_stale:
+                self.temperature_stale = False
+                log.info('{0} has a recent temperature again, heating is back on'.format(self.name))
             self.current_temperature = measured_value
+            if self.working and self.timeline is not None:
+                self._advance_timeline(measured_value)
             if self.pid is not None:
                 calc = self._calculate_pid(measured_value)
-                log.debug('{0} reports measured value {1} ({2}) and pid calculated {3}'.
-                          format(self.name, round(measured_value, 1), measured_value, calc))
-            else:
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug('{0} reports measured value {1} ({2}) and pid calculated {3}'.
+                              format(self.name, round(measured_value, 1), measured_value, calc))
+            elif log.isEnabledFor(logging.DEBUG):
                 log.debug('{0} reports measured value {1} ({2})'.format(self.name, round(measured_value, 1), measured_value))
-            if self.start_hold_timer is None:
-                work = 'Reaching temperature {:.2f}'.format(self.current_set_temperature)
-            else:
-                work = 'Holding temperature at {:.2f}'.format(self.current_set_temperature)
             measurement = self._create_measurement(
                 self.name,
-                self._get_device(self.thermometer_name).name,
+                self.thermometer.name,
                 self.current_temperature,
                 self.current_set_temperature,
-                work,
-                '{:.2f}'.format(self.current_set_temperature - self.current_temperature)
+                self.WORK_REACHING if self.start_hold_timer is None else self.WORK_HOLDING,
+                self.current_set_temperature - self.current_temperature
             )
+            if self.history is not None:
+                self._record_history(measured_value, calc)
             self._temperature_callback_event(measurement, measured_value)
             self._send_measurement(measurement)
-            if self.working and self.start_hold_timer is None and round(measured_value, 1) >= self.current_set_temperature:
-                self.start_hold_timer = datetime.now()
-                self._send_event_to_master(self.EVENT_ON_TEMPERATURE_REACHED)
             if self._is_done():
                 self.stop_worker()
                 self._send_master_is_finished()
             elif self.pid is not None:
-                self._get_device(self.ssr_name).write(calc)
+                self.ssr.write(calc)
+                STARTUP.mark('first_actuation')
+            if self.working:
+                # Steps and gates change here, the PID state on every sample
+                self._save_checkpoint()
         except Exception as e:
             log.error('TemperatureWorker unable to react to temperature update, shutting down: {0}'.format(e.args[0]))
             self._stop_all_devices()
+        self.callback_seconds.observe(time.monotonic() - start)
 
     def _ssr_callback(self, heating_ratio):
-        device = self._get_device(self.ssr_name)
         try:
-            log.debug('{0} reports heating ratio of {1} percent'.format(self.name, heating_ratio))
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug('{0} reports heating ratio of {1} percent'.format(self.name, heating_ratio))
             if self.start_hold_timer is None:
-                work = 'Reaching temperature {:.2f}'.format(self.current_set_temperature)
-                remaining = 'Unknown'
+                work = self.WORK_REACHING
+                remaining = None
             else:
-                work = 'Holding temperature at {:.2f}'.format(self.current_set_temperature)
-                remaining = (self._calculate_finish_time() - datetime.now())
+                work = self.WORK_HOLDING
+                remaining = (self._calculate_finish_time() - self.clock.now())
             measurement = self._create_measurement(
                 self.name,
-                device.name,
+                self.ssr.name,
                 heating_ratio,
                 self.current_hold_time,
                 work,
-                remaining
+                remaining,
+                self.current_set_temperature
             )
             self._ssr_callback_event(heating_ratio, measurement)
             self._send_measurement(measurement)
@@ -225,129 +540,33 @@ class TemperatureWorker(DeviceWorker):
             self._stop_all_devices()
 
     def _setup_prometheus(self):
-        try:
-            labels = ['name', "device_name", 'device_type']
-            TemperatureWorker.PROM_HEATING_RATIO = Gauge('HEATING_RATIO', 'Heating ratio', labels)
-            TemperatureWorker.PROM_TEMPERATURE = Gauge('TEMPERATURE', 'Temperature', labels)
-        except ValueError:
-            pass  # It is already defined
+        # Resolve label children once, not on every sample
+        labels = ['name', "device_name", 'device_type']
+        self.measurement_gauges = {
+            self.ssr.name: metric('Gauge', 'HEATING_RATIO', 'Heating ratio', labels).labels(
+                self.name, self.ssr_name, 'SSR'),
+            self.thermometer.name: metric('Gauge', 'TEMPERATURE', 'Temperature', labels).labels(
+                self.name, self.thermometer_name, 'Thermometer')
+        }
+        self.callback_seconds = metric('Histogram', 'CALLBACK_SECONDS', 'Temperature callback time',
+                                       buckets=CALLBACK_BUCKETS).labels(self.name, self.thermometer_name)
+        metric('Gauge', 'MEASUREMENTS_DROPPED', 'Measurements dropped by a full buffer').labels(
+            self.name, self.thermometer_name).set_function(lambda: self.measurements.dropped)
+
+    def _setup_measurements(self):
+        self.thermometer = self._get_device(self.thermometer_name)
+        self.ssr = self._get_device(self.ssr_name)
 
     def _send_measurement(self, worker_measurement):
-        log.info('Send measurement triggered')
-        if worker_measurement.get('device_name', '') == os.environ.get(self.SSR_NAME):
-            TemperatureWorker.PROM_HEATING_RATIO.labels(self.name, self.ssr_name, 'SSR').set(worker_measurement.get('value', -1))
-            log.info('Sending heating ratio to Prometheus')
-        elif worker_measurement.get('device_name', '') == os.environ.get(self.THERMOMETER_NAME):
-            TemperatureWorker.PROM_TEMPERATURE.labels(self.name, self.thermometer_name, 'Thermometer').set(worker_measurement.get('value', -1))
-            log.info('Sending temperature to Prometheus')
+        # Runs on the device thread, logging and export happen on the measurement thread
+        self.measurements.put(worker_measurement)
+
+    def _export_measurement(self, worker_measurement):
+        gauge = self.measurement_gauges.get(worker_measurement.device_name)
+        if gauge is not None:
+            gauge.set(worker_measurement.value)
         log.info('{0}: {1} - work {2} - remaining {3}'.format(
-            worker_measurement.get('device_name'),
-            worker_measurement.get('value'),
-            worker_measurement.get('work'),
-            worker_measurement.get('remaining')))
-
-    def _get_grafana_rows(self):
-        # 1. Define the panel in grafana
-        # 2. View panel json i.e. https://imgur.com/HcsW9sf
-        # 3. Paste JSON and convert to python dict
-        # This example only has 1 row with 1 panel
-        panels = [
-            {
-                "panels": [
-                    {
-                        "aliasColors": {},
-                        "bars": False,
-                        "dashLength": 10,
-                        "dashes": False,
-                        "datasource": None,
-                        "fill": 1,
-                        "id": 1,
-                        "legend": {
-                            "avg": False,
-                            "current": False,
-                            "max": False,
-                            "min": False,
-                            "show": True,
-                            "total": False,
-                            "values": False
-                        },
-                        "lines": True,
-                        "linewidth": 1,
-                        "links": [],
-                        "nullPointMode": "null",
-                        "percentage": False,
-                        "pointradius": 5,
-                        "points": False,
-                        "renderer": "flot",
-                        "seriesOverrides": [
-                            {
-                                "alias": "Heating Time",
-                                "yaxis": 2
-                            }
-                        ],
-                        "spaceLength": 10,
-                        "span": 12,
-                        "stack": False,
-                        "steppedLine": False,
-                        "targets": [
-                            {
-                                "expr": "TEMPERATURE{name=\"" + self.name + "\"}",
-                                "format": "time_series",
-                                "instant": False,
-                                "interval": "",
-                                "intervalFactor": 2,
-                                "legendFormat": "Temperature",
-                                "refId": "A",
-                                "step": 1
-                            },
-                            {
-                                "expr": "HEATING_RATIO{name=\"" + self.name + "\"}",
-                                "format": "time_series",
-                                "instant": False,
-                                "intervalFactor": 2,
-                                "legendFormat": "Heating Time",
-                                "refId": "B",
-                                "step": 1
-                            }
-                        ],
-                        "thresholds": [],
-                        "timeFrom": None,
-                        "timeShift": None,
-                        "title": self.name,
-                        "tooltip": {
-                            "shared": True,
-                            "sort": 0,
-                            "value_type": "individual"
-                        },
-                        "type": "graph",
-                        "xaxis": {
-                            "buckets": None,
-                            "mode": "time",
-                            "name": None,
-                            "show": True,
-                            "values": []
-                        },
-                        "yaxes": [
-                            {
-                                "format": "celsius",
-                                "label": None,
-                                "logBase": 1,
-                                "max": None,
-                                "min": None,
-                                "show": True
-                            },
-                            {
-                                "decimals": None,
-                                "format": "percentunit",
-                                "label": "",
-                                "logBase": 1,
-                                "max": None,
-                                "min": None,
-                                "show": True
-                            }
-                        ]
-                    }
-                ]
-            }
-        ]
-        return panels
+            worker_measurement.device_name,
+            worker_measurement.value,
+            worker_measurement.work_text(),
+            worker_measurement.remaining_text()))
@@ -0,0 +1,120 @@
+#!/usr/bin python
+import errno
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+CHECKPOINT_VERSION = 1
+CHECKPOINT_MAX_AGE = 900.0  # Seconds a checkpoint is resumed from after it was written
+
+
+class CheckpointFile(object):
+    """
+    The latest control state of a worker as a small JSON file that survives a crash or a power
+    cut: a state is written to a temporary file next to it, fsynced and renamed over the previous
+    one, so a reader always finds either the old or the new state whole.
+
+    save() only hands the state dict to a background thread, which writes the newest one it was
+    given and skips those overtaken meanwhile, so a worker can save on every cycle without its
+    device thread waiting for the disk. save(state, sync=True) writes before it returns, for the
+    transitions that must not be lost, i.e. a stop.
+    """
+
+    def __init__(self, path, name='checkpoint'):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.name = name
+        self.lock = threading.Lock()  # One write at a time
+        self.pending_lock = threading.Lock()  # Saves come from the device and the master threads
+        self.pending = None  # (sequence, state) of the newest save
+        self.sequence = 0
+        self.written = 0  # Sequence of the state on disk
+        self.errors = 0
+        self.ready = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.ready.set()
+
+    def save(self, state, sync=False):
+        """
+        :param state: Dict of JSON types, not changed by the caller afterwards.
+        :param sync: Write it before returning instead of on the background thread.
+        """
+        with self.pending_lock:
+            self.sequence += 1
+            self.pending = (self.sequence, state)
+        if sync or self.thread is None:
+            self._write_pending()
+        elif not self.ready.is_set():
+            self.ready.set()
+
+    def load(self):
+        """
+        :return: The state dict last written, None if there is none or it can not be read.
+        """
+        try:
+            with open(self.path) as fo:
+                state = json.load(fo)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:  # No file just means nothing to resume
+                log.warning('Unable to read checkpoint "{0}": {1}'.format(self.path, e))
+            return None
+        except ValueError as e:
+            log.warning('Checkpoint "{0}" is corrupt, ignoring it: {1}'.format(self.path, e))
+            return None
+        if not isinstance(state, dict) or state.get('version') != CHECKPOINT_VERSION:
+            log.warning('Checkpoint "{0}" has an unknown version, ignoring it'.format(self.path))
+            return None
+        return state
+
+    def _write_pending(self):
+        with self.lock:
+            pending = self.pending
+            if pending is None or pending[0] <= self.written:
+                return
+            sequence, state = pending
+            try:
+                self._write(state)
+            except (IOError, OSError, TypeError, ValueError) as e:
+                self.errors += 1
+                if self.errors == 1:
+                    log.warning('Unable to write checkpoint "{0}": {1}'.format(self.path, e))
+                return
+            if self.errors:
+                log.info('Checkpoint "{0}" written again after {1} failures'.format(self.path, self.errors))
+                self.errors = 0
+            self.written = sequence
+
+    def _write(self, state):
+        data = json.dumps(state, sort_keys=True).encode()
+        fd = os.open(self.tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(self.tmp_path, self.path)
+        # The rename itself is only durable once the directory is
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _run(self):
+        while self.running:
+            self.ready.wait()
+            self.ready.clear()
+            self._write_pending()
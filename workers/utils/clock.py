@@ -0,0 +1,131 @@
+#!/usr/bin python
+import threading
+import time
+from datetime import datetime as datetime
+from datetime import timedelta as timedelta
+
+VIRTUAL_CLOCK_POLL = 0.1  # Real seconds a virtual wait rechecks, guards against a missed notify
+
+
+class Clock(object):
+    """
+    Wall clock time for devices and workers. Everything that sleeps or reads the time in a device
+    loop or a worker timer goes through one of these, so a simulation can swap in a VirtualClock.
+    """
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def time(self):
+        return time.time()
+
+    def now(self):
+        return datetime.now()
+
+    def wait(self, event, timeout=None):
+        """
+        Waits for a threading.Event like event.wait(timeout) does.
+        """
+        return event.wait(timeout)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def notify(self):
+        """
+        Has to be called after setting an event some thread may be waiting on through wait().
+        """
+        pass
+
+    def register(self):
+        """
+        Registers the calling thread as one that only sleeps through this clock.
+        """
+        pass
+
+    def unregister(self):
+        pass
+
+
+REAL_CLOCK = Clock()
+
+
+class VirtualClock(Clock):
+    """
+    Simulated time that jumps straight to the next deadline as soon as every registered thread is
+    waiting on the clock and none of them is runnable, so simulations run as fast as the CPU allows.
+    Threads that are not registered (i.e. the one talking to the master) still run in real time
+    and only observe the virtual time.
+    """
+
+    def __init__(self, start=None):
+        self.start = start if start is not None else datetime.now()
+        self.start_time = time.mktime(self.start.timetuple()) + self.start.microsecond / 1e6
+        self.elapsed = 0.0
+        self.participants = 0
+        self.waiters = {}
+        self.condition = threading.Condition()
+        self.local = threading.local()
+
+    def monotonic(self):
+        return self.elapsed
+
+    def time(self):
+        return self.start_time + self.elapsed
+
+    def now(self):
+        return self.start + timedelta(seconds=self.elapsed)
+
+    def register(self):
+        with self.condition:
+            self.local.registered = True
+            self.participants += 1
+
+    def unregister(self):
+        with self.condition:
+            self.local.registered = False
+            self.participants -= 1
+            self._advance()
+
+    def notify(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def sleep(self, seconds):
+        self.wait(threading.Event(), seconds)
+
+    def wait(self, event, timeout=None):
+        with self.condition:
+            deadline = float('inf') if timeout is None else self.elapsed + max(0.0, timeout)
+            waiter = (deadline, event, getattr(self.local, 'registered', False))
+            key = id(waiter)
+            self.waiters[key] = waiter
+            try:
+                while not event.is_set() and self.elapsed < deadline:
+                    self._advance()
+                    if event.is_set() or self.elapsed >= deadline:
+                        break
+                    self.condition.wait(VIRTUAL_CLOCK_POLL)
+            finally:
+                del self.waiters[key]
+            return event.is_set()
+
+    def _advance(self):
+        # Only jump when every registered thread waits and nobody is about to run
+        if sum(1 for waiter in self.waiters.values() if waiter[2]) < self.participants:
+            return
+        for deadline, event, registered in self.waiters.values():
+            if event.is_set() or deadline <= self.elapsed:
+                return
+        deadline = min([waiter[0] for waiter in self.waiters.values()] or [float('inf')])
+        if deadline != float('inf'):
+            self.elapsed = deadline
+            self.condition.notify_all()
+
+    def advance(self, seconds):
+        """
+        Moves time forward by hand, i.e. for threads that are not registered.
+        """
+        with self.condition:
+            self.elapsed += seconds
+            self.condition.notify_all()
@@ -0,0 +1,114 @@
+#!/usr/bin python
+from collections import deque
+
+from workers.utils.plant import WATER_HEAT_CAPACITY
+
+ESTIMATOR_MEASUREMENT_NOISE = 0.05  # C standard deviation of a probe sample, DS18B20 quantisation is 0.0625
+ESTIMATOR_TEMPERATURE_NOISE = 0.001  # C^2 per second the model is allowed to be off by
+ESTIMATOR_DRIFT_NOISE = 1e-9  # (C/s)^2 per second the unmodelled drift may change by
+
+
+class Estimate(object):
+    __slots__ = ['temperature', 'rate', 'timestamp']
+
+    def __init__(self, temperature, rate, timestamp):
+        self.temperature = temperature
+        self.rate = rate  # C per second
+        self.timestamp = timestamp  # Monotonic time of the sample it is based on
+
+    def at(self, monotonic):
+        """
+        :return: The temperature extrapolated to monotonic, i.e. between two probe samples.
+        """
+        return self.temperature + self.rate * (monotonic - self.timestamp)
+
+
+class TemperatureEstimator(object):
+    """
+    Kalman filter over the kettle model of a KettlePlant (watts, liters, cooling, transport delay,
+    loss to ambient) that is fed every probe sample together with the SSR duty of the cycle before.
+    The state is the temperature and an unmodelled drift (a wrong cooling rate, a lid taken off),
+    the heat still on its way through the transport delay comes from the duty history. Quantised
+    or noisy samples come out as a smooth temperature, plus a rate of change that is the model's
+    and not a difference of two samples, so a PID can use it for the D term.
+    """
+
+    def __init__(self, plant, cycle_time, plant_cycle_time=None, measurement_noise=ESTIMATOR_MEASUREMENT_NOISE,
+                 temperature_noise=ESTIMATOR_TEMPERATURE_NOISE, drift_noise=ESTIMATOR_DRIFT_NOISE):
+        """
+        :param plant: Dict with watts, liters and optionally cooling (C/s), delay, loss (1/s) and ambient.
+        :param cycle_time: Seconds between two update() calls.
+        :param plant_cycle_time: Seconds per step of the plant delay, cycle_time if not given.
+        """
+        self.cycle_time = cycle_time
+        self.heat = plant['watts'] * cycle_time / (WATER_HEAT_CAPACITY * plant['liters'])  # C per cycle at full power
+        self.cooling = plant.get('cooling', 0.0)
+        self.loss = plant.get('loss', 0.0)
+        self.ambient = plant.get('ambient', 20.0)
+        delay = plant.get('delay', 0) * (plant_cycle_time or cycle_time)
+        self.delay = int(round(delay / cycle_time))
+        self.r = measurement_noise ** 2
+        self.q_temperature = temperature_noise * cycle_time
+        self.q_drift = drift_noise * cycle_time
+        self.in_flight = deque([0.0] * self.delay)  # Heat on its way, oldest first
+        self.temperature = None
+        self.drift = 0.0  # C per second
+        self.p = [[1.0, 0.0], [0.0, 1e-6]]  # Covariance of temperature and drift
+        self.estimate = None
+
+    def reset(self, temperature):
+        self.temperature = temperature
+        self.drift = 0.0
+        self.p = [[self.r, 0.0], [0.0, 1e-6]]
+        self.in_flight = deque([0.0] * self.delay)
+
+    def _rate(self, temperature, arriving):
+        return arriving / self.cycle_time + self.drift - self.cooling - self.loss * (temperature - self.ambient)
+
+    def update(self, measured_value, duty, timestamp=0.0):
+        """
+        :param duty: SSR duty (0..1) during the cycle that ended with this sample.
+        :return: The Estimate after this sample.
+        """
+        if self.temperature is None:
+            self.reset(measured_value)
+        dt = self.cycle_time
+        self.in_flight.append(duty * self.heat)
+        arriving = self.in_flight.popleft()
+        # Predict: x = F x + heat, with F = [[1 - loss dt, dt], [0, 1]]
+        f = 1.0 - self.loss * dt
+        temperature = f * self.temperature + dt * self.drift + arriving - (self.cooling - self.loss * self.ambient) * dt
+        (p00, p01), (p10, p11) = self.p
+        p00, p01, p10, p11 = (f * f * p00 + f * dt * (p01 + p10) + dt * dt * p11 + self.q_temperature,
+                              f * p01 + dt * p11,
+                              f * p10 + dt * p11,
+                              p11 + self.q_drift)
+        # Correct with the sample, H = [1, 0]
+        s = p00 + self.r
+        k0 = p00 / s
+        k1 = p10 / s
+        innovation = measured_value - temperature
+        self.temperature = temperature + k0 * innovation
+        self.drift += k1 * innovation
+        self.p = [[(1.0 - k0) * p00, (1.0 - k0) * p01], [p10 - k1 * p00, p11 - k1 * p01]]
+        self.estimate = Estimate(self.temperature, self._rate(self.temperature, self.in_flight[0] if self.delay else
+                                                              duty * self.heat), timestamp)
+        return self.estimate
+
+
+class EstimatingController(object):
+    """
+    Puts a TemperatureEstimator in front of a PID or PredictiveController for closed_loop and the
+    benchmarks: calculate() feeds the sample and the duty of the cycle before into the estimator
+    and the controller only sees the estimate.
+    """
+
+    def __init__(self, controller, estimator):
+        self.controller = controller
+        self.estimator = estimator
+        self.output = 0.0
+
+    def calculate(self, measured_value, set_point):
+        estimate = self.estimator.update(measured_value, self.output)
+        self.output = self.controller.calculate(estimate.temperature, set_point, estimate.rate)
+        return self.output
@@ -0,0 +1,101 @@
+#!/usr/bin python
+"""
+Builds Grafana dashboard rows. The panel layout is the JSON of a graph panel made in Grafana
+(view panel json, i.e. https://imgur.com/HcsW9sf) turned into a function of its series.
+"""
+
+
+def target(expr, legend, index):
+    return {
+        "expr": expr,
+        "format": "time_series",
+        "instant": False,
+        "interval": "",
+        "intervalFactor": 2,
+        "legendFormat": legend,
+        "refId": chr(ord('A') + index),
+        "step": 1
+    }
+
+
+def axis(y_format, show=True, minimum=None):
+    return {
+        "decimals": None,
+        "format": y_format,
+        "label": None,
+        "logBase": 1,
+        "max": None,
+        "min": minimum,
+        "show": show
+    }
+
+
+def graph(panel_id, title, targets, left_format, right_format=None, right_aliases=(), span=12):
+    """
+    :param targets: List of (expression, legend); legends in right_aliases go on the right y axis.
+    """
+    return {
+        "aliasColors": {},
+        "bars": False,
+        "dashLength": 10,
+        "dashes": False,
+        "datasource": None,
+        "fill": 1,
+        "id": panel_id,
+        "legend": {
+            "avg": False,
+            "current": False,
+            "max": False,
+            "min": False,
+            "show": True,
+            "total": False,
+            "values": False
+        },
+        "lines": True,
+        "linewidth": 1,
+        "links": [],
+        "nullPointMode": "null",
+        "percentage": False,
+        "pointradius": 5,
+        "points": False,
+        "renderer": "flot",
+        "seriesOverrides": [{"alias": alias, "yaxis": 2} for alias in right_aliases],
+        "spaceLength": 10,
+        "span": span,
+        "stack": False,
+        "steppedLine": False,
+        "targets": [target(expr, legend, index) for index, (expr, legend) in enumerate(targets)],
+        "thresholds": [],
+        "timeFrom": None,
+        "timeShift": None,
+        "title": title,
+        "tooltip": {
+            "shared": True,
+            "sort": 0,
+            "value_type": "individual"
+        },
+        "type": "graph",
+        "xaxis": {
+            "buckets": None,
+            "mode": "time",
+            "name": None,
+            "show": True,
+            "values": []
+        },
+        "yaxes": [
+            axis(left_format),
+            axis(right_format or "short", show=right_format is not None)
+        ]
+    }
+
+
+def row(panels, title=None, collapse=False):
+    result = {"panels": panels}
+    if title is not None:
+        result["title"] = title
+        result["collapse"] = collapse
+    return result
+
+
+def selector(**labels):
+    return '{' + ','.join('{0}="{1}"'.format(key, value) for key, value in sorted(labels.items())) + '}'
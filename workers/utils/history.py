@@ -0,0 +1,183 @@
+#!/usr/bin python
+"""
+Fixed size on-node history of a worker: a ring of binary records in a memory mapped file that
+survives restarts and can be read back without copying.
+
+    python -m workers.utils.history /var/lib/distribrewed/mash.history --buckets 100
+"""
+import argparse
+import logging
+import mmap
+import os
+import struct
+import sys
+
+from workers.utils.lazy import lazy_import
+
+np = lazy_import('numpy')  # Only queries need numpy, appending is plain struct
+
+log = logging.getLogger(__name__)
+
+HISTORY_MAGIC = b'DBH1'
+HISTORY_HEADER = struct.Struct('<4sIQQ')  # magic, record size, capacity, written
+HISTORY_HEADER_SIZE = 64
+HISTORY_FIELDS = ['timestamp', 'temperature', 'set_point', 'heating_ratio', 'pp', 'pi', 'pd']
+HISTORY_RECORD = struct.Struct('<' + 'd' * len(HISTORY_FIELDS))
+HISTORY_CAPACITY = 100000  # About 5.6 MB, 11 days of 10 second samples
+
+
+def history_dtype():
+    return np.dtype([(field, '<f8') for field in HISTORY_FIELDS])
+
+
+class HistoryFile(object):
+    """
+    Ring of HISTORY_FIELDS records, oldest overwritten first. One thread appends, any thread can
+    query; a query racing the writer may see the oldest records already replaced by new ones.
+    Queries return numpy structured arrays that are views on the mapping as long as the range
+    does not wrap around the end of the ring.
+    """
+
+    def __init__(self, path, capacity=HISTORY_CAPACITY, read_only=False):
+        """
+        Opens the history at path, or starts a new one if there is none with this capacity. Only an
+        empty file or a history of another capacity is (re)initialised, any other file is left alone.
+        :param capacity: Records in the ring, None to take it from the existing file.
+        :param read_only: Only read an existing history, never create or change a file.
+        :raise ValueError: If path holds something else than a history.
+        """
+        self.path = path
+        fd = os.open(path, os.O_RDONLY if read_only else os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            header = os.pread(fd, HISTORY_HEADER.size, 0)
+            if size and not header.startswith(HISTORY_MAGIC):
+                raise ValueError('"{0}" is not a history file'.format(path))
+            existing = self._existing_capacity(header, capacity)
+            self.capacity = existing or capacity or HISTORY_CAPACITY
+            self.size = HISTORY_HEADER_SIZE + self.capacity * HISTORY_RECORD.size
+            if read_only:
+                if existing is None or size != self.size:
+                    raise ValueError('History "{0}" is incomplete or of another format'.format(path))
+                self.map = mmap.mmap(fd, self.size, access=mmap.ACCESS_READ)
+            else:
+                if existing is None or size != self.size:
+                    if size:
+                        log.warning('History "{0}" does not match capacity {1}, starting a new one'.format(
+                            path, self.capacity))
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, self.size)
+                    os.pwrite(fd, HISTORY_HEADER.pack(HISTORY_MAGIC, HISTORY_RECORD.size, self.capacity, 0), 0)
+                self.map = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        self.written = HISTORY_HEADER.unpack_from(self.map, 0)[3]
+        self._records = None
+
+    @property
+    def records(self):
+        # The numpy view on the ring, created by the first query
+        if self._records is None:
+            self._records = np.frombuffer(self.map, history_dtype(), self.capacity, HISTORY_HEADER_SIZE)
+        return self._records
+
+    @staticmethod
+    def _existing_capacity(header, capacity):
+        if len(header) == HISTORY_HEADER.size:
+            magic, record_size, existing, written = HISTORY_HEADER.unpack(header)
+            if magic == HISTORY_MAGIC and record_size == HISTORY_RECORD.size and capacity in [None, existing]:
+                return existing
+        return None
+
+    def close(self):
+        self._records = None
+        self.map.close()
+
+    def flush(self):
+        self.map.flush()
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def append(self, timestamp, temperature, set_point, heating_ratio, pp=0.0, pi=0.0, pd=0.0):
+        # Record first, then the count, so a reader never sees a record that is not written yet
+        offset = HISTORY_HEADER_SIZE + (self.written % self.capacity) * HISTORY_RECORD.size
+        HISTORY_RECORD.pack_into(self.map, offset, timestamp, temperature, set_point, heating_ratio, pp, pi, pd)
+        self.written += 1
+        struct.pack_into('<Q', self.map, HISTORY_HEADER.size - 8, self.written)
+
+    def _segments(self):
+        # The ring in time order as one or two views
+        written = self.written
+        if written <= self.capacity:
+            return [self.records[:written]]
+        head = written % self.capacity
+        return [self.records[head:], self.records[:head]]
+
+    def latest(self, count):
+        segments = self._segments()
+        if count <= len(segments[-1]):
+            return segments[-1][len(segments[-1]) - count:]
+        return np.concatenate(segments)[-count:]
+
+    def range(self, start=None, end=None):
+        """
+        :return: Records with start <= timestamp < end, both optional.
+        """
+        parts = []
+        for segment in self._segments():
+            timestamps = segment['timestamp']
+            low = 0 if start is None else np.searchsorted(timestamps, start, 'left')
+            high = len(segment) if end is None else np.searchsorted(timestamps, end, 'left')
+            if high > low:
+                parts.append(segment[low:high])
+        if not parts:
+            return self.records[:0]
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def downsample(self, start=None, end=None, buckets=100):
+        """
+        Averages every field over equal time buckets between start and end.
+        :return: One record per bucket that holds samples, the timestamp is the mean of the bucket.
+        """
+        records = self.range(start, end)
+        if len(records) == 0:
+            return np.zeros(0, history_dtype())
+        timestamps = records['timestamp']
+        first = timestamps[0] if start is None else start
+        last = timestamps[-1] if end is None else end
+        width = max(last - first, 1e-9) / buckets
+        index = np.minimum(((timestamps - first) / width).astype(np.int64), buckets - 1)
+        counts = np.bincount(index, minlength=buckets)
+        used = counts > 0
+        result = np.zeros(int(used.sum()), history_dtype())
+        for field in HISTORY_FIELDS:
+            result[field] = np.bincount(index, records[field], buckets)[used] / counts[used]
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--start', type=float, default=None, help='Unix time')
+    parser.add_argument('--end', type=float, default=None, help='Unix time')
+    parser.add_argument('--buckets', type=int, default=None, help='Average into this many rows')
+    args = parser.parse_args()
+    try:
+        history = HistoryFile(args.path, None, read_only=True)
+    except (OSError, ValueError) as e:
+        sys.exit('Unable to read history: {0}'.format(e))
+    if args.buckets:
+        records = history.downsample(args.start, args.end, args.buckets)
+    else:
+        records = history.range(args.start, args.end)
+    sys.stdout.write(','.join(HISTORY_FIELDS) + '\n')
+    for record in records:
+        sys.stdout.write(','.join(repr(float(value)) for value in record) + '\n')
+    # Views on the mapping keep it from being closed
+    records = record = None
+    history.close()
+
+
+if __name__ == "__main__":
+    main()
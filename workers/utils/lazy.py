@@ -0,0 +1,35 @@
+#!/usr/bin python
+import importlib
+import importlib.util
+import sys
+
+
+class LazyModule(object):
+    """
+    Stands in for a module that is slow to import (numpy, prometheus_client) and only imports it
+    when one of its attributes is first used, so a worker does not pay for it on the way to its
+    first SSR actuation. Every attribute is looked up once and then kept on the stand-in.
+    """
+
+    def __init__(self, name):
+        self.__name__ = name
+
+    def __getattr__(self, attribute):
+        # Only called for attributes that were not looked up yet, importing is thread safe
+        value = getattr(importlib.import_module(self.__name__), attribute)
+        setattr(self, attribute, value)
+        return value
+
+    def __repr__(self):
+        return '<lazy module {0}>'.format(self.__name__)
+
+
+def lazy_import(name):
+    """
+    :return: A LazyModule for name, None if the module is not installed.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        return None
+    return LazyModule(name)
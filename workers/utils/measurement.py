@@ -0,0 +1,115 @@
+#!/usr/bin python
+import logging
+import threading
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+MEASUREMENT_BUFFER_SIZE = 1024
+
+
+class Measurement(object):
+    """
+    One sample of a worker device, made on the device thread without any string formatting. work
+    is a format string for target (the set temperature), remaining a number, a timedelta or None.
+    Supports get() and [] like the dict it replaces.
+    """
+    __slots__ = ['name', 'device_name', 'value', 'set_point', 'work', 'target', 'remaining', 'timestamp']
+
+    def __init__(self, name, device_name, value, set_point, work, remaining, target=None, timestamp=None):
+        self.name = name
+        self.device_name = device_name
+        self.value = value
+        self.set_point = set_point
+        self.work = work
+        self.target = set_point if target is None else target
+        self.remaining = remaining
+        self.timestamp = timestamp
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def work_text(self):
+        return self.work.format(self.target)
+
+    def remaining_text(self):
+        if self.remaining is None:
+            return 'Unknown'
+        if isinstance(self.remaining, float):
+            return '{:.2f}'.format(self.remaining)
+        return str(self.remaining)
+
+    def as_dict(self):
+        result = dict((key, self.get(key)) for cls in type(self).__mro__ for key in getattr(cls, '__slots__', []))
+        result['work'] = self.work_text()
+        result['remaining'] = self.remaining_text()
+        return result
+
+
+class MeasurementBuffer(object):
+    """
+    Bounded ring of measurements drained by one background thread that hands each of them to
+    consumer. put() never blocks, when the consumer falls behind the oldest samples are dropped
+    and counted in dropped. setup, if given, is called on the thread before the first measurement,
+    for slow preparations of the consumer that should not hold up the worker.
+    """
+
+    def __init__(self, consumer, size=MEASUREMENT_BUFFER_SIZE, name='measurements', setup=None):
+        self.consumer = consumer
+        self.setup = setup
+        self.name = name
+        self.samples = deque(maxlen=size)
+        self.dropped = 0
+        self.ready = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.ready.set()
+
+    def put(self, measurement):
+        if len(self.samples) == self.samples.maxlen:
+            self.dropped += 1
+        self.samples.append(measurement)
+        if not self.ready.is_set():
+            self.ready.set()
+
+    def drain(self):
+        """
+        Hands every buffered measurement to the consumer.
+        :return: Number of measurements consumed.
+        """
+        count = 0
+        while True:
+            try:
+                measurement = self.samples.popleft()
+            except IndexError:
+                return count
+            try:
+                self.consumer(measurement)
+            except Exception as e:
+                log.warning('Unable to consume measurement of {0}: {1}'.format(measurement.device_name, e))
+            count += 1
+
+    def _run(self):
+        if self.setup is not None:
+            try:
+                self.setup()
+            except Exception as e:
+                log.warning('Unable to set up {0}: {1}'.format(self.name, e))
+        while self.running:
+            self.ready.wait()
+            self.ready.clear()
+            self.drain()
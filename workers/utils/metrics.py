@@ -0,0 +1,104 @@
+#!/usr/bin python
+import threading
+
+from workers.utils.lazy import lazy_import
+
+# Imported when the first metric is created, metrics are only recorded when it is installed
+prometheus_client = lazy_import('prometheus_client')
+
+METRIC_LABELS = ['name', 'device_name']  # Worker name and device name, like TEMPERATURE and HEATING_RATIO
+PROBE_READ_BUCKETS = (.001, .005, .01, .05, .1, .25, .5, .75, 1.0, 1.5, 2.5)
+CALLBACK_BUCKETS = (.00001, .00005, .0001, .0005, .001, .005, .01, .05, .1)
+LOOP_JITTER_BUCKETS = (.001, .005, .01, .05, .1, .5, 1.0, 5.0)
+DUTY_ERROR_BUCKETS = (.001, .005, .01, .02, .05, .1, .2, .5)
+DEVICE_STALL_FACTOR = 2.0  # A cycle starting this many cycle times (plus a second) late is a stall
+
+
+class NoopMetric(object):
+    """
+    Stands in for a metric (or a label child of one) when nothing is recorded.
+    """
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, value=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def set_to_current_time(self):
+        pass
+
+    def set_function(self, f):
+        pass
+
+
+NOOP_METRIC = NoopMetric()
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def metric(kind, name, documentation, labels=METRIC_LABELS, **kwargs):
+    """
+    :param kind: "Counter", "Gauge" or "Histogram".
+    :return: The metric registered under name, created on first use, NOOP_METRIC without prometheus_client.
+    """
+    if prometheus_client is None:
+        return NOOP_METRIC
+    with _metrics_lock:
+        if name not in _metrics:
+            _metrics[name] = getattr(prometheus_client, kind)(name, documentation, labels, **kwargs)
+        return _metrics[name]
+
+
+class DeviceMetrics(object):
+    """
+    Label children of the device metrics for one device. Each child is bound on first use and
+    then stored as a plain attribute, so recording on the device thread is a single observe()/inc()
+    without label lookups, and a device only exports the metrics it records. Without a worker name
+    nothing is recorded, which is the default for devices created outside of a worker.
+    """
+    METRICS = {
+        # attribute: (kind, name, documentation, extra label values, options)
+        'read_seconds': ('Histogram', 'PROBE_READ_SECONDS', 'Probe read time', [],
+                         {'buckets': PROBE_READ_BUCKETS}),
+        'read_crc_errors': ('Counter', 'PROBE_READ_ERRORS', 'Failed probe reads', ['crc'], {}),
+        'read_io_errors': ('Counter', 'PROBE_READ_ERRORS', 'Failed probe reads', ['io'], {}),
+        'read_outliers': ('Counter', 'PROBE_READ_ERRORS', 'Failed probe reads', ['outlier'], {}),
+        'read_stale': ('Counter', 'PROBE_STALE_CYCLES', 'Probe cycles without a recent enough sample', [], {}),
+        'sample_age': ('Gauge', 'PROBE_SAMPLE_AGE_SECONDS', 'Age of the probe sample the last cycle used', [], {}),
+        'loop_jitter': ('Histogram', 'DEVICE_LOOP_JITTER_SECONDS', 'Deviation of the cycle period', [],
+                        {'buckets': LOOP_JITTER_BUCKETS}),
+        'loop_stalls': ('Counter', 'DEVICE_STALLS', 'Device cycles that started far too late', [], {}),
+        'last_cycle': ('Gauge', 'DEVICE_LAST_CYCLE', 'Unix time of the last device cycle', [], {}),
+        'duty_error': ('Histogram', 'SSR_DUTY_ERROR', 'Achieved minus requested duty per SSR window', [],
+                       {'buckets': DUTY_ERROR_BUCKETS})
+    }
+    EXTRA_LABELS = {'PROBE_READ_ERRORS': ['reason']}
+
+    def __init__(self, worker_name=None, device_name=None):
+        self.worker_name = worker_name
+        self.device_name = device_name
+
+    def __getattr__(self, attribute):
+        # Only called for children that are not bound yet
+        if attribute not in self.METRICS:
+            raise AttributeError(attribute)
+        if self.worker_name is None:
+            child = NOOP_METRIC
+        else:
+            kind, name, documentation, values, options = self.METRICS[attribute]
+            labels = METRIC_LABELS + self.EXTRA_LABELS.get(name, [])
+            child = metric(kind, name, documentation, labels, **options).labels(
+                self.worker_name, self.device_name, *values)
+        setattr(self, attribute, child)
+        return child
+
+
+NOOP_DEVICE_METRICS = DeviceMetrics()
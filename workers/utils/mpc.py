@@ -0,0 +1,59 @@
+#!/usr/bin python
+from collections import deque
+
+from workers.utils.plant import WATER_HEAT_CAPACITY
+
+MPC_BIAS_SMOOTHING = 0.1  # Weight of a new model error in the disturbance estimate
+
+
+class PredictiveController(object):
+    """
+    Model predictive heater control from the kettle model of a KettlePlant (watts, liters, cooling,
+    transport delay, loss to ambient). Every call predicts where the temperature ends up once the
+    heat already on its way has arrived, and picks the duty that lands that prediction on the
+    set point one transport delay from now. Far below the set point that is full power; close to
+    it the heater is cut early and the kettle coasts in. The model error of every step feeds a
+    disturbance estimate, so a wrong model still settles on the set point.
+
+    Takes the place of PID: calculate() is called once per cycle_time and returns a duty of 0..1.
+    """
+
+    def __init__(self, plant, cycle_time, plant_cycle_time=None, bias_smoothing=MPC_BIAS_SMOOTHING):
+        """
+        :param plant: Dict with watts, liters and optionally cooling (C/s), delay, loss (1/s) and ambient.
+        :param plant_cycle_time: Seconds per step of the plant delay, cycle_time if not given.
+        """
+        self.cycle_time = cycle_time
+        self.heat = plant['watts'] * cycle_time / (WATER_HEAT_CAPACITY * plant['liters'])  # C per cycle at full power
+        self.cooling = plant.get('cooling', 0.0) * cycle_time
+        self.loss = plant.get('loss', 0.0) * cycle_time
+        self.ambient = plant.get('ambient', 20.0)
+        delay = plant.get('delay', 0) * (plant_cycle_time or cycle_time)
+        self.delay = int(round(delay / cycle_time))
+        self.bias_smoothing = bias_smoothing
+        self.in_flight = deque([0.0] * self.delay)  # Heat on its way, oldest first
+        self.bias = 0.0
+        self.expected = None
+        self.predicted = None
+        self.output = 0.0
+
+    def _drift(self, temperature):
+        return self.bias - self.cooling - self.loss * (temperature - self.ambient)
+
+    def calculate(self, measured_value, set_point, rate=None):
+        # rate (C/s, i.e. from a TemperatureEstimator) is not needed, the model predicts it
+        if self.expected is not None:
+            self.bias += self.bias_smoothing * (measured_value - self.expected - self.bias)
+        coast = measured_value + sum(self.in_flight) + (self.delay + 1) * self._drift(measured_value)
+        output = (set_point - coast) / self.heat
+        if output > 1.0:
+            output = 1.0
+        elif output < 0.0:
+            output = 0.0
+        self.in_flight.append(output * self.heat)
+        arriving = self.in_flight.popleft()
+        # What the model alone expects for the next sample, the difference is learned into bias
+        self.expected = measured_value + arriving - self.cooling - self.loss * (measured_value - self.ambient)
+        self.predicted = coast + output * self.heat
+        self.output = output
+        return output
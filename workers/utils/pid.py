@@ -28,10 +28,12 @@ class PIDParams:
             self.xk_1 = 0.0
             self.xk_2 = 0.0
             self.yk = 0.0
+            self.rk_1 = None
         else:
             self.xk_1 = last.xk_1
             self.xk_2 = last.xk_2
             self.yk = last.yk
+            self.rk_1 = last.rk_1
 
     def update(self, xk):
         self.xk_2 = self.xk_1
@@ -79,7 +81,7 @@ class PID():
         p.lpf1 = (2.0 * p.k_lpf - p.ts) / (2.0 * p.k_lpf + p.ts)
         p.lpf2 = p.ts / (2.0 * p.k_lpf + p.ts)
 
-    def pid_reg4(self, xk, tset, p, vrg):
+    def pid_reg4(self, xk, tset, p, vrg, rk=None):
         # From http:#www.vandelogt.nl/datasheets/pid_controller_calculus_v320.pdf
         # This function implements the Takahashi PID controller,
         # which is a type C controller: the P and D term are no
@@ -90,6 +92,8 @@ class PID():
         # The setpoint value for the temperature
         # Pointer to struct containing PID parameters
         # Release signal: 1 = Start control, 0 = disable PID controller No values are returned
+        # Optional rate of change of PV [C/s], i.e. from a TemperatureEstimator. Given, the D term uses
+        # its change instead of the second difference of PV, which amplifies probe quantisation.
 
         lpf = 0.0  # LPF output
         ek = tset - xk  # calculate e[k] = SP[k] - PV[k]
@@ -97,7 +101,12 @@ class PID():
             # Calculate PID controller:
             p.pp = p.kc * (p.xk_1 - xk)  # y[k] = y[k - 1] + Kc * (PV[k - 1] - PV[k])
             p.pi = p.k0 * ek           # + Kc * Ts / Ti * e[k]
-            p.pd = p.k1 * (2.0 * p.xk_1 - xk - p.xk_2)
+            if rk is None:
+                p.pd = p.k1 * (2.0 * p.xk_1 - xk - p.xk_2)
+            elif p.rk_1 is None:
+                p.pd = 0.0
+            else:
+                p.pd = p.kc * p.td * (p.rk_1 - rk)  # Kc.Td.(r[k-1] - r[k]), r = dPV/dt
             p.yk += p.pp + p.pi + p.pd
 
         else:
@@ -105,6 +114,7 @@ class PID():
 
         #print '{0} += {1} + {2} + {3}'.format(p.yk, p.pp, p.pi, p.pd)
         p.update(xk) # PV[k-2] = PV[k-1] and PV[k-1] = PV[k]
+        p.rk_1 = rk
         # limit y[k] to GMA_HLIM and GMA_LLIM
         if p.yk > PID.GMA_HLIM:
             p.yk = PID.GMA_HLIM
@@ -114,10 +124,11 @@ class PID():
         return p.yk
 
 
-    def calculate(self, measured_value, set_point):
-        output = self.pid_reg4(measured_value, set_point, self.pid_params, True)
+    def calculate(self, measured_value, set_point, rate=None):
+        output = self.pid_reg4(measured_value, set_point, self.pid_params, True, rate)
         return output / 100.0
 
+    # Shared by every caller in the process, simulations should use utils.plant.KettlePlant instead
     heating_delay = deque()
 
     @staticmethod
@@ -0,0 +1,91 @@
+#!/usr/bin python
+import numpy as np
+
+from workers.utils.pid import PID, PIDParams, KC_DEFAULT, TI_DEFAULT, TD_DEFAULT
+
+
+class PIDBank(object):
+    """
+    N independent PID loops with every PIDParams field stored as a numpy array, so pid_reg4 runs
+    for all loops in one vectorized call. Every operation is done in the same order as in the
+    scalar PID, so the outputs are bit for bit equal to N PID objects fed the same inputs.
+    """
+    FIELDS = ['kc', 'ti', 'td', 'ts', 'k_lpf', 'k0', 'k1', 'k2', 'k3', 'lpf1', 'lpf2',
+              'pp', 'pi', 'pd', 'xk_1', 'xk_2', 'yk']
+
+    def __init__(self, size, cycle_time, kc=KC_DEFAULT, ti=TI_DEFAULT, td=TD_DEFAULT):
+        self.size = size
+        for field in self.FIELDS:
+            setattr(self, field, np.zeros(size))
+        self.ts[:] = cycle_time
+        self.kc[:] = kc
+        self.ti[:] = ti
+        self.td[:] = td
+        self._ek = np.empty(size)
+        self._tmp = np.empty(size)
+        self.init_pid4()
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Builds a bank from a list of (already initialised) PIDParams, i.e. [pid.pid_params for pid in pids].
+        """
+        bank = cls(len(params), 0.0)
+        for field in cls.FIELDS:
+            getattr(bank, field)[:] = [getattr(p, field) for p in params]
+        return bank
+
+    def params(self, index):
+        """
+        :return: A PIDParams with the current state of loop index, i.e. to hand it back to a scalar PID.
+        """
+        p = PIDParams()
+        for field in self.FIELDS:
+            setattr(p, field, float(getattr(self, field)[index]))
+        return p
+
+    def init_pid4(self):
+        # Same as PID.init_pid4, for every loop
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.k0[:] = np.where(self.ti == 0.0, 0.0, self.kc * self.ts / self.ti)
+            self.k1[:] = self.kc * self.td / self.ts
+            self.lpf1[:] = (2.0 * self.k_lpf - self.ts) / (2.0 * self.k_lpf + self.ts)
+            self.lpf2[:] = self.ts / (2.0 * self.k_lpf + self.ts)
+
+    def pid_reg4(self, xk, tset, vrg=True):
+        """
+        Takahashi type C controller of PID.pid_reg4 for all loops at once.
+        :param xk: Measured values, array of size N (or a scalar for all loops).
+        :param tset: Setpoints, array of size N (or a scalar).
+        :param vrg: Release signal, bool or boolean array of size N.
+        :return: Array y[k] of size N, a view that is overwritten by the next call.
+        """
+        ek = np.subtract(tset, xk, out=self._ek)
+        tmp = self._tmp
+        # pp = kc * (xk_1 - xk)
+        np.subtract(self.xk_1, xk, out=self.pp)
+        np.multiply(self.kc, self.pp, out=self.pp)
+        # pi = k0 * ek
+        np.multiply(self.k0, ek, out=self.pi)
+        # pd = k1 * (2.0 * xk_1 - xk - xk_2)
+        np.multiply(2.0, self.xk_1, out=self.pd)
+        np.subtract(self.pd, xk, out=self.pd)
+        np.subtract(self.pd, self.xk_2, out=self.pd)
+        np.multiply(self.k1, self.pd, out=self.pd)
+        # yk += pp + pi + pd
+        np.add(self.pp, self.pi, out=tmp)
+        np.add(tmp, self.pd, out=tmp)
+        np.add(self.yk, tmp, out=self.yk)
+        if vrg is not True:
+            disabled = np.logical_not(vrg)
+            for field in [self.yk, self.pp, self.pi, self.pd]:
+                field[disabled] = 0.0
+        self.xk_2[:] = self.xk_1
+        self.xk_1[:] = xk
+        # limit y[k] like the scalar comparisons do (np.clip may differ on -0.0)
+        np.copyto(self.yk, PID.GMA_HLIM, where=self.yk > PID.GMA_HLIM)
+        np.copyto(self.yk, PID.GMA_LLIM, where=self.yk < PID.GMA_LLIM)
+        return self.yk
+
+    def calculate(self, measured_value, set_point):
+        return self.pid_reg4(measured_value, set_point, True) / 100.0
@@ -0,0 +1,109 @@
+#!/usr/bin python
+from collections import deque
+
+from workers.utils.lazy import lazy_import
+
+np = lazy_import('numpy')  # Only KettleBatch needs numpy
+
+WATER_HEAT_CAPACITY = 4184.0  # 4,184 watts will heat a liter up by 1C every second.
+
+
+class KettlePlant(object):
+    """
+    Thermal model of one kettle, stepped once per SSR cycle: heater power into the volume of water
+    arriving after a transport delay of a number of steps, a constant cooling rate and an optional
+    heat loss to ambient proportional to the temperature difference. Unlike PID.calc_heating every
+    kettle keeps its own delay line. With loss=0.0 it gives the exact values of PID.calc_heating.
+    """
+
+    def __init__(self, watts, liters, cooling=0.0, delay=10, minimum=10.0, initial=None, ambient=20.0, loss=0.0):
+        self.watts = watts
+        self.liters = liters
+        self.cooling = cooling  # C per second
+        self.delay = delay  # steps
+        self.minimum = minimum
+        self.ambient = ambient
+        self.loss = loss  # 1 / second
+        self.temperature = minimum if initial is None else initial
+        self.heating_delay = deque()
+
+    def reset(self, temperature):
+        self.temperature = temperature
+        self.heating_delay.clear()
+
+    def heat(self, seconds):
+        """
+        :return: Temperature rise from running the heater for seconds.
+        """
+        if seconds > 0:
+            time_watts = self.watts * seconds
+            liter_watts = time_watts / WATER_HEAT_CAPACITY
+            return liter_watts / self.liters
+        return 0.0
+
+    def step(self, seconds, dt):
+        """
+        Advances the kettle by dt seconds during which the heater was on for seconds.
+        :return: The new temperature.
+        """
+        self.heating_delay.appendleft(self.heat(seconds))
+        if len(self.heating_delay) > self.delay:
+            result = self.heating_delay.pop()
+        else:
+            result = 0.0
+        result = self.temperature + result - (self.cooling * dt)
+        if self.loss:
+            result -= self.loss * (self.temperature - self.ambient) * dt
+        if result < self.minimum:
+            result = self.minimum
+        self.temperature = result
+        return result
+
+
+class KettleBatch(object):
+    """
+    Many independent KettlePlants stepped together with numpy, one array element per kettle.
+    Every parameter can be a scalar shared by all kettles or an array with one value per kettle.
+    """
+
+    def __init__(self, size, watts, liters, cooling=0.0, delay=10, minimum=10.0, initial=None, ambient=20.0,
+                 loss=0.0):
+        self.size = size
+        self.watts = self._array(watts)
+        self.liters = self._array(liters)
+        self.cooling = self._array(cooling)
+        self.minimum = self._array(minimum)
+        self.ambient = self._array(ambient)
+        self.loss = self._array(loss)
+        self.delay = np.broadcast_to(np.asarray(delay, dtype=np.int64), (size,)).copy()
+        self.temperature = self._array(minimum if initial is None else initial)
+        self.heating_delay = np.zeros((size, int(self.delay.max()) + 1))
+        self.rows = np.arange(size)
+        self.steps = 0
+
+    def _array(self, value):
+        return np.broadcast_to(np.asarray(value, dtype=float), (self.size,)).copy()
+
+    def reset(self, temperature):
+        self.temperature[:] = temperature
+        self.heating_delay[:] = 0.0
+        self.steps = 0
+
+    def step(self, seconds, dt):
+        """
+        :param seconds: Heater on time per kettle, array or scalar.
+        :param dt: Step length in seconds, array or scalar.
+        :return: Array with the new temperatures.
+        """
+        seconds = np.asarray(seconds, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            heat = np.where(seconds > 0, self.watts * seconds / WATER_HEAT_CAPACITY / self.liters, 0.0)
+        length = self.heating_delay.shape[1]
+        self.heating_delay[:, self.steps % length] = heat
+        delayed = self.heating_delay[self.rows, (self.steps - self.delay) % length]
+        delayed = np.where(self.steps >= self.delay, delayed, 0.0)
+        self.steps += 1
+        result = self.temperature + delayed - (self.cooling * dt)
+        result -= self.loss * (self.temperature - self.ambient) * dt
+        self.temperature = np.where(result < self.minimum, self.minimum, result)
+        return self.temperature
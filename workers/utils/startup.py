@@ -0,0 +1,115 @@
+#!/usr/bin python
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from workers.utils.metrics import metric
+
+log = logging.getLogger(__name__)
+
+# In the order a worker reaches them after a (re)start
+STARTUP_PHASES = ['imports', 'devices', 'auto_setup', 'first_sample', 'first_actuation']
+# Seconds after the process started, on a Raspberry Pi 3 with a DS18B20 (750 ms conversion) and
+# the schedule at hand (see the README)
+STARTUP_BUDGET = {'imports': 1.5, 'auto_setup': 1.7, 'first_sample': 2.5, 'first_actuation': 3.0}
+
+
+def process_started():
+    """
+    :return: time.monotonic() at the moment this process was started (from /proc on Linux), or
+             now where that is not known.
+    """
+    try:
+        with open('/proc/self/stat') as fo:
+            stat = fo.read()
+        # Field 22 is the start time in clock ticks after boot, fields 3 and on follow the command
+        ticks = int(stat[stat.rindex(')') + 2:].split()[19])
+        age = time.clock_gettime(time.CLOCK_BOOTTIME) - ticks / os.sysconf('SC_CLK_TCK')
+        return time.monotonic() - age
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.monotonic()
+
+
+class StartupProfiler(object):
+    """
+    Times the cold start of a worker process in STARTUP_PHASES: each phase is recorded once, the
+    first time it is reached, as the seconds since the process started (at) and the seconds it took
+    (seconds, for a mark the time since the phase before). A phase entered again while it runs or
+    after it was recorded is not timed, so when a BrewhouseWorker sets up its loops the host's
+    phases are the ones that count. When the last phase is reached the whole start is logged and
+    exported as WORKER_STARTUP_SECONDS.
+    """
+
+    def __init__(self, started=None):
+        self.started = process_started() if started is None else started
+        self.phases = OrderedDict()
+        self.active = set()
+        self.lock = threading.Lock()
+        self.worker_name = None
+
+    def since_start(self):
+        return time.monotonic() - self.started
+
+    def mark(self, phase):
+        """
+        Records that phase was reached now, unless it was reached before.
+        """
+        if phase in self.phases:
+            return
+        with self.lock:
+            if phase in self.phases:
+                return
+            at = self.since_start()
+            previous = max([recorded['at'] for recorded in self.phases.values()] or [0.0])
+            self.phases[phase] = {'at': at, 'seconds': max(0.0, at - previous)}
+        self._recorded(phase)
+
+    @contextmanager
+    def phase(self, phase):
+        """
+        Times the block as phase.
+        """
+        with self.lock:
+            timed = phase not in self.phases and phase not in self.active
+            if timed:
+                self.active.add(phase)
+        start = self.since_start()
+        try:
+            yield
+        finally:
+            if timed:
+                with self.lock:
+                    end = self.since_start()
+                    self.active.discard(phase)
+                    self.phases[phase] = {'at': end, 'seconds': end - start}
+                self._recorded(phase)
+
+    def report(self):
+        """
+        :return: Dict of phase to {'at', 'seconds'} for the phases recorded so far.
+        """
+        with self.lock:
+            return dict((phase, dict(recorded)) for phase, recorded in self.phases.items())
+
+    def _recorded(self, phase):
+        if phase != STARTUP_PHASES[-1]:
+            return
+        report = self.report()
+        log.info('Started in {0:.3f}s: {1}'.format(report[phase]['at'], ', '.join(
+            '{0} at {1:.3f}s ({2:.3f}s)'.format(name, report[name]['at'], report[name]['seconds'])
+            for name in STARTUP_PHASES if name in report)))
+        over = [name for name, budget in sorted(STARTUP_BUDGET.items()) if name in report and report[name]['at'] > budget]
+        if over:
+            log.warning('Startup over budget in {0}'.format(', '.join(
+                '{0} ({1:.3f}s > {2}s)'.format(name, report[name]['at'], STARTUP_BUDGET[name]) for name in over)))
+        if self.worker_name is not None:
+            gauge = metric('Gauge', 'WORKER_STARTUP_SECONDS', 'Seconds after the process started a startup phase ended',
+                           ['name', 'phase'])
+            for name, recorded in report.items():
+                gauge.labels(self.worker_name, name).set(recorded['at'])
+
+
+STARTUP = StartupProfiler()
@@ -0,0 +1,265 @@
+#!/usr/bin python
+import json
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+import urllib3
+
+from workers.utils.metrics import metric
+
+log = logging.getLogger(__name__)
+
+TELEGRAM_API_URL = 'https://api.telegram.org'
+TELEGRAM_QUEUE_SIZE = 256  # Messages waiting to be sent, the oldest are dropped beyond this
+TELEGRAM_COALESCE_WINDOW = 10.0  # Seconds in which near-duplicate messages to a chat are merged
+TELEGRAM_CHAT_INTERVAL = 1.0  # Seconds between two messages to one chat, Telegram allows about one per second
+TELEGRAM_RETRIES = 5  # Attempts per message on server or connection errors
+TELEGRAM_BACKOFF = 1.0  # Seconds before the first retry, doubled on every further one
+TELEGRAM_MAX_BACKOFF = 60.0
+TELEGRAM_TIMEOUT = 10.0  # Seconds per HTTP request
+SEND_LATENCY_BUCKETS = (.05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_numbers = re.compile(r'[-+]?\d+(?:[.,]\d+)?')
+_spaces = re.compile(r'\s+')
+
+
+def coalesce_key(chat_id, text):
+    """
+    Messages with the same key are near-duplicates: they only differ in numbers and whitespace,
+    like "Temperature is 64.5" and "Temperature is 64.7".
+    """
+    return chat_id, _spaces.sub(' ', _numbers.sub('#', text)).strip()
+
+
+class OutboundMessage(object):
+    __slots__ = ['chat_id', 'text', 'key', 'count', 'queued', 'not_before', 'attempts']
+
+    def __init__(self, chat_id, text, key, queued, not_before):
+        self.chat_id = chat_id
+        self.text = text
+        self.key = key
+        self.count = 1  # Messages merged into this one
+        self.queued = queued  # Monotonic time the first of them was put
+        self.not_before = not_before
+        self.attempts = 0
+
+    def body(self):
+        text = self.text if self.count == 1 else '{0} (x{1})'.format(self.text, self.count)
+        return {'chat_id': self.chat_id, 'text': text}
+
+
+class TelegramQueue(object):
+    """
+    Sends Telegram messages from one background thread over one HTTP connection pool, so put()
+    never waits for the network. Messages to a chat go out in order, at most one per
+    chat_interval. A message that only differs in numbers from one still waiting is merged into
+    it, so the chat gets the latest text once with a count. The same happens for a message
+    repeating one sent less than coalesce_window ago: it is held back until the window has passed
+    and collects the repeats that arrive meanwhile. Answers 429 pause the chat for the
+    retry_after Telegram asks for, server and connection errors are retried with exponential
+    backoff, other errors drop the message.
+
+    api_url points the queue at another server, i.e. a local stub in a test.
+    """
+
+    def __init__(self, token, api_url=TELEGRAM_API_URL, name='telegram', size=TELEGRAM_QUEUE_SIZE,
+                 coalesce_window=TELEGRAM_COALESCE_WINDOW, chat_interval=TELEGRAM_CHAT_INTERVAL,
+                 retries=TELEGRAM_RETRIES, backoff=TELEGRAM_BACKOFF, timeout=TELEGRAM_TIMEOUT):
+        self.url = '{0}/bot{1}/'.format(api_url.rstrip('/'), token)
+        self.name = name
+        self.size = size
+        self.coalesce_window = coalesce_window
+        self.chat_interval = chat_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.http = urllib3.PoolManager(num_pools=1, maxsize=1, retries=False,
+                                        timeout=urllib3.Timeout(total=timeout))
+        self.chats = {}  # chat id: deque of OutboundMessage in the order they were put
+        self.next_send = {}  # chat id: monotonic time the chat may get its next message
+        self.pending = {}  # coalesce key: OutboundMessage not sent yet
+        self.last_sent = {}  # coalesce key: monotonic time a message with it was last sent
+        self.depth = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.sending = None
+        self.latency = metric('Histogram', 'TELEGRAM_SEND_LATENCY_SECONDS', 'Time from put to sent',
+                              ['name'], buckets=SEND_LATENCY_BUCKETS).labels(name)
+        self.results = dict((result, metric('Counter', 'TELEGRAM_MESSAGES', 'Outbound telegram messages',
+                                            ['name', 'result']).labels(name, result))
+                            for result in ['sent', 'coalesced', 'dropped', 'rate_limited', 'retried'])
+        metric('Gauge', 'TELEGRAM_QUEUE_DEPTH', 'Telegram messages waiting to be sent',
+               ['name']).labels(name).set_function(lambda: self.depth)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """
+        :param timeout: Seconds to keep sending what is queued, nothing more is sent after them.
+        """
+        if self.running:
+            self.flush(timeout)
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def put(self, chat_id, text):
+        now = time.monotonic()
+        key = coalesce_key(chat_id, text)
+        with self.condition:
+            message = self.pending.get(key)
+            if message is not None:
+                message.text = text
+                message.count += 1
+                self.coalesced += 1
+                self.results['coalesced'].inc()
+                return
+            if self.depth >= self.size:
+                self._drop_oldest()
+            not_before = self.last_sent.get(key, now - self.coalesce_window) + self.coalesce_window
+            message = OutboundMessage(chat_id, text, key, now, not_before)
+            self.chats.setdefault(chat_id, deque()).append(message)
+            self.pending[key] = message
+            self.depth += 1
+            self.condition.notify_all()
+
+    def call(self, method, **fields):
+        """
+        Calls a bot API method right away on the caller's thread.
+        :return: The result field of the answer.
+        """
+        status, answer = self._request(method, fields)
+        if not answer.get('ok'):
+            raise IOError('Telegram {0} failed with {1}: {2}'.format(method, status, answer.get('description')))
+        return answer['result']
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued message has been sent or dropped.
+        :return: False if messages are still queued after timeout seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while self.depth:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def _drop_oldest(self):
+        # The message on its way to Telegram stays, whatever its age
+        oldest = min((message for queue in self.chats.values() for message in queue if message is not self.sending),
+                     key=lambda m: m.queued, default=None)
+        if oldest is not None:
+            self._remove(oldest)
+            self._dropped(oldest, 'queue full')
+
+    def _dropped(self, message, reason):
+        self.dropped += message.count
+        self.results['dropped'].inc(message.count)
+        log.warning('Dropped telegram message to {0} ({1}): {2}'.format(message.chat_id, reason, message.text))
+
+    def _remove(self, message):
+        self.chats[message.chat_id].remove(message)
+        if self.pending.get(message.key) is message:
+            del self.pending[message.key]
+        self.depth -= 1
+        self.condition.notify_all()
+
+    def _forget(self, now):
+        for key, sent in list(self.last_sent.items()):
+            if sent < now - self.coalesce_window:
+                del self.last_sent[key]
+
+    def _next(self, now):
+        """
+        :return: The message to send now, else None and the monotonic time one is due (None if empty).
+        """
+        due = None
+        ready = None
+        for chat_id, queue in self.chats.items():
+            chat_due = self.next_send.get(chat_id, now)
+            for message in queue:
+                # A held back repeat does not keep the messages after it waiting
+                at = max(chat_due, message.not_before)
+                if at <= now:
+                    if ready is None or message.queued < ready.queued:
+                        ready = message
+                    break
+                due = at if due is None else min(due, at)
+        return ready, due
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if not self.running:
+                        return
+                    now = time.monotonic()
+                    message, due = self._next(now)
+                    if message is not None:
+                        break
+                    self.condition.wait(None if due is None else due - now)
+                # Later near-duplicates start a new message from here on
+                if self.pending.get(message.key) is message:
+                    del self.pending[message.key]
+                self.sending = message
+            self._send(message)
+
+    def _send(self, message):
+        message.attempts += 1
+        try:
+            status, answer = self._request('sendMessage', message.body())
+        except (urllib3.exceptions.HTTPError, ValueError) as e:
+            status, answer = None, {'description': str(e)}
+        now = time.monotonic()
+        with self.condition:
+            self.sending = None
+            self.next_send[message.chat_id] = now + self.chat_interval
+            if status == 200 and answer.get('ok'):
+                self._remove(message)
+                self.last_sent[message.key] = now
+                if len(self.last_sent) > self.size:
+                    self._forget(now)
+                self.sent += 1
+                self.results['sent'].inc()
+                self.latency.observe(now - message.queued)
+                return
+            if status == 429:
+                # Not counted as an attempt, Telegram says when to try again
+                message.attempts -= 1
+                retry_after = answer.get('parameters', {}).get('retry_after', self.chat_interval)
+                self.next_send[message.chat_id] = now + retry_after
+                self.results['rate_limited'].inc()
+                log.info('Telegram rate limit for chat {0}, waiting {1}s'.format(message.chat_id, retry_after))
+            elif (status is None or status >= 500) and message.attempts < self.retries:
+                message.not_before = now + min(self.backoff * 2 ** (message.attempts - 1), TELEGRAM_MAX_BACKOFF)
+                self.results['retried'].inc()
+            else:
+                self._remove(message)
+                self._dropped(message, answer.get('description', status))
+                return
+            # Retried messages keep merging near-duplicates
+            if message.key not in self.pending:
+                self.pending[message.key] = message
+
+    def _request(self, method, fields):
+        response = self.http.request('POST', self.url + method, body=json.dumps(fields).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+        try:
+            answer = json.loads(response.data.decode('utf-8'))
+        except ValueError:
+            answer = {'ok': False, 'description': 'HTTP {0}'.format(response.status)}
+        return response.status, answer
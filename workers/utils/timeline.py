@@ -0,0 +1,117 @@
+#!/usr/bin python
+from bisect import bisect_right
+from datetime import datetime
+
+STEP_HOLD = 'hold'  # Wait until the temperature is reached, then hold it for the duration
+STEP_RAMP = 'ramp'  # Move the set temperature linearly from the step before, at a rate or over the duration
+STEP_WAIT = 'wait'  # Only wait until the temperature is reached
+STEP_KINDS = [STEP_HOLD, STEP_RAMP, STEP_WAIT]
+
+
+def parse_duration(duration):
+    """
+    :return: Seconds of a "H:MM:SS" string.
+    """
+    t = datetime.strptime(duration, "%H:%M:%S")
+    return float(t.hour * 3600 + t.minute * 60 + t.second)
+
+
+class Step(object):
+    __slots__ = ['kind', 'temperature', 'duration', 'rate', 'start', 'end', 'from_temperature']
+
+    def __init__(self, kind, temperature, duration, rate=0.0, from_temperature=None):
+        self.kind = kind
+        self.temperature = temperature
+        self.duration = duration
+        self.rate = rate  # C per second
+        self.from_temperature = temperature if from_temperature is None else from_temperature
+        self.start = 0.0
+        self.end = 0.0
+
+    @property
+    def gated(self):
+        # The timeline stops at the start of the step until its temperature is reached
+        return self.kind != STEP_RAMP
+
+    def set_point(self, offset):
+        """
+        :param offset: Seconds since the start of the step.
+        """
+        if self.kind != STEP_RAMP or offset >= self.duration:
+            return self.temperature
+        return self.from_temperature + self.rate * max(0.0, offset)
+
+    def __repr__(self):
+        return 'Step({0}, {1}, {2}s at {3})'.format(self.kind, self.temperature, self.duration, self.start)
+
+
+class Timeline(object):
+    """
+    A worker schedule compiled once into steps placed on one time axis. Timeline time only runs
+    while no step waits for its temperature (and the worker is not paused), so the step at any
+    timeline time is a bisect over the step ends.
+
+    Schedule entries are [duration, temperature] for a hold step, or
+    [duration, temperature, kind] and [duration, temperature, "ramp", rate in C per minute].
+    A ramp starts at the temperature of the step before it, so it can not be the first step.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.ends = []
+        offset = 0.0
+        for step in steps:
+            step.start = offset
+            offset += step.duration
+            step.end = offset
+            self.ends.append(offset)
+        self.total = offset
+
+    @classmethod
+    def compile(cls, worker_schedule, scale=1.0):
+        """
+        :param scale: Factor for every duration, i.e. to run a schedule faster in simulation.
+        """
+        steps = []
+        for entry in worker_schedule:
+            duration = parse_duration(entry[0]) * scale
+            temperature = float(entry[1])
+            kind = entry[2] if len(entry) > 2 else STEP_HOLD
+            if kind not in STEP_KINDS:
+                raise ValueError('Unknown schedule step "{0}"'.format(kind))
+            if kind == STEP_WAIT:
+                steps.append(Step(kind, temperature, 0.0))
+            elif kind == STEP_RAMP:
+                if not steps:
+                    raise ValueError('A ramp can not be the first schedule step')
+                start = steps[-1].temperature
+                if len(entry) > 3:
+                    per_minute = float(entry[3])
+                    if per_minute <= 0.0:
+                        raise ValueError('Ramp to {0} needs a positive rate, not {1}'.format(temperature, entry[3]))
+                    duration = abs(temperature - start) / (per_minute / 60.0) * scale
+                rate = (temperature - start) / duration if duration > 0 else 0.0
+                steps.append(Step(kind, temperature, duration, rate, start))
+            else:
+                steps.append(Step(kind, temperature, duration))
+        if not steps:
+            raise ValueError('Empty schedule')
+        return cls(steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def index_at(self, elapsed):
+        """
+        :return: Index of the step running at timeline time elapsed, the last one after the end.
+        """
+        return min(bisect_right(self.ends, elapsed), len(self.steps) - 1)
+
+    def next_gate(self, index):
+        """
+        :return: Index of the first step from index on that waits for its temperature, len(self) if none.
+        """
+        for i in range(index, len(self.steps)):
+            if self.steps[i].gated:
+                return i
+        return len(self.steps)
@@ -0,0 +1,255 @@
+#!/usr/bin python
+"""
+Offline PID tuning: identify the plant of a vessel with a relay test, then search kc/ti/td on the
+simulated plant in parallel for the shortest time to setpoint with the least overshoot.
+
+    python -m workers.utils.tuning --plant plant.json --setpoint 66 --output pid.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import math
+import os
+
+from workers.utils.pid import PID, KC_DEFAULT, TI_DEFAULT, TD_DEFAULT
+from workers.utils.plant import KettlePlant, WATER_HEAT_CAPACITY
+
+log = logging.getLogger(__name__)
+
+TUNING_OVERSHOOT_WEIGHT = 600.0  # Seconds of rise time that one degree of overshoot is worth
+TUNING_DURATION = 3 * 3600.0
+TUNING_SETTLED_BAND = 0.25  # C around the setpoint that counts as settled
+TUNING_RELAY_AMPLITUDE = 50.0  # Half the swing of the relay in PID output units (0..100)
+
+
+def load_pid_params(path):
+    """
+    :return: Dict with kc, ti and td from a file written by save_pid_params, defaults for missing values.
+    """
+    params = {'kc': KC_DEFAULT, 'ti': TI_DEFAULT, 'td': TD_DEFAULT}
+    with open(path) as fo:
+        params.update((key, float(value)) for key, value in json.load(fo).items() if key in params)
+    return params
+
+
+def save_pid_params(path, params):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as fo:
+        json.dump(params, fo, indent=2, sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+def closed_loop(controller, kettle, setpoint, cycle_time, duration=TUNING_DURATION, resolution=0.0, noise=0.0,
+                rng=None):
+    """
+    Runs controller (anything with calculate(measured_value, set_point) returning a duty) on the
+    kettle, one evaluation and one SSR window per cycle_time, the way TemperatureWorker drives it.
+    :param resolution: Probe resolution in C the temperature is rounded to, 0.0 for none.
+    :param noise: Standard deviation in C of gaussian probe noise, drawn from rng (a random.Random).
+    :return: Dict with time_to_setpoint (None if never reached), overshoot, settling_time (after
+             which it stays within TUNING_SETTLED_BAND), hold_rms, the RMS error over the last
+             third of the run, and duty_variation, the mean change of the duty from one cycle to
+             the next over that third (heater chatter).
+    """
+    elapsed = 0.0
+    reached = None
+    settled = 0.0
+    peak = temperature = kettle.temperature
+    hold = []
+    variation = []
+    duty = 0.0
+    while elapsed < duration:
+        measured = temperature + rng.gauss(0.0, noise) if noise else temperature
+        if resolution:
+            measured = round(measured / resolution) * resolution
+        last_duty = duty
+        duty = controller.calculate(measured, setpoint)
+        temperature = kettle.step(duty * cycle_time, cycle_time)
+        elapsed += cycle_time
+        if reached is None and round(temperature, 1) >= setpoint:
+            reached = elapsed
+        if reached is not None and temperature > peak:
+            peak = temperature
+        if abs(temperature - setpoint) > TUNING_SETTLED_BAND:
+            settled = None
+        elif settled is None:
+            settled = elapsed
+        if elapsed >= duration * 2 / 3:
+            hold.append((temperature - setpoint) ** 2)
+            variation.append(abs(duty - last_duty))
+    return {
+        'time_to_setpoint': reached,
+        'overshoot': max(0.0, peak - setpoint),
+        'settling_time': settled,
+        'hold_rms': math.sqrt(sum(hold) / len(hold)) if hold else 0.0,
+        'duty_variation': sum(variation) / len(variation) if variation else 0.0
+    }
+
+
+def simulate(gains, plant, setpoint, cycle_time, initial, duration=TUNING_DURATION):
+    """
+    Runs the PID with gains (kc, ti, td) in closed loop on a KettlePlant built from the plant dict.
+    :return: Dict with time_to_setpoint (None if never reached) and overshoot.
+    """
+    kc, ti, td = gains
+    kettle = KettlePlant(minimum=min(initial, plant.get('ambient', initial)), initial=initial, **plant)
+    pid = PID(None, setpoint, cycle_time, kc=kc, ti=ti, td=td)
+    result = closed_loop(pid, kettle, setpoint, cycle_time, duration)
+    return {'time_to_setpoint': result['time_to_setpoint'], 'overshoot': result['overshoot']}
+
+
+def score(result, duration=TUNING_DURATION):
+    rise = result['time_to_setpoint']
+    if rise is None:
+        rise = 2 * duration
+    return rise + TUNING_OVERSHOOT_WEIGHT * result['overshoot']
+
+
+def _evaluate(job):
+    gains, plant, setpoint, cycle_time, initial, duration = job
+    result = simulate(gains, plant, setpoint, cycle_time, initial, duration)
+    return score(result, duration), gains, result
+
+
+def candidates(kc=KC_DEFAULT, ti=TI_DEFAULT, td=TD_DEFAULT):
+    """
+    Grid of (kc, ti, td) around a starting point, i.e. the Ziegler-Nichols gains of a relay test.
+    """
+    kcs = [kc * factor for factor in [0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0]]
+    tis = [ti * factor for factor in [0.5, 1.0, 2.0, 4.0, 8.0]] + [0.0]
+    tds = [td * factor for factor in [0.0, 0.5, 1.0, 2.0]]
+    return list(itertools.product(kcs, tis, tds))
+
+
+def search(plant, setpoint, cycle_time, initial, gains=None, duration=TUNING_DURATION, processes=None):
+    """
+    Simulates every candidate on a pool of processes, one per core by default.
+    :return: (score, (kc, ti, td), simulation result) of the best candidate.
+    """
+    import multiprocessing  # Only the tuning itself needs it, not a worker loading its PID params
+
+    jobs = [(g, plant, setpoint, cycle_time, initial, duration) for g in (gains or candidates())]
+    # A fresh interpreter per process, forking a worker with running threads could copy held locks
+    pool = multiprocessing.get_context('spawn').Pool(processes)
+    try:
+        results = pool.map(_evaluate, jobs, chunksize=max(1, len(jobs) // (4 * (processes or os.cpu_count() or 1))))
+    finally:
+        pool.close()
+        pool.join()
+    best = min(results, key=lambda result: result[0])
+    log.info('Best of {0} PID candidates: kc={1[0]}, ti={1[1]}, td={1[2]} with {2}'.format(len(jobs), best[1], best[2]))
+    return best
+
+
+class RelayTest(object):
+    """
+    Relay (on/off) feedback test around a setpoint with some hysteresis. Feed it every temperature
+    sample through output(); once done() the oscillation gives the ultimate gain and period, and
+    the heating/cooling slopes and dead time give a plant model for simulate().
+    """
+
+    def __init__(self, setpoint, hysteresis=0.5, cycles=3):
+        self.setpoint = setpoint
+        self.hysteresis = hysteresis
+        self.cycles = cycles
+        self.on = True
+        self.samples = []
+        self.switches = []
+
+    def output(self, timestamp, temperature):
+        """
+        :return: The duty (0.0 or 1.0) for the SSR.
+        """
+        self.samples.append((timestamp, temperature))
+        if self.on and temperature >= self.setpoint + self.hysteresis:
+            self.on = False
+            self.switches.append((timestamp, False))
+        elif not self.on and temperature <= self.setpoint - self.hysteresis:
+            self.on = True
+            self.switches.append((timestamp, True))
+        return 1.0 if self.on else 0.0
+
+    def done(self):
+        # The first switch only ends the heat up, each cycle needs an off and an on switch after it
+        return len(self.switches) >= 2 * self.cycles + 1
+
+    def _phases(self):
+        # (switch time, on, samples until the next switch) for every complete phase
+        phases = []
+        for (start, on), (end, _) in zip(self.switches, self.switches[1:]):
+            phases.append((start, on, [sample for sample in self.samples if start <= sample[0] < end]))
+        return phases
+
+    def identify(self, cycle_time, liters=1.0):
+        """
+        :return: Dict with the ultimate gain ku and period tu, the Ziegler-Nichols gains and a plant
+                 dict (watts scaled to liters) for simulate().
+        """
+        extremes = []
+        dead_times = []
+        slopes = {True: [], False: []}
+        for start, on, samples in self._phases():
+            if not samples:
+                continue
+            pick = min if on else max
+            extreme_time, extreme = pick(samples, key=lambda sample: sample[1])
+            extremes.append(extreme)
+            dead_times.append(extreme_time - start)
+            end_time, end_temperature = samples[-1]
+            if end_time > extreme_time:
+                slopes[on].append((end_temperature - extreme) / (end_time - extreme_time))
+        amplitude = sum(abs(a - b) for a, b in zip(extremes, extremes[1:])) / (2.0 * max(1, len(extremes) - 1))
+        offs = [timestamp for timestamp, on in self.switches[1:] if not on]
+        tu = (offs[-1] - offs[0]) / (len(offs) - 1) if len(offs) > 1 else 0.0
+        ku = 4.0 * TUNING_RELAY_AMPLITUDE / (math.pi * amplitude) if amplitude > 0 else 0.0
+        cooling = max(0.0, -sum(slopes[False]) / max(1, len(slopes[False])))
+        heating = sum(slopes[True]) / max(1, len(slopes[True])) + cooling
+        dead_time = sum(dead_times) / max(1, len(dead_times))
+        return {
+            'ku': ku,
+            'tu': tu,
+            'gains': {'kc': 0.6 * ku, 'ti': tu / 2.0, 'td': tu / 8.0},
+            'plant': {
+                'watts': heating * WATER_HEAT_CAPACITY * liters,
+                'liters': liters,
+                'cooling': cooling,
+                'delay': int(round(dead_time / cycle_time))
+            }
+        }
+
+
+def tune(plant, setpoint, cycle_time, initial, output, start=None, processes=None):
+    """
+    Searches around start (or the defaults) and writes the best gains to output for
+    TemperatureWorker to load at startup (PID_PARAMS_FILE).
+    """
+    start = start or {'kc': KC_DEFAULT, 'ti': TI_DEFAULT, 'td': TD_DEFAULT}
+    best_score, (kc, ti, td), result = search(plant, setpoint, cycle_time, initial,
+                                              candidates(start['kc'], start['ti'], start['td']),
+                                              processes=processes)
+    params = {'kc': kc, 'ti': ti, 'td': td,
+              'time_to_setpoint': result['time_to_setpoint'], 'overshoot': result['overshoot']}
+    save_pid_params(output, params)
+    return params
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--plant', required=True, help='JSON file with a plant or a full relay test identification')
+    parser.add_argument('--setpoint', type=float, default=66.0)
+    parser.add_argument('--initial', type=float, default=20.0)
+    parser.add_argument('--cycle-time', type=float, default=10.0)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--output', default='pid.json')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    with open(args.plant) as fo:
+        identification = json.load(fo)
+    plant = identification.get('plant', identification)
+    print(json.dumps(tune(plant, args.setpoint, args.cycle_time, args.initial, args.output,
+                          identification.get('gains'), args.processes), indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()